@@ -0,0 +1,279 @@
+"""
+Headless HTTP service: the reconciliation sheets and Recon rows as JSON
+or Arrow, for tools that cannot drive the app.
+
+    python api.py reference.xlsx --port 8080
+
+    GET /health
+    GET /sheets?start=2024-04-01&end=2024-04-30[&partition=Fab BV, B2C order]
+    GET /sheets/<sheet>?start=...&end=...[&partition=...][&offset=0][&limit=1000][&format=json]
+    GET /recon?start=...&end=...          (same as /sheets/Recon)
+
+``format`` is ``json`` (rows as records, dates in ISO 8601) or ``arrow``
+(an Arrow IPC stream, needs pyarrow; the paging is in the X-Total-Count
+and X-Next-Offset headers). Results stay warm in memory across
+requests for as long as the output cache would trust them, and fetched
+pages are checkpointed (utils.checkpoints), so asking for another sheet
+or page of the same period does not fetch again.
+
+Settings (ITSP_*, SHOPIFY_*) come from the environment or
+.streamlit/secrets.toml, see utils/config.py; pointing the URLs at
+stand-in backends runs it locally.
+"""
+import argparse
+import json
+import sys
+import threading
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, unquote, urlsplit
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+MAX_ENTRIES = 8
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="E-commerce reconciliation API")
+    parser.add_argument("reference", help="reference Excel with the Backend and Old ITSP sheets")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--engine", choices=["pandas", "duckdb"], default="pandas")
+    parser.add_argument("--shopify-summary", dest="shopify_profile", action="store_const",
+                        const="summary", default="detail",
+                        help="fetch only the per-order Shopify totals the Recon needs")
+    parser.add_argument("--max-entries", type=int, default=MAX_ENTRIES,
+                        help="periods and partitions kept in memory")
+    return parser.parse_args(argv)
+
+
+# --------------------------------------------------
+# Warm results
+# --------------------------------------------------
+class FrameCache:
+    """
+    ``compute(start_date, end_date, partition)`` results, least recently
+    used dropped first. Concurrent requests for the same key wait for
+    one computation.
+    """
+
+    def __init__(self, compute, max_entries=MAX_ENTRIES):
+        self.compute = compute
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, start_date, end_date, partition):
+        from utils.output_cache import source_version
+
+        key = (start_date, end_date, partition, source_version(start_date, end_date))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            pending = self._pending.setdefault(key, threading.Lock())
+
+        with pending:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key]
+            try:
+                value = self.compute(start_date, end_date, partition)
+                with self._lock:
+                    self._entries[key] = value
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+        return value
+
+
+# --------------------------------------------------
+# Request handling
+# --------------------------------------------------
+class NotFound(KeyError):
+    pass
+
+
+def _query(params, name, default=None):
+    values = params.get(name)
+    return values[0] if values else default
+
+
+def _period(params):
+    try:
+        start_date = date.fromisoformat(_query(params, "start", ""))
+        end_date = date.fromisoformat(_query(params, "end", ""))
+    except ValueError:
+        raise ValueError("start and end are required, as YYYY-MM-DD") from None
+    if end_date < start_date:
+        raise ValueError("end is before start")
+    return start_date, end_date
+
+
+def _partition(params):
+    from utils.partitions import DEFAULT_PARTITION, parse_partitions
+
+    partitions = parse_partitions(_query(params, "partition", ""))
+    if len(partitions) > 1:
+        raise ValueError("Ask for one partition at a time")
+    return partitions[0] if partitions else DEFAULT_PARTITION
+
+
+def _page_bounds(params):
+    try:
+        offset = int(_query(params, "offset", 0))
+        limit = int(_query(params, "limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("offset and limit must be integers") from None
+    if offset < 0 or not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f"offset must be >= 0 and limit between 1 and {MAX_LIMIT}")
+    return offset, limit
+
+
+def _json_rows(df):
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+def _arrow_stream(df):
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ValueError("format=arrow needs pyarrow (pip install pyarrow)") from e
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # Mixed columns (e.g. Old ITSP dates: text from the reference,
+        # timestamps for the new orders) go as text
+        mixed = {col: "string" for col in df.columns if df[col].dtype == object}
+        table = pa.Table.from_pandas(df.astype(mixed), preserve_index=False)
+    sink = BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    cache = None  # FrameCache, set by serve()
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        path = unquote(url.path).rstrip("/")
+        try:
+            if path == "/health":
+                return self._send(200, {"status": "ok"})
+            if path == "/sheets":
+                return self._sheet_list(params)
+            if path == "/recon":
+                return self._sheet("Recon", params)
+            if path.startswith("/sheets/"):
+                return self._sheet(path[len("/sheets/"):], params)
+            raise NotFound(f"No such path: {path}")
+        except NotFound as e:
+            self._send(404, {"error": e.args[0]})
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self.log_error("%s failed: %r", self.path, e)
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _frames(self, params):
+        start_date, end_date = _period(params)
+        partition = _partition(params)
+        sheets, recon_df = self.cache.get(start_date, end_date, partition)
+        return partition, {**sheets, "Recon": recon_df.reset_index(drop=True)}
+
+    def _sheet_list(self, params):
+        from utils.partitions import partition_label
+
+        partition, frames = self._frames(params)
+        self._send(200, {
+            "partition": partition_label(partition),
+            "sheets": {sheet: len(df) for sheet, df in frames.items()},
+        })
+
+    def _sheet(self, sheet, params):
+        from utils.partitions import partition_label
+
+        fmt = _query(params, "format", "json")
+        if fmt not in ("json", "arrow"):
+            raise ValueError("format must be json or arrow")
+        offset, limit = _page_bounds(params)
+        partition, frames = self._frames(params)
+        if sheet not in frames:
+            raise NotFound(f"No sheet {sheet!r}, there are {sorted(frames)}")
+
+        df = frames[sheet]
+        page = df.iloc[offset:offset + limit]
+        next_offset = offset + limit if offset + limit < len(df) else None
+        if fmt == "arrow":
+            headers = {"X-Total-Count": len(df)}
+            if next_offset is not None:
+                headers["X-Next-Offset"] = next_offset
+            return self._send(200, _arrow_stream(page), ARROW_STREAM, headers)
+
+        self._send(200, {
+            "sheet": sheet,
+            "partition": partition_label(partition),
+            "offset": offset,
+            "limit": limit,
+            "total": len(df),
+            "next_offset": next_offset,
+            "columns": list(page.columns),
+            "rows": _json_rows(page),
+        })
+
+
+def serve(reference, host="127.0.0.1", port=8080, engine="pandas", shopify_profile="detail",
+          max_entries=MAX_ENTRIES):
+    from services.generation import generate_frames, generate_frames_lazy
+
+    frames = generate_frames_lazy if engine == "duckdb" else generate_frames
+
+    def compute(start_date, end_date, partition):
+        results = frames(start_date, end_date, reference, [partition], shopify_profile)
+        return results[partition]
+
+    Handler.cache = FrameCache(compute, max_entries)
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving on http://{host}:{server.server_address[1]}")
+    return server
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.reference, "rb") as f:
+        reference = f.read()
+
+    server = serve(reference, args.host, args.port, args.engine, args.shopify_profile,
+                   args.max_entries)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
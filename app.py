@@ -1,133 +1,246 @@
-import streamlit as st
-import pandas as pd
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import time
-
-from services.shopify_service import fetch_shopify_reports
-from services.itsperfect_returns import fetch_returns
-from services.itsperfect_sales import fetch_sales_orders
-from utils.excel import export_to_excel
-
-def load_reference_sheet(path, sheet_name):
-    return pd.read_excel(path, sheet_name=sheet_name, dtype=str)
-
-st.title("E-commerce Reconciliation Export")
-
-today = datetime.today()
-first = today.replace(day=1)
-last = (first + relativedelta(months=1)) - relativedelta(days=1)
-
-date_range = st.date_input(
-    "Date range",
-    value=(first, last)
-)
-
-reference_excel = st.file_uploader(
-    label="Upload reference Excel",
-    type="xlsx"
-)
-
-if isinstance(date_range, tuple) and len(date_range) == 2:
-    start_date, end_date = date_range
-else:
-    start_date, end_date = None, None
-
-if reference_excel is None:
-    st.info("Please upload the reference Excel to enable the Generate button.")
-else:
-    if st.button("Generate Excel"):
-        with st.spinner("In progress..."):
-            status_text = st.empty()
-    
-            report_index = 0
-            t0 = time.perf_counter()
-            shopify_dfs = fetch_shopify_reports(start_date=start_date.strftime("%Y-%m-%d"), 
-                                            end_date=end_date.strftime("%Y-%m-%d"))
-            t1 = time.perf_counter()
-            returns_df = fetch_returns(
-                f"{start_date} 00:00:00",
-                f"{end_date} 23:59:59"
-            )
-            t2 = time.perf_counter()
-            sales_df = fetch_sales_orders(
-                f"{start_date} 00:00:00",
-                f"{end_date} 23:59:59"
-            )
-            t3 = time.perf_counter()
-    
-            sales_df_copy = sales_df.copy()
-            sales_df_copy["VAT %"] = (
-                sales_df_copy["VAT value"]
-                .astype(str).str.replace(",", ".", regex=False)
-                .pipe(pd.to_numeric, errors="coerce")
-                .div(
-                    sales_df_copy["Shipping costs"]
-                    .astype(str).str.replace(",", ".", regex=False)
-                    .pipe(pd.to_numeric, errors="coerce")
-                    +
-                    sales_df_copy["Amount"]
-                    .astype(str).str.replace(",", ".", regex=False)
-                    .pipe(pd.to_numeric, errors="coerce")
-                )
-                .replace([float("inf"), -float("inf")], 0)
-                .fillna(0)
-            )
-    
-            t4 = time.perf_counter()
-            backend_df = load_reference_sheet(reference_excel, "Backend")
-            t5 = time.perf_counter()
-            old_itsp_df = load_reference_sheet(reference_excel, "Old ITSP")
-            t6 = time.perf_counter()
-    
-            KEY_COL = "Order no."
-            existing_orders = set(old_itsp_df[KEY_COL].dropna().astype(str))
-            sales_df_copy[KEY_COL] = sales_df_copy[KEY_COL].astype(str)
-
-            new_sales_rows = sales_df_copy[
-                ~sales_df_copy[KEY_COL].isin(existing_orders)
-            ]
-            del sales_df_copy
-            new_sales_rows["Marketplace > Channel"] = None
-            new_sales_rows = new_sales_rows[old_itsp_df.columns]
-    
-            old_itsp_combined = pd.concat(
-                [old_itsp_df, new_sales_rows],
-                ignore_index=True
-            )
-    
-            sheets = {
-                **shopify_dfs,
-                "ITSP Sales": sales_df,
-                "ITSP Returns": returns_df,
-                "Old ITSP": old_itsp_combined,
-                "Backend": backend_df,
-            }
-            t7 = time.perf_counter()
-            output = export_to_excel(sheets)
-            t8 = time.perf_counter()
-    
-            # st.info(
-            #     f"""
-            #     Shopify fetch: {t1 - t0:.2f}s  
-            #     Returns fetch: {t2 - t1:.2f}s  
-            #     Sales fetch: {t3 - t2:.2f}s  
-            #     Excel export: {t4 - t3:.2f}s  
-            #     Backend fetch: {t5 - t4:.2f}s
-            #     Old ITSP fetch: {t6 - t5:.2f}s
-            #     Combine sheets: {t7 - t6:.2f}s
-            #     Excel export: {t8 - t7:.2f}s
-            #     **Total:** {t8 - t0:.2f}s
-            #     """
-            # )
-        st.download_button(
-            "Download Excel",
-            output,
-            file_name="ecom_recon.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    
-        )
-
-
-
-
+import streamlit as st
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import time
+
+from services.estimate import estimate_run
+from services.generation import generate, generate_lazy
+from services.preview import preview_totals, reconciles
+from utils.checkpoints import clear_checkpoints
+from utils.output_cache import load_outputs, output_key, store_outputs
+from utils.planner import take_run_metrics
+from utils.profiler import RunProfiler
+from utils.partitions import DEFAULT_PARTITION, parse_partitions, partition_filename, partition_label
+
+AUTO_ENGINE = "Auto (from the run estimate)"
+PANDAS_ENGINE = "pandas (in memory)"
+LAZY_ENGINE = "DuckDB (out of core)"
+ENGINES = {"pandas": PANDAS_ENGINE, "duckdb": LAZY_ENGINE}
+
+st.title("E-commerce Reconciliation Export")
+
+today = datetime.today()
+first = today.replace(day=1)
+last = (first + relativedelta(months=1)) - relativedelta(days=1)
+
+date_range = st.date_input(
+    "Date range",
+    value=(first, last)
+)
+
+partitions_text = st.text_area(
+    "Partitions (one per line: Subsidiary, Channel[, Marketplace])",
+    value=", ".join(p for p in DEFAULT_PARTITION if p),
+)
+
+engine = st.radio(
+    "Engine",
+    [AUTO_ENGINE, PANDAS_ENGINE, LAZY_ENGINE],
+    horizontal=True,
+    help="The out-of-core engine keeps memory bounded on multi-month and yearly ranges. "
+         "Auto picks the out-of-core engine when the run estimate says the period would "
+         "not fit in memory, and pandas until the run is estimated.",
+)
+
+incremental = st.checkbox(
+    "Incremental recon",
+    help="Only recompute the Recon rows of orders that changed since the last run "
+         "for this period, and add a Changes sheet.",
+)
+
+patch_reference = st.checkbox(
+    "Update the reference workbook",
+    help="Add this period's sheets to the uploaded workbook and append only the new "
+         "orders to its Old ITSP, instead of writing Backend and Old ITSP again.",
+)
+
+line_level = st.checkbox(
+    "Shopify line-level sheets",
+    value=True,
+    help="Untick to fetch only the per-order Shopify totals and tax rates the Recon "
+         "needs, without the Shopify incl. returns and Shopify Tax sheets. Much "
+         "faster on busy months.",
+)
+shopify_profile = "detail" if line_level else "summary"
+
+refresh = st.checkbox(
+    "Refresh",
+    help="Generate again even if this period was already generated with the same "
+         "reference and the source data has not changed since, fetching every page "
+         "again.",
+)
+
+profile = st.checkbox(
+    "Profile this run",
+    help="Sample where the time goes and which lines allocate the most memory, "
+         "per stage. Makes the run slower; always regenerates.",
+)
+
+reference_excel = st.file_uploader(
+    label="Upload reference Excel",
+    type="xlsx"
+)
+
+if isinstance(date_range, tuple) and len(date_range) == 2:
+    start_date, end_date = date_range
+else:
+    start_date, end_date = None, None
+
+partitions = parse_partitions(partitions_text) or [DEFAULT_PARTITION]
+
+# -------------------
+# Run estimate: how big is the period, and how will it run?
+# -------------------
+# Counted on request, or under Auto when the date range is changed, not
+# on every page load
+estimate_key = (start_date, end_date, shopify_profile)
+estimate = st.session_state.get("estimate")
+if estimate is not None and estimate[0] != estimate_key:
+    estimate = None
+range_changed = st.session_state.get("estimate_range", (start_date, end_date)) != (start_date, end_date)
+st.session_state["estimate_range"] = (start_date, end_date)
+if end_date is not None and estimate is None and (
+    (engine == AUTO_ENGINE and range_changed)
+    or st.button("Estimate the run", help="Count the period's rows and plan the fetch, in a few requests.")
+):
+    with st.spinner("Counting the period..."):
+        try:
+            estimate = (estimate_key, estimate_run(start_date, end_date, shopify_profile))
+        except Exception as e:
+            st.warning(f"Could not estimate the run ({e}), Auto uses the pandas engine.")
+        else:
+            st.session_state["estimate"] = estimate
+
+if engine == AUTO_ENGINE:
+    engine = ENGINES[estimate[1].engine] if estimate is not None else PANDAS_ENGINE
+if estimate is not None:
+    run_estimate = estimate[1]
+    with st.expander(
+        f"Run plan: {run_estimate.sources['Rows'].sum():,} rows, about {run_estimate.seconds:.0f}s "
+        f"with the {ENGINES[run_estimate.engine]} engine"
+    ):
+        st.dataframe(run_estimate.sources, hide_index=True)
+        st.caption(f"Fetching takes about {run_estimate.fetch_seconds:.0f}s of it.")
+    for note in run_estimate.notes:
+        st.warning(note)
+
+# -------------------
+# Totals preview: does the period reconcile at all?
+# -------------------
+preview_key = (start_date, end_date, tuple(partitions))
+if end_date is not None and st.button(
+    "Preview totals",
+    help="ITSP and Shopify totals of the period in a few seconds, before the full export. "
+         "ITSP returns are estimated with the period's average VAT and without the original "
+         "order's shipping. Shopify is compared with the default partition only.",
+):
+    with st.spinner("Summing the period..."):
+        try:
+            st.session_state["preview"] = (preview_key, preview_totals(start_date, end_date, partitions))
+        except Exception as e:
+            st.warning(f"Could not preview the totals ({e}), the full export still runs.")
+
+run_full_export = False
+preview = st.session_state.get("preview")
+if preview is not None and preview[0] == preview_key:
+    preview_df = preview[1]
+    st.dataframe(preview_df, hide_index=True)
+    if preview_df["Delta"].isna().all():
+        st.info("Shopify is only compared with the default partition, which is not selected.")
+    elif reconciles(preview_df):
+        st.success("ITSP and Shopify totals match for this period.")
+    else:
+        st.warning("ITSP and Shopify totals differ, the full export shows which orders.")
+        if reference_excel is not None:
+            run_full_export = st.button("Run the full export")
+
+if reference_excel is None:
+    st.info("Please upload the reference Excel to enable the Generate button.")
+else:
+    reference = reference_excel.getvalue()
+    cache_key = None
+    if end_date is not None:
+        cache_key = output_key(
+            start_date, end_date, reference, partitions, engine, incremental, patch_reference,
+            shopify_profile,
+        )
+    # Reruns (e.g. after a download) serve what was already generated
+    cached = None if refresh or profile or cache_key is None else load_outputs(cache_key)
+
+    generate_clicked = st.button("Generate Excel")
+    if (generate_clicked or run_full_export) and cached is None:
+        outputs = {}
+        match_reports = {}
+        with st.spinner("In progress..."):
+            status_text = st.empty()
+    
+            report_index = 0
+            t0 = time.perf_counter()
+
+            if refresh:
+                clear_checkpoints()
+            # See services.generation for what runs when
+            run = generate_lazy if engine == LAZY_ENGINE else generate
+            profiler = RunProfiler() if profile else None
+            run_args = (
+                start_date, end_date, reference, partitions, incremental, patch_reference,
+                shopify_profile,
+            )
+            if profiler is None:
+                outputs, match_reports, timeline = run(*run_args)
+            else:
+                with profiler:
+                    outputs, match_reports, timeline = run(*run_args, profiler=profiler)
+            cached = store_outputs(cache_key, outputs, match_reports)
+            t3 = time.perf_counter()
+    
+            if timeline is not None:
+                with st.expander(f"Timeline ({t3 - t0:.2f}s)"):
+                    st.dataframe(timeline, hide_index=True)
+            fetch_plans = take_run_metrics()
+            if not fetch_plans.empty:
+                with st.expander("Page sizes and concurrency"):
+                    st.dataframe(fetch_plans, hide_index=True)
+            if profiler is not None:
+                with st.expander(f"Profile (peak traced memory {profiler.peak_bytes / 2**20:.0f} MiB)"):
+                    allocations = profiler.allocations()
+                    st.dataframe(allocations, hide_index=True)
+                    st.download_button(
+                        "Download flamegraph stacks",
+                        profiler.folded(),
+                        file_name="profile.folded",
+                        mime="text/plain",
+                        help="Folded stacks, for flamegraph.pl or speedscope.app",
+                    )
+                    st.download_button(
+                        "Download top allocators",
+                        allocations.to_csv(index=False),
+                        file_name="allocations.csv",
+                        mime="text/csv",
+                    )
+
+            # st.info(
+            #     f"""
+            #     Reference load: {t1 - t0:.2f}s  
+            #     Fetch + transform: {t2 - t1:.2f}s  
+            #     Combine + Excel export: {t3 - t2:.2f}s
+            #     **Total:** {t3 - t0:.2f}s
+            #     """
+            # )
+    elif cached is not None:
+        st.caption("Already generated for this period, reference and source data (tick Refresh to regenerate).")
+
+    for partition, (path, match_report) in (cached or {}).items():
+        if match_report is not None:
+            st.caption(f"Order matching ({partition_label(partition)})")
+            st.dataframe(match_report, hide_index=True)
+        file_name = partition_filename(partition)
+        # st.download_button reads the whole file into memory, it cannot stream it
+        with open(path, "rb") as f:
+            st.download_button(
+                f"Download Excel ({partition_label(partition)})",
+                f,
+                file_name=file_name,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key=f"download_{file_name}",
+            )
@@ -0,0 +1,122 @@
+"""
+Batch entry point: build the reconciliation workbooks without the app.
+
+    python cli.py 2024-04-01 2024-04-30 reference.xlsx --out exports/
+
+Settings (ITSP_*, SHOPIFY_*) come from the environment or
+.streamlit/secrets.toml, see utils/config.py.
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+from datetime import date
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="E-commerce reconciliation export")
+    parser.add_argument("start_date", type=date.fromisoformat)
+    parser.add_argument("end_date", type=date.fromisoformat)
+    parser.add_argument("reference", help="reference Excel with the Backend and Old ITSP sheets")
+    parser.add_argument("--partition", action="append", default=[],
+                        help='"Subsidiary, Channel[, Marketplace]", can be repeated')
+    parser.add_argument("--engine", choices=["auto", "pandas", "duckdb"], default="auto",
+                        help="auto counts the period's rows first and picks duckdb when "
+                             "they would not fit in memory")
+    parser.add_argument("--plan", action="store_true",
+                        help="print the run estimate (rows, fetch plan, runtime) and stop")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse the Recon of the previous run for this period")
+    parser.add_argument("--patch-reference", action="store_true",
+                        help="add the period sheets to the reference workbook instead of "
+                             "writing Backend and Old ITSP again")
+    parser.add_argument("--shopify-summary", dest="shopify_profile", action="store_const",
+                        const="summary", default="detail",
+                        help="fetch only the per-order Shopify totals the Recon needs and leave "
+                             "out the Shopify incl. returns and Shopify Tax sheets")
+    parser.add_argument("--hedge", action="store_true",
+                        help="request pages again when they are much slower than the others "
+                             "(same as RECON_HEDGE=1)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="generate again even if the output cache has this run, "
+                             "without reusing checkpointed pages")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="profile the run (implies --refresh) and write "
+                             "profile.folded and allocations.csv to DIR")
+    parser.add_argument("--out", default=".", help="output directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from services.generation import generate, generate_lazy
+    from utils.checkpoints import clear_checkpoints
+    from utils.config import configure
+    from utils.output_cache import load_outputs, output_key, store_outputs
+    from utils.partitions import DEFAULT_PARTITION, parse_partitions, partition_filename
+
+    partitions = parse_partitions("\n".join(args.partition)) or [DEFAULT_PARTITION]
+    with open(args.reference, "rb") as f:
+        reference = f.read()
+
+    if args.refresh:
+        clear_checkpoints()
+    if args.hedge:
+        configure(RECON_HEDGE="1")
+
+    t0 = time.perf_counter()
+    if args.engine == "auto" or args.plan:
+        from services.estimate import estimate_run
+
+        estimate = estimate_run(args.start_date, args.end_date, args.shopify_profile)
+        print(estimate.sources.to_string(index=False))
+        for note in estimate.notes:
+            print(note)
+        print(f"Engine: {estimate.engine}, about {estimate.seconds:.0f}s "
+              f"({estimate.fetch_seconds:.0f}s fetching)")
+        if args.plan:
+            return 0
+        if args.engine == "auto":
+            args.engine = estimate.engine
+
+    key = output_key(
+        args.start_date, args.end_date, reference, partitions, args.engine, args.incremental,
+        args.patch_reference, args.shopify_profile,
+    )
+    cached = None if args.refresh or args.profile else load_outputs(key)
+    timeline = None
+    if cached is None:
+        run = generate_lazy if args.engine == "duckdb" else generate
+        run_args = (
+            args.start_date, args.end_date, reference, partitions, args.incremental, args.patch_reference,
+            args.shopify_profile,
+        )
+        if args.profile:
+            from utils.profiler import RunProfiler
+
+            with RunProfiler() as profiler:
+                outputs, match_reports, timeline = run(*run_args, profiler=profiler)
+            for path in profiler.write(args.profile):
+                print(path)
+        else:
+            outputs, match_reports, timeline = run(*run_args)
+        cached = store_outputs(key, outputs, match_reports)
+    else:
+        print("From the output cache")
+
+    os.makedirs(args.out, exist_ok=True)
+    for partition, (cached_path, _) in cached.items():
+        path = os.path.join(args.out, partition_filename(partition))
+        shutil.copyfile(cached_path, path)
+        print(path)
+
+    if timeline is not None:
+        print(timeline.to_string(index=False))
+    print(f"Total: {time.perf_counter() - t0:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
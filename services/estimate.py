@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import importlib.util
+import math
+import os
+from collections import namedtuple
+
+from services.itsperfect_returns import returns_url
+from services.itsperfect_sales import sales_orders_url
+from services.shopify_service import SHOPIFY_REPORTS, SUMMARY_SHEETS, shopify_post, shopify_stores
+from utils.auth import get_itsperfect_token
+from utils.helpers import lazy_import
+from utils.pagination import count_rows
+from utils.pipeline import Stage, run_stages
+from utils.planner import PagePlan, itsp_endpoint, load_plans, shopify_endpoint
+
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Run estimate
+#
+# Before anything is fetched, how big is the period? ITSP tells its row
+# count through the page count of a one-row page, Shopify through one
+# aggregate query per store (orders, and units for the line-level
+# sheets). Each pull is then sized with what utils.planner remembers of
+# its endpoint (page size, pages in flight, seconds per page, bytes per
+# row), which gives the fetch time and the memory the frames would take.
+# Periods that would not fit the memory budget go to the out-of-core
+# engine.
+#
+# The numbers are rough: Shopify line-level rows are taken as one per
+# unit sold, and an endpoint never fetched before gets the defaults.
+# --------------------------------------------------
+ESTIMATE_COLUMNS = ["Source", "Rows", "Page size", "Workers", "Pages", "Fetch (s)", "Memory (MiB)"]
+
+RunEstimate = namedtuple("RunEstimate", ["sources", "engine", "fetch_seconds", "seconds", "notes"])
+
+# Names of the shopify_stores(), in order
+STORES = ["live", "archive"]
+
+# Shopify sheet -> the ShopifyQL dataset it reads (see the planner endpoints)
+SHOPIFY_DATASETS = {
+    "Shopify payments": "payments",
+    "Shopify incl. returns": "sales",
+    "Shopify Tax": "sales_taxes",
+}
+
+# Used for endpoints the planner has not seen yet
+DEFAULT_PAGE_SECONDS = 1.0
+DEFAULT_BYTES_PER_ROW = 1000
+
+# A row held in a DataFrame takes about this many times its JSON size
+FRAME_BYTES_PER_JSON_BYTE = 2
+
+# The pandas engine gets this share of physical memory, DEFAULT_MEMORY_BUDGET
+# where that cannot be read
+PANDAS_MEMORY_SHARE = 0.25
+DEFAULT_MEMORY_BUDGET = 2 * 2**30
+
+# Transform, Recon and workbook throughput after the fetch, per engine
+ROWS_PER_SECOND = {"pandas": 20_000, "duckdb": 10_000}
+
+EXCEL_MAX_ROWS = 1_048_576
+
+
+def memory_budget():
+    try:
+        return PANDAS_MEMORY_SHARE * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return DEFAULT_MEMORY_BUDGET
+
+
+def count_itsp(url):
+    return count_rows(url, {"Authorization": f"Bearer {get_itsperfect_token()}"})
+
+
+def count_shopify(start_date, end_date, access_token, graphql_url):
+    """``(orders, units)`` of one store over the period."""
+    query = """
+    query {{
+        shopifyqlQuery(
+            query: "
+            FROM sales
+            SHOW orders, quantity_ordered
+            SINCE {start_date} UNTIL {end_date}
+            "
+        ) {{
+            tableData {{
+                columns {{ name }}
+                rows
+            }}
+            parseErrors
+        }}
+    }}
+    """.format(start_date=start_date, end_date=end_date)
+
+    data, _ = shopify_post(query, access_token, graphql_url)
+    rows = data["data"]["shopifyqlQuery"]["tableData"].get("rows", [])
+    if not rows:
+        return 0, 0
+    return int(float(rows[0].get("orders") or 0)), abs(int(float(rows[0].get("quantity_ordered") or 0)))
+
+
+def pull_plan(endpoint, client, rows):
+    """How one pull of ``rows`` rows would go, from what the planner remembers."""
+    plan = PagePlan(endpoint, client)
+    remembered = load_plans().get(endpoint, {})
+    pages = max(1, math.ceil(rows / plan.limit))
+    workers = max(1, min(plan.workers, pages))
+    page_seconds = remembered.get("seconds_per_page") or DEFAULT_PAGE_SECONDS
+    bytes_per_row = remembered.get("bytes_per_row") or DEFAULT_BYTES_PER_ROW
+    return {
+        "Rows": rows,
+        "Page size": plan.limit,
+        "Workers": workers,
+        "Pages": pages,
+        # The first page goes alone, the rest ``workers`` at a time
+        "Fetch (s)": round(page_seconds * (1 + math.ceil((pages - 1) / workers)), 1),
+        "Memory (MiB)": round(rows * bytes_per_row * FRAME_BYTES_PER_JSON_BYTE / 2**20, 1),
+    }
+
+
+def choose_engine(memory_bytes):
+    """``"pandas"``, or ``"duckdb"`` when the frames would not fit the budget and it is installed."""
+    if memory_bytes <= memory_budget():
+        return "pandas"
+    if importlib.util.find_spec("duckdb") is None or importlib.util.find_spec("pyarrow") is None:
+        return "pandas"
+    return "duckdb"
+
+
+def estimate_run(start_date, end_date, shopify_profile="detail") -> RunEstimate:
+    """Rows, fetch plan and runtime of generating the period, and the engine to use."""
+    date_from = f"{start_date} 00:00:00"
+    date_to = f"{end_date} 23:59:59"
+    shop_from = start_date.strftime("%Y-%m-%d")
+    shop_to = end_date.strftime("%Y-%m-%d")
+    stores = dict(zip(STORES, shopify_stores()))
+    itsp_urls = {
+        "ITSP Sales": sales_orders_url(date_from, date_to),
+        "ITSP Returns": returns_url(date_from, date_to),
+    }
+
+    stages = [Stage(source, lambda url=url: count_itsp(url)) for source, url in itsp_urls.items()]
+    for store, (token, graphql_url) in stores.items():
+        stages.append(Stage(store, lambda t=token, u=graphql_url: count_shopify(
+            shop_from, shop_to, t, u
+        )))
+    counts, _ = run_stages(stages)
+
+    rows = []
+    for source, url in itsp_urls.items():
+        rows.append({"Source": source, **pull_plan(itsp_endpoint(url), "itsp", counts[source])})
+
+    # Shopify stages fetch the stores one after the other
+    stage_seconds = [row["Fetch (s)"] for row in rows]
+    sheet_rows = {row["Source"]: row["Rows"] for row in rows}
+    for sheet in SHOPIFY_REPORTS:
+        seconds = 0.0
+        sheet_rows[sheet] = 0
+        for store, (_, graphql_url) in stores.items():
+            orders, units = counts[store]
+            # The summary profile still pulls tax per line (see fetch_shopify_order_tax)
+            line_level = sheet == "Shopify Tax" or (
+                shopify_profile == "detail" and sheet != "Shopify payments"
+            )
+            endpoint = shopify_endpoint(graphql_url, f"FROM {SHOPIFY_DATASETS[sheet]}")
+            row = pull_plan(endpoint, "shopify", max(orders, units) if line_level else orders)
+            rows.append({"Source": f"{sheet} ({store})", **row})
+            seconds += row["Fetch (s)"]
+            sheet_rows[sheet] += row["Rows"]
+        stage_seconds.append(seconds)
+    sources = pd.DataFrame(rows, columns=ESTIMATE_COLUMNS)
+
+    memory = sources["Memory (MiB)"].sum() * 2**20
+    engine = choose_engine(memory)
+    fetch_seconds = max(stage_seconds)
+    seconds = fetch_seconds + sources["Rows"].sum() / ROWS_PER_SECOND[engine]
+
+    notes = []
+    if engine == "duckdb":
+        notes.append(
+            f"About {memory / 2**30:.1f} GiB in frames, over the {memory_budget() / 2**30:.1f} GiB "
+            "budget of the pandas engine: the out-of-core engine is used."
+        )
+    elif memory > memory_budget():
+        notes.append("The period may not fit in memory, and duckdb/pyarrow are not installed.")
+    for sheet, count in sheet_rows.items():
+        if count >= EXCEL_MAX_ROWS and not (shopify_profile == "summary" and sheet in SUMMARY_SHEETS):
+            notes.append(f"{sheet}: about {count:,} rows, more than an Excel sheet holds.")
+    return RunEstimate(sources, engine, round(fetch_seconds, 1), round(seconds, 1), notes)
@@ -0,0 +1,294 @@
+from io import BytesIO
+
+from services.shopify_service import SHOPIFY_REPORTS, SUMMARY_SHEETS, fetch_shopify_report, workbook_sheets
+from services.itsperfect_returns import fetch_returns_partitioned
+from services.itsperfect_sales import fetch_sales_orders_partitioned
+from utils.excel import export_to_excel
+from utils.lazy_engine import run_lazy, write_lazy
+from utils.order_keys import build_order_indexes, match_report
+from utils.partitions import partition_label
+from utils.pipeline import Stage, run_stages
+from utils.recon import build_recon_frame
+from utils.recon_state import incremental_recon, state_key
+from utils.schema import apply_schema
+from utils.xlsx_patch import APPENDED_SHEET, KEPT_SHEETS, patch_reference, patch_workbook, reference_styles
+from utils.xlsx_writer import assemble_workbook, serialize_sheet
+from utils.helpers import lazy_import
+
+pd = lazy_import("pandas")
+
+REFERENCE_SHEETS = ["Backend", "Old ITSP"]
+
+
+def load_reference_sheet(path, sheet_name):
+    df = pd.read_excel(path, sheet_name=sheet_name, dtype=str)
+    return apply_schema(df, sheet_name)
+
+def merge_old_itsp(sales_df, old_itsp_df):
+    """Append this period's sales orders that are not in Old ITSP yet."""
+    sales_df_copy = sales_df.copy()
+    sales_df_copy["VAT %"] = (
+        sales_df_copy["VAT value"]
+        .div(sales_df_copy["Shipping costs"] + sales_df_copy["Amount"])
+        .replace([float("inf"), -float("inf")], 0)
+        .fillna(0)
+    )
+
+    KEY_COL = "Order no."
+    existing_orders = set(old_itsp_df[KEY_COL].dropna().astype(str))
+    sales_df_copy[KEY_COL] = sales_df_copy[KEY_COL].astype(str)
+
+    new_sales_rows = sales_df_copy[
+        ~sales_df_copy[KEY_COL].isin(existing_orders)
+    ]
+    del sales_df_copy
+    new_sales_rows["Marketplace > Channel"] = None
+    new_sales_rows = new_sales_rows[old_itsp_df.columns]
+
+    return pd.concat(
+        [old_itsp_df, new_sales_rows],
+        ignore_index=True
+    )
+
+
+# --------------------------------------------------
+# Stage graph
+#
+# Every source is fetched in its own stage and serialized to worksheet
+# XML (in worker processes, see utils.xlsx_writer) as soon as it
+# arrives, so sheet writing overlaps with the requests still in flight.
+# Sheets shared by all partitions are serialized once. The Old ITSP
+# merge waits for ITSP sales, Recon for all sources, and each
+# partition's workbook is zipped from its parts at the end.
+#
+# With ``patch``, the workbook is the reference itself, patched (see
+# utils.xlsx_patch): Backend and Old ITSP are not written again, Old
+# ITSP only gets the partition's new orders appended.
+#
+# With the "summary" Shopify profile, the SUMMARY_SHEETS are fetched as
+# order-level aggregates for Recon and not written.
+# --------------------------------------------------
+SHARED_SHEETS = [*SHOPIFY_REPORTS, "Backend"]
+
+
+def merged_stage(partition):
+    return f"Merge Old ITSP ({partition_label(partition)})"
+
+
+def source_stages(start_date, end_date, reference, partitions, shopify_profile="detail"):
+    """Stages fetching every source, and merging each partition's Old ITSP."""
+    date_from = f"{start_date} 00:00:00"
+    date_to = f"{end_date} 23:59:59"
+    shop_from = start_date.strftime("%Y-%m-%d")
+    shop_to = end_date.strftime("%Y-%m-%d")
+
+    stages = [
+        Stage("ITSP Sales", lambda: fetch_sales_orders_partitioned(date_from, date_to, partitions)),
+        Stage("ITSP Returns", lambda: fetch_returns_partitioned(date_from, date_to, partitions)),
+    ]
+    for sheet in SHOPIFY_REPORTS:
+        stages.append(Stage(sheet, lambda sheet=sheet: fetch_shopify_report(
+            sheet, shop_from, shop_to, shopify_profile
+        )))
+    for sheet in REFERENCE_SHEETS:
+        stages.append(Stage(sheet, lambda sheet=sheet: load_reference_sheet(BytesIO(reference), sheet)))
+    for partition in partitions:
+        stages.append(Stage(
+            merged_stage(partition),
+            lambda sales, old, p=partition: merge_old_itsp(sales[p], old),
+            ("ITSP Sales", "Old ITSP"),
+            {"ITSP Sales": "sales", "Old ITSP": "old"},
+        ))
+    return stages
+
+
+def partition_sources(partition):
+    """Sheet name -> (stage holding its frame, partition to pick or None)."""
+    sources = {sheet: (sheet, None) for sheet in SHARED_SHEETS}
+    sources["ITSP Sales"] = ("ITSP Sales", partition)
+    sources["ITSP Returns"] = ("ITSP Returns", partition)
+    sources["Old ITSP"] = (merged_stage(partition), None)
+    return sources
+
+
+def partition_sheets(sources, frames):
+    """The sheets of one partition, from the results of its source stages."""
+    return {
+        sheet: frames[source] if part is None else frames[source][part]
+        for sheet, (source, part) in sources.items()
+    }
+
+
+def generation_stages(start_date, end_date, reference, partitions, incremental=False, patch=False,
+                      shopify_profile="detail"):
+    """
+    Stages producing one workbook per partition.
+
+    ``reference`` holds the bytes of the reference Excel. The result of
+    the stage named ``partition_label(p)`` is ``(output, match_report)``.
+    """
+    styles = reference_styles(reference) if patch else None
+    offset = styles.offset if patch else 0
+    written = [
+        s for s in SHARED_SHEETS
+        if not (patch and s in KEPT_SHEETS)
+        and not (shopify_profile == "summary" and s in SUMMARY_SHEETS)
+    ]
+
+    stages = source_stages(start_date, end_date, reference, partitions, shopify_profile)
+    for sheet in written:
+        stages.append(Stage(
+            f"Write {sheet}",
+            lambda df, sheet=sheet: serialize_sheet(sheet, df, style_offset=offset),
+            (sheet,),
+            {sheet: "df"},
+        ))
+
+    for partition in partitions:
+        label = partition_label(partition)
+        merged = merged_stage(partition)
+        recon = f"Recon ({label})"
+        sources = partition_sources(partition)
+
+        writes = [f"Write {sheet}" for sheet in written]
+        for sheet in ["ITSP Sales", "ITSP Returns", "Old ITSP"]:
+            if patch and sheet in KEPT_SHEETS:
+                continue
+            source, part = sources[sheet]
+            name = f"Write {sheet} ({label})"
+            writes.append(name)
+            stages.append(Stage(
+                name,
+                lambda df, sheet=sheet, part=part: serialize_sheet(
+                    sheet, df if part is None else df[part], style_offset=offset
+                ),
+                (source,),
+                {source: "df"},
+            ))
+
+        key = state_key(start_date, end_date, label, shopify_profile)
+
+        def run_recon(key=key, sources=sources, **frames):
+            sheets = partition_sheets(sources, frames)
+            indexes = build_order_indexes(sheets)
+            parts = []
+            if incremental:
+                recon_df, changes_df = incremental_recon(sheets, key, indexes)
+                parts.append(serialize_sheet("Changes", changes_df, style_offset=offset))
+            else:
+                recon_df = build_recon_frame(sheets, indexes)
+            parts.append(serialize_sheet("Recon", recon_df, as_table=False, style_offset=offset))
+            return parts, match_report(indexes)
+
+        inputs = sorted({source for source, _ in sources.values()})
+        stages.append(Stage(recon, run_recon, inputs))
+
+        def finish(recon, writes=tuple(writes), old=None, merged_old=None, **parts):
+            recon_parts, report = recon
+            sheet_parts = [parts[name] for name in writes] + recon_parts
+            if not patch:
+                return assemble_workbook(sheet_parts), report
+            # merge_old_itsp appends the new orders after the old ones
+            appends = {APPENDED_SHEET: merged_old.iloc[len(old):]}
+            return patch_workbook(reference, sheet_parts, appends, styles), report
+
+        deps = (recon, *writes, *((merged, "Old ITSP") if patch else ()))
+        stages.append(Stage(label, finish, deps, {recon: "recon", merged: "merged_old", "Old ITSP": "old"}))
+
+    return stages
+
+
+def generate(start_date, end_date, reference, partitions, incremental=False, patch=False,
+             shopify_profile="detail", max_workers=8, profiler=None):
+    """
+    Build every partition's workbook through the stage graph.
+
+    Returns ``(outputs, match_reports, timeline)``, the first two keyed
+    by partition. With ``patch``, each workbook is the reference with
+    this period's sheets added (see utils.xlsx_patch). ``shopify_profile``
+    picks the Shopify queries (see services.shopify_service.SHOPIFY_PROFILES).
+    """
+    stages = generation_stages(
+        start_date, end_date, reference, partitions, incremental, patch, shopify_profile
+    )
+    results, timeline = run_stages(stages, max_workers=max_workers, profiler=profiler)
+
+    outputs, match_reports = {}, {}
+    for partition in partitions:
+        outputs[partition], match_reports[partition] = results[partition_label(partition)]
+    return outputs, match_reports, timeline
+
+
+def generate_lazy(start_date, end_date, reference, partitions, incremental=False, patch=False,
+                  shopify_profile="detail", profiler=None):
+    """
+    Same as generate() with the out-of-core engine (no timeline). It is
+    not split in stages, so a ``profiler`` sees it as one run.
+
+    Sheets are streamed from DuckDB into the workbook (see
+    utils.lazy_engine.write_lazy), except with ``incremental`` or
+    ``patch``, which need the period's sheets as frames.
+    """
+    if not incremental and not patch:
+        outputs = write_lazy(
+            start_date, end_date,
+            load_reference_sheet(BytesIO(reference), "Old ITSP"),
+            load_reference_sheet(BytesIO(reference), "Backend"),
+            partitions, shopify_profile,
+        )
+        return outputs, {}, None
+
+    old_itsp_df = load_reference_sheet(BytesIO(reference), "Old ITSP")
+
+    outputs = {}
+    results = generate_frames_lazy(
+        start_date, end_date, reference, partitions, shopify_profile, old_itsp_df
+    )
+    for partition, (sheets, recon_df) in results.items():
+        if incremental:
+            key = state_key(start_date, end_date, partition_label(partition), shopify_profile)
+            recon_df, sheets["Changes"] = incremental_recon(sheets, key)
+        sheets = workbook_sheets(sheets, shopify_profile)
+        if patch:
+            appends = {APPENDED_SHEET: sheets[APPENDED_SHEET].iloc[len(old_itsp_df):]}
+            outputs[partition] = patch_reference(reference, sheets, recon_df, appends)
+        else:
+            outputs[partition] = export_to_excel(sheets, recon_df=recon_df)
+    return outputs, {}, None
+
+
+# --------------------------------------------------
+# Frames only
+#
+# The same sheets and Recon, as DataFrames, for callers that do not
+# want a workbook (see api.py).
+# --------------------------------------------------
+def generate_frames(start_date, end_date, reference, partitions, shopify_profile="detail",
+                    max_workers=8):
+    """``{partition: (sheets, recon_df)}`` through the stage graph."""
+    stages = source_stages(start_date, end_date, reference, partitions, shopify_profile)
+    for partition in partitions:
+        sources = partition_sources(partition)
+
+        def collect(sources=sources, **frames):
+            sheets = partition_sheets(sources, frames)
+            return sheets, build_recon_frame(sheets)
+
+        inputs = sorted({source for source, _ in sources.values()})
+        stages.append(Stage(partition_label(partition), collect, inputs))
+
+    results, _ = run_stages(stages, max_workers=max_workers)
+    return {partition: results[partition_label(partition)] for partition in partitions}
+
+
+def generate_frames_lazy(start_date, end_date, reference, partitions, shopify_profile="detail",
+                         old_itsp_df=None):
+    """Same as generate_frames() with the out-of-core engine."""
+    backend_df = load_reference_sheet(BytesIO(reference), "Backend")
+    if old_itsp_df is None:
+        old_itsp_df = load_reference_sheet(BytesIO(reference), "Old ITSP")
+
+    results = run_lazy(start_date, end_date, old_itsp_df, partitions, shopify_profile)
+    for sheets, _ in results.values():
+        sheets["Backend"] = backend_df
+    return results
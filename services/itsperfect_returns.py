@@ -1,52 +1,62 @@
-import pandas as pd
-from utils.auth import get_itsperfect_token
-from utils.pagination import fetch_paginated
-from utils.helpers import safe_get
-import streamlit as st
-
-BASE_URL = st.secrets["ITSP_BASE_URL"]
-def fetch_returns(date_from, date_to):
-    headers = {"Authorization": f"Bearer {get_itsperfect_token()}"}
-
-    url = (
-        f"{BASE_URL}/sales_return_orders?"
-        f"fields=id,date,warehouse,customer,return_costs_lcy,discount_lcy,"
-        f"remarks,country,subsidiary,quantity,amount_lcy,postage_costs_lcy,"
-        f"marketplace_channel,b2b_b2c_order"
-        f"&date>={date_from}&date<{date_to}"
-    )
-
-    df = pd.DataFrame(fetch_paginated(url, headers))
-
-    if df.empty:
-        return df
-
-    df = df[df["b2b_b2c_order"] == 2]
-    df = df[df["subsidiary"].apply(lambda x: safe_get(x, "subsidiary") == "Fab BV")]
-    df = df[df["marketplace_channel"].apply(lambda x: safe_get(x, "channel") is None)]
-
-    df = df.rename(columns={
-        "id": "Order no.",
-        "date": "Date",
-        "return_costs_lcy": "Return costs",
-        "discount_lcy": "Discount",
-        "amount_lcy": "Amount",
-        "postage_costs_lcy": "Postage costs",
-        "quantity": "Quantity",
-        "remarks": "Comments"
-    })
-
-    df["Warehouse"] = df["warehouse"].apply(lambda x: safe_get(x, "warehouse"))
-    df["Customer ID"] = df["customer"].apply(lambda x: safe_get(x, "id"))
-    df["Customer"] = df["customer"].apply(lambda x: safe_get(x, "customer_name"))
-    df["Country"] = df["country"].apply(lambda x: safe_get(x, "iso2"))
-    df["Subsidiary"] = df["subsidiary"].apply(lambda x: safe_get(x, "subsidiary"))
-
-    return df[[
-        "Order no.", "Date", "Warehouse", "Customer ID", "Customer",
-        "Return costs", "Discount", "Comments",
-        "Country", "Subsidiary", "Quantity",
-        "Amount", "Postage costs"
-
-    ]]
-
+from utils.auth import get_itsperfect_token
+from utils.config import setting
+from utils.pagination import fetch_paginated
+from utils.helpers import safe_get
+from utils.schema import apply_schema
+from utils.partitions import DEFAULT_PARTITION, in_partitions, split_by_partition
+from services.itsperfect_sales import B2B_B2C_MAP
+
+def returns_url(date_from, date_to):
+    return (
+        f"{setting('ITSP_BASE_URL')}/sales_return_orders?"
+        f"fields=id,date,warehouse,customer,return_costs_lcy,discount_lcy,"
+        f"remarks,country,subsidiary,quantity,amount_lcy,postage_costs_lcy,"
+        f"marketplace_channel,b2b_b2c_order"
+        f"&date>={date_from}&date<{date_to}"
+    )
+
+def fetch_returns(date_from, date_to):
+    return fetch_returns_partitioned(date_from, date_to, [DEFAULT_PARTITION])[DEFAULT_PARTITION]
+
+def fetch_returns_partitioned(date_from, date_to, partitions):
+    headers = {"Authorization": f"Bearer {get_itsperfect_token()}"}
+    url = returns_url(date_from, date_to)
+
+    df = fetch_paginated(url, headers, as_frame=True)
+
+    if df.empty:
+        return {p: df for p in partitions}
+
+    df["Subsidiary"] = df["subsidiary"].apply(lambda x: safe_get(x, "subsidiary"))
+    df["Channel"] = df["b2b_b2c_order"].map(B2B_B2C_MAP)
+    df["Marketplace"] = df["marketplace_channel"].apply(lambda x: safe_get(x, "channel"))
+    df = df[in_partitions(df, partitions)]
+
+    df = df.rename(columns={
+        "id": "Order no.",
+        "date": "Date",
+        "return_costs_lcy": "Return costs",
+        "discount_lcy": "Discount",
+        "amount_lcy": "Amount",
+        "postage_costs_lcy": "Postage costs",
+        "quantity": "Quantity",
+        "remarks": "Comments"
+    })
+
+    df["Warehouse"] = df["warehouse"].apply(lambda x: safe_get(x, "warehouse"))
+    df["Customer ID"] = df["customer"].apply(lambda x: safe_get(x, "id"))
+    df["Customer"] = df["customer"].apply(lambda x: safe_get(x, "customer_name"))
+    df["Country"] = df["country"].apply(lambda x: safe_get(x, "iso2"))
+
+    df = df[[
+        "Order no.", "Date", "Warehouse", "Customer ID", "Customer",
+        "Return costs", "Discount", "Comments",
+        "Country", "Subsidiary", "Quantity",
+        "Amount", "Postage costs",
+        "Channel", "Marketplace"
+    ]]
+    apply_schema(df, "ITSP Returns")
+
+    parts = split_by_partition(df, partitions)
+    return {p: part.drop(columns="Channel") for p, part in parts.items()}
+
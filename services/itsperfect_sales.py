@@ -1,209 +1,283 @@
-import pandas as pd
-from utils.auth import get_itsperfect_token
-from utils.pagination import fetch_paginated
-from utils.helpers import safe_get
-import streamlit as st
-
-BASE_URL = st.secrets["ITSP_BASE_URL"]
-# -----------------------------------
-# Mappings
-# -----------------------------------
-TYPE_MAP = {
-    1: "Pre-order",
-    2: "Direct order",
-    3: "Receipt",
-    4: "Sample order",
-}
-
-STATUS_MAP = {
-    0: "Quantity to ship",
-    1: "Sent",
-    2: "Canceled",
-    3: "Draft",
-    4: "Quote",
-}
-
-B2B_B2C_MAP = {
-    0: "Unknown",
-    1: "B2B order",
-    2: "B2C order",
-}
-
-
-# -----------------------------------
-# Public API
-# -----------------------------------
-def fetch_sales_orders(date_from: str, date_to: str) -> pd.DataFrame:
-    """
-    Fetch Itsperfect B2C sales orders (Fab BV),
-    including payments and lines.
-    """
-
-    headers = {"Authorization": f"Bearer {get_itsperfect_token()}"}
-
-    url = (
-        f"{BASE_URL}/sales_orders?"
-        "fields=id,date,warehouse,customer,reference,country,"
-        "shipping_costs_lcy,shipping_costs_fcy,"
-        "discount_lcy,discount_fcy,"
-        "subsidiary,type,status,webshop,marketplace_channel,"
-        "currency,amount_lcy,amount_fcy,"
-        "vat_amount_lcy,vat_amount_fcy,"
-        "creation_date,quantity,b2b_b2c_order"
-        f"&date>={date_from}&date<{date_to}"
-        "&includes=payments,lines"
-    )
-
-    raw = fetch_paginated(url, headers)
-    df = pd.DataFrame(raw)
-
-    if df.empty:
-        return df
-
-    # -----------------------------------
-    # Map enums
-    # -----------------------------------
-    df["type"] = df["type"].map(TYPE_MAP)
-    df["status"] = df["status"].map(STATUS_MAP)
-    df["b2b_b2c_order"] = df["b2b_b2c_order"].map(B2B_B2C_MAP)
-
-    # -----------------------------------
-    # Rename base fields
-    # -----------------------------------
-    df = df.rename(columns={
-        "id": "Order no.",
-        "date": "Date",
-        "reference": "Reference",
-        "shipping_costs_lcy": "Shipping costs",
-        "discount_lcy": "Discount",
-        "type": "Type",
-        "status": "Status",
-        "b2b_b2c_order": "Channel",
-        "amount_lcy": "Amount",
-        "vat_amount_lcy": "VAT value",
-        "creation_date": "Creation date",
-    })
-
-    # -----------------------------------
-    # Extract nested objects
-    # -----------------------------------
-    df["Warehouse"] = df["warehouse"].apply(lambda x: safe_get(x, "warehouse"))
-    df["Customer ID"] = df["customer"].apply(lambda x: safe_get(x, "id"))
-    df["Customer"] = df["customer"].apply(lambda x: safe_get(x, "customer_name"))
-    df["Country"] = df["country"].apply(lambda x: safe_get(x, "iso2"))
-    df["Subsidiary"] = df["subsidiary"].apply(lambda x: safe_get(x, "subsidiary"))
-    df["Webshop"] = df["webshop"].apply(lambda x: safe_get(x, "webshop"))
-    df["Currency"] = df["currency"].apply(lambda x: safe_get(x, "iso"))
-
-    # -----------------------------------
-    # Filters (B2C / Fab BV / no marketplace)
-    # -----------------------------------
-    df = df[df["Subsidiary"] == "Fab BV"]
-    df = df[df["Channel"] == "B2C order"]
-    df = df[
-        df["marketplace_channel"].apply(
-            lambda x: safe_get(x, "channel") is None
-        )
-    ]
-
-    # -----------------------------------
-    # Numeric coercion
-    # -----------------------------------
-    numeric_cols = [
-        "Amount",
-        "Shipping costs",
-        "VAT value",
-        "Discount",
-        "amount_fcy",
-        "discount_fcy",
-        "shipping_costs_fcy",
-        "vat_amount_fcy",
-    ]
-
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-
-    # -----------------------------------
-    # Calculated amounts (FCY)
-    # -----------------------------------
-    df["Subtotaal excl VAT"] = df["amount_fcy"] + df["discount_fcy"]
-    df["Total incl. VAT"] = (
-        df["amount_fcy"]
-        + df["shipping_costs_fcy"]
-        + df["vat_amount_fcy"]
-    )
-
-    # -----------------------------------
-    # Quantities from lines
-    # -----------------------------------
-    df["Total Qty"] = df["lines"].apply(
-        lambda lines: sum(l.get("quantity", 0) for l in lines)
-        if isinstance(lines, list)
-        else 0
-    )
-
-    # -----------------------------------
-    # Payments
-    # -----------------------------------
-    df["Payment date"] = df["payments"].apply(
-        lambda payments: min(
-            p.get("date") for p in payments if p.get("date")
-        )
-        if isinstance(payments, list) and payments
-        else None
-    )
-
-    df["Payment method"] = df["payments"].apply(
-        lambda payments: payments[0]
-        .get("payment_method", {})
-        .get("payment_method")
-        if isinstance(payments, list) and payments
-        else None
-    )
-
-    df["Payment amount (LCY)"] = df.apply(
-        lambda row: sum(
-            float(p.get("amount_rcy", 0))
-            for p in row["payments"]
-        ) * row["Total Qty"]
-        if isinstance(row["payments"], list)
-        else 0,
-        axis=1,
-    )
-
-    # -----------------------------------
-    # Final column order
-    # -----------------------------------
-    columns = [
-        "Order no.",
-        "Date",
-        "Warehouse",
-        "Customer ID",
-        "Customer",
-        "Reference",
-        "Country",
-        "Shipping costs",
-        "Discount",
-        "Subsidiary",
-        "Type",
-        "Status",
-        "Webshop",
-        "Channel",
-        "Currency",
-        "Amount",
-        "VAT value",
-        "Creation date",
-        "Payment date",
-        "Payment amount (LCY)",
-        "Payment method",
-        "Total Qty",
-        "Subtotaal excl VAT",
-        "Total incl. VAT",
-    ]
-
-    df = df[columns]
-
-
-    return df
-
+from __future__ import annotations
+
+from utils.auth import get_itsperfect_token
+from utils.config import setting
+from utils.pagination import fetch_paginated
+from utils.helpers import lazy_import, safe_get
+from utils.schema import apply_schema
+from utils.partitions import DEFAULT_PARTITION, in_partitions, split_by_partition
+
+pd = lazy_import("pandas")
+
+# -----------------------------------
+# Mappings
+# -----------------------------------
+TYPE_MAP = {
+    1: "Pre-order",
+    2: "Direct order",
+    3: "Receipt",
+    4: "Sample order",
+}
+
+STATUS_MAP = {
+    0: "Quantity to ship",
+    1: "Sent",
+    2: "Canceled",
+    3: "Draft",
+    4: "Quote",
+}
+
+B2B_B2C_MAP = {
+    0: "Unknown",
+    1: "B2B order",
+    2: "B2C order",
+}
+
+# -----------------------------------
+# Projection
+#
+# The fields each output column is built from, as "field" or
+# "field.sub_field". The request only asks for the fields (and the
+# relations, through includes=) that some column needs. The API
+# projects top-level fields only, so sub-fields document what is read
+# from each nested object.
+# -----------------------------------
+INCLUDE_RELATIONS = {"payments", "lines"}
+
+# Total Qty is the sum of the order's lines, and it multiplies into
+# Payment amount (LCY). The order's own ``quantity`` may hold the same
+# total, which would spare requesting the lines (by far the largest part
+# of the response), but that has not been checked against the API:
+# switch this off only once it has.
+TOTAL_QTY_FROM_LINES = True
+TOTAL_QTY_FIELDS = ["lines.quantity"] if TOTAL_QTY_FROM_LINES else ["quantity"]
+
+SALES_PROJECTION = {
+    "Order no.": ["id"],
+    "Date": ["date"],
+    "Warehouse": ["warehouse.warehouse"],
+    "Customer ID": ["customer.id"],
+    "Customer": ["customer.customer_name"],
+    "Reference": ["reference"],
+    "Country": ["country.iso2"],
+    "Shipping costs": ["shipping_costs_lcy"],
+    "Discount": ["discount_lcy"],
+    "Subsidiary": ["subsidiary.subsidiary"],
+    "Type": ["type"],
+    "Status": ["status"],
+    "Webshop": ["webshop.webshop"],
+    "Channel": ["b2b_b2c_order"],
+    "Currency": ["currency.iso"],
+    "Amount": ["amount_lcy"],
+    "VAT value": ["vat_amount_lcy"],
+    "Creation date": ["creation_date"],
+    "Payment date": ["payments.date"],
+    "Payment amount (LCY)": ["payments.amount_rcy", *TOTAL_QTY_FIELDS],
+    "Payment method": ["payments.payment_method.payment_method"],
+    "Total Qty": TOTAL_QTY_FIELDS,
+    "Subtotaal excl VAT": ["amount_fcy", "discount_fcy"],
+    "Total incl. VAT": ["amount_fcy", "shipping_costs_fcy", "vat_amount_fcy"],
+    "Marketplace": ["marketplace_channel.channel"],
+}
+
+
+def projection_params(projection=SALES_PROJECTION, columns=None):
+    """``(fields, includes)`` needed to build ``columns`` (default: all)."""
+    fields, includes = [], []
+    for col in columns or projection:
+        for path in projection[col]:
+            head = path.split(".", 1)[0]
+            target = includes if head in INCLUDE_RELATIONS else fields
+            if head not in target:
+                target.append(head)
+    return fields, includes
+
+
+def nested_columns(projection=SALES_PROJECTION):
+    """Columns read straight from one sub-field of a nested object."""
+    return {
+        col: tuple(paths[0].split(".", 1))
+        for col, paths in projection.items()
+        if len(paths) == 1 and "." in paths[0]
+        and paths[0].split(".", 1)[0] not in INCLUDE_RELATIONS
+    }
+
+
+# -----------------------------------
+# Public API
+# -----------------------------------
+def sales_orders_url(date_from: str, date_to: str) -> str:
+    fields, includes = projection_params()
+    url = (
+        f"{setting('ITSP_BASE_URL')}/sales_orders?"
+        f"fields={','.join(fields)}"
+        f"&date>={date_from}&date<{date_to}"
+    )
+    if includes:
+        url += f"&includes={','.join(includes)}"
+    return url
+
+
+def fetch_sales_orders(date_from: str, date_to: str) -> pd.DataFrame:
+    """
+    Fetch Itsperfect B2C sales orders (Fab BV),
+    including payments.
+    """
+    return fetch_sales_orders_partitioned(
+        date_from, date_to, [DEFAULT_PARTITION]
+    )[DEFAULT_PARTITION]
+
+
+def fetch_sales_orders_partitioned(date_from: str, date_to: str, partitions) -> dict:
+    """
+    Fetch Itsperfect sales orders once for the date range and split them
+    into one DataFrame per (subsidiary, channel, marketplace) partition.
+    """
+
+    headers = {"Authorization": f"Bearer {get_itsperfect_token()}"}
+    url = sales_orders_url(date_from, date_to)
+
+    df = fetch_paginated(url, headers, as_frame=True)
+
+    if df.empty:
+        return {p: df for p in partitions}
+
+    # -----------------------------------
+    # Map enums
+    # -----------------------------------
+    df["type"] = df["type"].map(TYPE_MAP)
+    df["status"] = df["status"].map(STATUS_MAP)
+    df["b2b_b2c_order"] = df["b2b_b2c_order"].map(B2B_B2C_MAP)
+
+    # -----------------------------------
+    # Rename base fields
+    # -----------------------------------
+    df = df.rename(columns={
+        "id": "Order no.",
+        "date": "Date",
+        "reference": "Reference",
+        "shipping_costs_lcy": "Shipping costs",
+        "discount_lcy": "Discount",
+        "type": "Type",
+        "status": "Status",
+        "b2b_b2c_order": "Channel",
+        "amount_lcy": "Amount",
+        "vat_amount_lcy": "VAT value",
+        "creation_date": "Creation date",
+    })
+
+    # -----------------------------------
+    # Extract nested objects
+    # -----------------------------------
+    for col, (field, sub_field) in nested_columns().items():
+        df[col] = df[field].apply(lambda x: safe_get(x, sub_field))
+
+    # -----------------------------------
+    # Filters (requested partitions only)
+    # -----------------------------------
+    df = df[in_partitions(df, partitions)]
+
+    # -----------------------------------
+    # Numeric coercion
+    # -----------------------------------
+    numeric_cols = [
+        "Amount",
+        "Shipping costs",
+        "VAT value",
+        "Discount",
+        "amount_fcy",
+        "discount_fcy",
+        "shipping_costs_fcy",
+        "vat_amount_fcy",
+    ]
+
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    # -----------------------------------
+    # Calculated amounts (FCY)
+    # -----------------------------------
+    df["Subtotaal excl VAT"] = df["amount_fcy"] + df["discount_fcy"]
+    df["Total incl. VAT"] = (
+        df["amount_fcy"]
+        + df["shipping_costs_fcy"]
+        + df["vat_amount_fcy"]
+    )
+
+    # -----------------------------------
+    # Quantities
+    # -----------------------------------
+    if TOTAL_QTY_FROM_LINES:
+        df["Total Qty"] = df["lines"].apply(
+            lambda lines: sum(l.get("quantity", 0) for l in lines)
+            if isinstance(lines, list)
+            else 0
+        )
+    else:
+        df["Total Qty"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0)
+
+    # -----------------------------------
+    # Payments
+    # -----------------------------------
+    df["Payment date"] = df["payments"].apply(
+        lambda payments: min(
+            p.get("date") for p in payments if p.get("date")
+        )
+        if isinstance(payments, list) and payments
+        else None
+    )
+
+    df["Payment method"] = df["payments"].apply(
+        lambda payments: payments[0]
+        .get("payment_method", {})
+        .get("payment_method")
+        if isinstance(payments, list) and payments
+        else None
+    )
+
+    df["Payment amount (LCY)"] = df.apply(
+        lambda row: sum(
+            float(p.get("amount_rcy", 0))
+            for p in row["payments"]
+        ) * row["Total Qty"]
+        if isinstance(row["payments"], list)
+        else 0,
+        axis=1,
+    )
+
+    # -----------------------------------
+    # Final column order
+    # -----------------------------------
+    columns = [
+        "Order no.",
+        "Date",
+        "Warehouse",
+        "Customer ID",
+        "Customer",
+        "Reference",
+        "Country",
+        "Shipping costs",
+        "Discount",
+        "Subsidiary",
+        "Type",
+        "Status",
+        "Webshop",
+        "Channel",
+        "Currency",
+        "Amount",
+        "VAT value",
+        "Creation date",
+        "Payment date",
+        "Payment amount (LCY)",
+        "Payment method",
+        "Total Qty",
+        "Subtotaal excl VAT",
+        "Total incl. VAT",
+    ]
+
+    df = df[columns + ["Marketplace"]]
+    apply_schema(df, "ITSP Sales")
+
+    return split_by_partition(df, partitions)
+
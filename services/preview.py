@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from services.itsperfect_sales import B2B_B2C_MAP, projection_params
+from services.shopify_service import shopify_post, shopify_stores
+from utils.auth import get_itsperfect_token
+from utils.config import setting
+from utils.helpers import lazy_import, safe_get
+from utils.pagination import fetch_paginated
+from utils.partitions import DEFAULT_PARTITION, in_partitions, partition_label
+from utils.pipeline import Stage, run_stages
+
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Totals preview
+#
+# Whether a period reconciles, before the full export: Shopify totals
+# come from one ShopifyQL aggregate per store (split by order/return
+# only), ITSP orders and returns are pulled with just the fields their
+# totals need and summed per partition. Signs and parts match the Recon
+# totals, except for ITSP returns: Recon adds the original order's
+# shipping (from Old ITSP) when the whole order came back, which the
+# preview cannot see, and grosses each return up with its original
+# order's VAT, where the preview takes the period's average sales VAT.
+#
+# Both Shopify stores sell for the default partition only, so Shopify
+# and the delta are only filled in on that row.
+# --------------------------------------------------
+PREVIEW_COLUMNS = [
+    "Partition", "ITSP orders", "ITSP returns",
+    "ITSP Sales", "ITSP Return excl. shipping", "Total ITSP",
+    "Shopify Sales", "Shopify Return", "Total Shopify", "Delta",
+]
+
+# Deltas below this count as reconciled (rounding)
+RECONCILED_TOLERANCE = 0.01
+
+SALES_TOTAL_COLUMNS = ["Shipping costs", "Amount", "VAT value", "Subsidiary", "Channel", "Marketplace"]
+RETURNS_TOTAL_FIELDS = [
+    "amount_lcy", "subsidiary", "b2b_b2c_order", "marketplace_channel",
+]
+
+
+def _sales_totals_url(date_from, date_to):
+    fields, _ = projection_params(columns=SALES_TOTAL_COLUMNS)
+    return (
+        f"{setting('ITSP_BASE_URL')}/sales_orders?"
+        f"fields={','.join(fields)}"
+        f"&date>={date_from}&date<{date_to}"
+    )
+
+
+def _returns_totals_url(date_from, date_to):
+    return (
+        f"{setting('ITSP_BASE_URL')}/sales_return_orders?"
+        f"fields={','.join(RETURNS_TOTAL_FIELDS)}"
+        f"&date>={date_from}&date<{date_to}"
+    )
+
+
+def fetch_itsp_amounts(url, partitions):
+    """The rows of ``url`` that fall in ``partitions``, with the partition columns."""
+    headers = {"Authorization": f"Bearer {get_itsperfect_token()}"}
+    df = fetch_paginated(url, headers, as_frame=True)
+    if df.empty:
+        return df
+
+    df["Subsidiary"] = df["subsidiary"].apply(lambda x: safe_get(x, "subsidiary"))
+    df["Channel"] = df["b2b_b2c_order"].map(B2B_B2C_MAP)
+    df["Marketplace"] = df["marketplace_channel"].apply(lambda x: safe_get(x, "channel"))
+    return df[in_partitions(df, partitions)]
+
+
+def fetch_shopify_totals(start_date, end_date):
+    """``{"order": total, "return": total}`` over both stores."""
+    query = """
+    query {{
+        shopifyqlQuery(
+            query: "
+            FROM sales
+            SHOW total_sales
+            GROUP BY order_or_return
+            SINCE {start_date} UNTIL {end_date}
+            "
+        ) {{
+            tableData {{
+                columns {{ name }}
+                rows
+            }}
+            parseErrors
+        }}
+    }}
+    """.format(start_date=start_date, end_date=end_date)
+
+    totals = {"order": 0.0, "return": 0.0}
+    for token, graphql_url in shopify_stores():
+        data, _ = shopify_post(query, token, graphql_url)
+        table = data["data"]["shopifyqlQuery"]["tableData"]
+        cols = [c["name"] for c in table.get("columns", [])]
+        df = pd.DataFrame(table.get("rows", []), columns=cols)
+        for sale_type, total in zip(df["order_or_return"], pd.to_numeric(df["total_sales"])):
+            totals[sale_type] = totals.get(sale_type, 0.0) + total
+    return totals
+
+
+def _sum(df, col):
+    if col not in df.columns:
+        return 0.0
+    return float(pd.to_numeric(df[col], errors="coerce").fillna(0).sum())
+
+
+def preview_totals(start_date, end_date, partitions) -> pd.DataFrame:
+    """
+    One row per partition: ITSP totals of the period, and for the
+    default partition the Shopify totals and the delta.
+    """
+    date_from = f"{start_date} 00:00:00"
+    date_to = f"{end_date} 23:59:59"
+
+    results, _ = run_stages([
+        Stage("ITSP Sales", lambda: fetch_itsp_amounts(_sales_totals_url(date_from, date_to), partitions)),
+        Stage("ITSP Returns", lambda: fetch_itsp_amounts(_returns_totals_url(date_from, date_to), partitions)),
+        Stage("Shopify", lambda: fetch_shopify_totals(
+            start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+        )),
+    ])
+    shopify = results["Shopify"]
+
+    rows = []
+    for partition in partitions:
+        sales, returns = (
+            df[in_partitions(df, [partition])] if not df.empty else df
+            for df in (results["ITSP Sales"], results["ITSP Returns"])
+        )
+        sales_excl_vat = _sum(sales, "shipping_costs_lcy") + _sum(sales, "amount_lcy")
+        sales_vat = _sum(sales, "vat_amount_lcy")
+        vat_rate = sales_vat / sales_excl_vat if sales_excl_vat else 0.0
+
+        itsp_sales = sales_excl_vat + sales_vat
+        itsp_return = -_sum(returns, "amount_lcy") * (1 + vat_rate)
+        total_itsp = round(itsp_sales + itsp_return, 2)
+        row = {
+            "Partition": partition_label(partition),
+            "ITSP orders": len(sales),
+            "ITSP returns": len(returns),
+            "ITSP Sales": round(itsp_sales, 2),
+            "ITSP Return excl. shipping": round(itsp_return, 2),
+            "Total ITSP": total_itsp,
+        }
+        if partition == DEFAULT_PARTITION:
+            total_shopify = round(shopify["order"] + shopify["return"], 2)
+            row.update({
+                "Shopify Sales": round(shopify["order"], 2),
+                "Shopify Return": round(shopify["return"], 2),
+                "Total Shopify": total_shopify,
+                "Delta": round(total_itsp - total_shopify, 2),
+            })
+        rows.append(row)
+    return pd.DataFrame(rows, columns=PREVIEW_COLUMNS)
+
+
+def reconciles(preview: pd.DataFrame) -> bool:
+    """Whether every compared partition is within RECONCILED_TOLERANCE (False if none is)."""
+    deltas = pd.to_numeric(preview["Delta"], errors="coerce").dropna()
+    return not deltas.empty and bool((deltas.abs() < RECONCILED_TOLERANCE).all())
@@ -1,262 +1,433 @@
-import time
-import requests
-import pandas as pd
-import streamlit as st
-
-ACCESS_TOKEN = st.secrets["SHOPIFY_ACCESS_TOKEN"]
-ACCESS_TOKEN_ARCHIVE = st.secrets["SHOPIFY_ACCESS_TOKEN_ARCHIVE"]
-GRAPHQL_URL = st.secrets["SHOPIFY_GRAPHQL_URL"]
-GRAPHQL_URL_ARCHIVE = st.secrets["SHOPIFY_GRAPHQL_URL_ARCHIVE"]
-
-SHOPIFY_RENAME_MAPS = {
-    "payments": {
-        "transaction_id": "Transaction ID",
-        "day": "Date",
-        "order_name": "Order",
-        "payment_gateway": "Payment method",
-        "credit_card_type": "Accelerated checkout",
-        "credit_card_tier": "Credit card",
-        "shipping_country": "Sales channel",
-        "billing_country": "Billing country",
-        "gift_card_id": "Gift card ID",
-        "gross_payments": "Gross payments",
-        "refunded_payments": "Refunds",
-        "net_payments": "Net payments",
-    },
-    "incl_returns": {
-        "order_id": "Order ID",
-        "sale_id": "Sale ID",
-        "order_name": "Order",
-        "day": "Date",
-        "order_or_return": "Sale type",
-        "sales_channel": "Sales channel",
-        "pos_location_name": "POS location",
-        "billing_country": "Billing country",
-        "shipping_country": "Shipping country",
-        "product_type": "Product type",
-        "product_vendor": "Product vendor",
-        "product_title": "Product",
-        "product_variant_title": "Variant",
-        "product_variant_sku": "Variant SKU",
-        "quantity_ordered": "Net quantity",
-        "gross_sales": "Gross sales",
-        "discounts": "Discounts",
-        "returns": "Returns",
-        "net_sales": "Net sales",
-        "shipping_charges": "Shipping",
-        "taxes": "Taxes",
-        "total_sales": "Total sales",
-    },
-    "tax": {
-        "line_item_id": "Sale tax ID",
-        "order_id": "Order ID",
-        "day": "Date",
-        "order_name": "Order",
-        "product_title": "Product",
-        "product_variant_title": "Variant",
-        "product_variant_sku": "Variant SKU",
-        "product_type": "Product type",
-        "tax_country": "Country",
-        "tax_region": "Region",
-        "tax_name": "Name",
-        "tax_rate": "Rate",
-        "sales_taxes": "Amount",
-        "sales_channel": "Sales channel",
-    },
-}
-
-# --------------------------------------------------
-# Low-level Shopify POST with retries & throttling
-# --------------------------------------------------
-def shopify_post(query, access_token, graphql_url, max_retries=5, initial_delay=5):
-    headers = {
-        "X-Shopify-Access-Token": access_token,
-        "Content-Type": "application/json",
-    }
-
-    delay = initial_delay
-    for attempt in range(max_retries):
-        r = requests.post(graphql_url, json={"query": query}, headers=headers)
-
-        try:
-            data = r.json()
-        except ValueError:
-            time.sleep(2)
-            continue
-
-        errors = (
-            data.get("errors")
-            or data.get("data", {}).get("shopifyqlQuery", {}).get("parseErrors", [])
-        )
-
-        if errors:
-            print(errors)
-            if any(e.get("extensions", {}).get("code") == "THROTTLED" for e in errors):
-                time.sleep(delay)
-                delay *= 2
-                continue
-            raise Exception(f"Shopify GraphQL error: {errors}")
-
-        return data
-
-    raise Exception("Shopify API failed after retries")
-
-# --------------------------------------------------
-# Generic ShopifyQL fetcher (pagination)
-# --------------------------------------------------
-def fetch_shopifyql(
-    query_template,
-    access_token,
-    graphql_url,
-    start_date,
-    end_date,
-    batch_size=3000,
-):
-    all_rows = []
-    offset = 0
-
-    while True:
-        query = query_template.format(
-            start_date=start_date,
-            end_date=end_date,
-            limit=batch_size,
-            offset=offset,
-        )
-
-        data = shopify_post(query, access_token, graphql_url)
-
-        table = data["data"]["shopifyqlQuery"]["tableData"]
-        rows = table.get("rows", [])
-        cols = [c["name"] for c in table.get("columns", [])]
-
-        if not rows:
-            break
-
-        all_rows.extend(rows)
-        offset += batch_size
-
-        if len(rows) < batch_size:
-            break
-
-    if not all_rows:
-        return pd.DataFrame()
-
-    return pd.DataFrame(all_rows, columns=cols)
-
-# --------------------------------------------------
-# Individual report functions
-# --------------------------------------------------
-def fetch_shopify_payments(start_date, end_date, access_token, graphql_url):
-    query = """
-    query {{
-        shopifyqlQuery(
-            query: "
-            FROM payments
-            SHOW gross_payments, refunded_payments, net_payments
-            WHERE transaction_kind IN ('sale','change','capture','refund')
-                AND order_name!=''
-            GROUP BY transaction_id, day, order_name, payment_gateway,
-                     credit_card_type, credit_card_tier, shipping_country,
-                     billing_country, gift_card_id
-            TIMESERIES day
-            SINCE {start_date} UNTIL {end_date}
-            ORDER BY day ASC
-            LIMIT {limit}
-            OFFSET {offset}
-            VISUALIZE net_payments TYPE table
-            "
-        ) {{
-            tableData {{
-                columns {{ name }}
-                rows
-            }}
-            parseErrors
-        }}
-    }}
-    """
-    df= fetch_shopifyql(query, access_token, graphql_url, start_date, end_date)
-    return df.rename(columns=SHOPIFY_RENAME_MAPS["payments"])
-
-def fetch_shopify_incl_returns(start_date, end_date, access_token, graphql_url):
-    query = """
-    query {{
-        shopifyqlQuery(
-            query: "
-            FROM sales
-            SHOW quantity_ordered, gross_sales, discounts, returns,
-                 net_sales, shipping_charges, taxes, total_sales
-            GROUP BY order_id, sale_id, order_name, day, order_or_return,
-                     sales_channel, pos_location_name, billing_country,
-                     shipping_country, product_type, product_vendor,
-                     product_title, product_variant_title, product_variant_sku
-            SINCE {start_date} UNTIL {end_date}
-            ORDER BY day ASC, order_id ASC, sale_id ASC
-            LIMIT {limit}
-            OFFSET {offset}
-            "
-        ) {{
-            tableData {{
-                columns {{ name }}
-                rows
-            }}
-            parseErrors
-        }}
-    }}
-    """
-    df= fetch_shopifyql(query, access_token, graphql_url, start_date, end_date)
-    return df.rename(columns=SHOPIFY_RENAME_MAPS["incl_returns"])
-
-def fetch_shopify_tax(start_date, end_date, access_token, graphql_url):
-    query = """
-    query {{
-        shopifyqlQuery(
-            query: "
-            FROM sales_taxes
-            SHOW sales_taxes
-            GROUP BY line_item_id, order_id, day, order_fulfillment_status,
-                     order_payment_status, order_name, product_title,
-                     product_variant_title, product_variant_sku,
-                     product_type, tax_country, tax_region, tax_name,
-                     tax_rate, sales_channel, filed_by_channel, is_canceled_order
-            SINCE {start_date} UNTIL {end_date}
-            ORDER BY order_id ASC
-            LIMIT {limit}
-            OFFSET {offset}
-            VISUALIZE sales_taxes TYPE table
-            "
-        ) {{
-            tableData {{
-                columns {{ name }}
-                rows
-            }}
-            parseErrors
-        }}
-    }}
-    """
-    df= fetch_shopifyql(query, access_token, graphql_url, start_date, end_date)
-    return df.rename(columns=SHOPIFY_RENAME_MAPS["tax"])
-
-# --------------------------------------------------
-# Public API: fetch all reports (live + archive)
-# --------------------------------------------------
-def fetch_shopify_reports(start_date, end_date):
-    results = {}
-
-    results["Shopify payments"] = pd.concat([
-        fetch_shopify_payments(start_date, end_date, ACCESS_TOKEN, GRAPHQL_URL),
-        fetch_shopify_payments(start_date, end_date, ACCESS_TOKEN_ARCHIVE, GRAPHQL_URL_ARCHIVE)
-    ], ignore_index=True)
-
-    results["Shopify incl. returns"] = pd.concat([
-        fetch_shopify_incl_returns(start_date, end_date, ACCESS_TOKEN, GRAPHQL_URL),
-        fetch_shopify_incl_returns(start_date, end_date, ACCESS_TOKEN_ARCHIVE, GRAPHQL_URL_ARCHIVE)
-    ], ignore_index=True)
-
-    results["Shopify Tax"] = pd.concat([
-        fetch_shopify_tax(start_date, end_date, ACCESS_TOKEN, GRAPHQL_URL),
-        fetch_shopify_tax(start_date, end_date, ACCESS_TOKEN_ARCHIVE, GRAPHQL_URL_ARCHIVE)
-    ], ignore_index=True)
-
-
-    return results
-
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.checkpoints import PageCheckpoints
+from utils.config import setting
+from utils.hedging import hedged, request_timeout
+from utils.helpers import decode_json, lazy_import
+from utils.planner import PagePlan, shopify_endpoint
+from utils.schema import apply_schema
+
+pd = lazy_import("pandas")
+requests = lazy_import("requests")
+
+
+def shopify_stores():
+    """(access token, GraphQL URL) of the live and the archive store."""
+    return [
+        (setting("SHOPIFY_ACCESS_TOKEN"), setting("SHOPIFY_GRAPHQL_URL")),
+        (setting("SHOPIFY_ACCESS_TOKEN_ARCHIVE"), setting("SHOPIFY_GRAPHQL_URL_ARCHIVE")),
+    ]
+
+SHOPIFY_RENAME_MAPS = {
+    "payments": {
+        "transaction_id": "Transaction ID",
+        "day": "Date",
+        "order_name": "Order",
+        "payment_gateway": "Payment method",
+        "credit_card_type": "Accelerated checkout",
+        "credit_card_tier": "Credit card",
+        "shipping_country": "Sales channel",
+        "billing_country": "Billing country",
+        "gift_card_id": "Gift card ID",
+        "gross_payments": "Gross payments",
+        "refunded_payments": "Refunds",
+        "net_payments": "Net payments",
+    },
+    "incl_returns": {
+        "order_id": "Order ID",
+        "sale_id": "Sale ID",
+        "order_name": "Order",
+        "day": "Date",
+        "order_or_return": "Sale type",
+        "sales_channel": "Sales channel",
+        "pos_location_name": "POS location",
+        "billing_country": "Billing country",
+        "shipping_country": "Shipping country",
+        "product_type": "Product type",
+        "product_vendor": "Product vendor",
+        "product_title": "Product",
+        "product_variant_title": "Variant",
+        "product_variant_sku": "Variant SKU",
+        "quantity_ordered": "Net quantity",
+        "gross_sales": "Gross sales",
+        "discounts": "Discounts",
+        "returns": "Returns",
+        "net_sales": "Net sales",
+        "shipping_charges": "Shipping",
+        "taxes": "Taxes",
+        "total_sales": "Total sales",
+    },
+    "tax": {
+        "line_item_id": "Sale tax ID",
+        "order_id": "Order ID",
+        "day": "Date",
+        "order_name": "Order",
+        "product_title": "Product",
+        "product_variant_title": "Variant",
+        "product_variant_sku": "Variant SKU",
+        "product_type": "Product type",
+        "tax_country": "Country",
+        "tax_region": "Region",
+        "tax_name": "Name",
+        "tax_rate": "Rate",
+        "sales_taxes": "Amount",
+        "sales_channel": "Sales channel",
+        "tax_lines": "Lines",
+    },
+}
+
+# --------------------------------------------------
+# Low-level Shopify POST with retries & throttling
+# --------------------------------------------------
+def shopify_post(query, access_token, graphql_url, max_retries=5, initial_delay=5, plan=None):
+    headers = {
+        "X-Shopify-Access-Token": access_token,
+        "Content-Type": "application/json",
+    }
+
+    delay = initial_delay
+    for attempt in range(max_retries):
+        try:
+            r = requests.post(graphql_url, json={"query": query}, headers=headers,
+                              timeout=request_timeout())
+        except requests.Timeout:
+            # Counts as an attempt
+            continue
+
+        try:
+            data = decode_json(r)
+        except ValueError:
+            time.sleep(2)
+            continue
+
+        errors = (
+            data.get("errors")
+            or data.get("data", {}).get("shopifyqlQuery", {}).get("parseErrors", [])
+        )
+
+        if errors:
+            print(errors)
+            if any(e.get("extensions", {}).get("code") == "THROTTLED" for e in errors):
+                if plan is not None:
+                    plan.throttle()
+                time.sleep(delay)
+                delay *= 2
+                continue
+            raise Exception(f"Shopify GraphQL error: {errors}")
+
+        return data, len(r.content)
+
+    raise Exception("Shopify API failed after retries")
+
+# --------------------------------------------------
+# Generic ShopifyQL fetcher (pagination)
+# --------------------------------------------------
+def fetch_shopifyql(
+    query_template,
+    access_token,
+    graphql_url,
+    start_date,
+    end_date,
+    sink=None,
+):
+    """
+    Run a paginated ShopifyQL query. With ``sink``, every page frame is
+    passed to ``sink(offset, frame)`` instead of being collected.
+
+    Page size and the number of pages requested at once are chosen by
+    utils.planner after the first page. Pages are checkpointed (see
+    utils.checkpoints), so the same query over the same period resumes
+    after the pages it already got.
+    """
+    plan = PagePlan(shopify_endpoint(graphql_url, query_template), "shopify")
+    checkpoints = PageCheckpoints("shopify", graphql_url, query_template, start_date, end_date)
+
+    def fetch(offset, limit):
+        saved = checkpoints.load(offset, limit)
+        if saved is not None:
+            plan.reuse()
+            return saved
+
+        query = query_template.format(
+            start_date=start_date,
+            end_date=end_date,
+            limit=limit,
+            offset=offset,
+        )
+
+        t0 = time.perf_counter()
+        data, nbytes = hedged(
+            lambda: shopify_post(query, access_token, graphql_url, plan=plan), plan
+        )
+        table = data["data"]["shopifyqlQuery"]["tableData"]
+        rows = table.get("rows", [])
+        cols = [c["name"] for c in table.get("columns", [])]
+        plan.observe(time.perf_counter() - t0, nbytes, len(rows))
+        checkpoints.save(offset, limit, len(rows), (rows, cols), last=len(rows) < limit)
+        return rows, cols
+
+    # Each page becomes a frame right away so its decoded rows can be freed
+    frames = []
+
+    def keep(page_offset, rows, cols):
+        if rows:
+            frame = pd.DataFrame(rows, columns=cols)
+            if sink is not None:
+                sink(page_offset, frame)
+            else:
+                frames.append(frame)
+
+    # Pages an earlier attempt already got
+    resumed, offset, done = checkpoints.resume()
+    for page_offset, (rows, cols) in resumed:
+        plan.reuse()
+        keep(page_offset, rows, cols)
+
+    limit, workers = plan.limit, 1
+
+    with ThreadPoolExecutor(max_workers=plan.bounds["workers"][1]) as pool:
+        while not done:
+            # The total is unknown, so the next ``workers`` pages are
+            # requested at once and anything after a short page is dropped
+            offsets = [offset + i * limit for i in range(workers)]
+            batch = list(pool.map(lambda o: fetch(o, limit), offsets))
+
+            for page_offset, (rows, cols) in zip(offsets, batch):
+                keep(page_offset, rows, cols)
+                if len(rows) < limit:
+                    done = True
+                    break
+            if done:
+                break
+
+            offset = offsets[-1] + limit
+            limit, workers = plan.choose()
+
+    plan.save()
+
+    if not frames:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True)
+
+# --------------------------------------------------
+# Individual report functions
+# --------------------------------------------------
+def fetch_shopify_payments(start_date, end_date, access_token, graphql_url, sink=None):
+    query = """
+    query {{
+        shopifyqlQuery(
+            query: "
+            FROM payments
+            SHOW gross_payments, refunded_payments, net_payments
+            WHERE transaction_kind IN ('sale','change','capture','refund')
+                AND order_name!=''
+            GROUP BY transaction_id, day, order_name, payment_gateway,
+                     credit_card_type, credit_card_tier, shipping_country,
+                     billing_country, gift_card_id
+            TIMESERIES day
+            SINCE {start_date} UNTIL {end_date}
+            ORDER BY day ASC
+            LIMIT {limit}
+            OFFSET {offset}
+            VISUALIZE net_payments TYPE table
+            "
+        ) {{
+            tableData {{
+                columns {{ name }}
+                rows
+            }}
+            parseErrors
+        }}
+    }}
+    """
+    df= fetch_shopifyql(query, access_token, graphql_url, start_date, end_date, sink=sink)
+    return df.rename(columns=SHOPIFY_RENAME_MAPS["payments"])
+
+def fetch_shopify_incl_returns(start_date, end_date, access_token, graphql_url, sink=None):
+    query = """
+    query {{
+        shopifyqlQuery(
+            query: "
+            FROM sales
+            SHOW quantity_ordered, gross_sales, discounts, returns,
+                 net_sales, shipping_charges, taxes, total_sales
+            GROUP BY order_id, sale_id, order_name, day, order_or_return,
+                     sales_channel, pos_location_name, billing_country,
+                     shipping_country, product_type, product_vendor,
+                     product_title, product_variant_title, product_variant_sku
+            SINCE {start_date} UNTIL {end_date}
+            ORDER BY day ASC, order_id ASC, sale_id ASC
+            LIMIT {limit}
+            OFFSET {offset}
+            "
+        ) {{
+            tableData {{
+                columns {{ name }}
+                rows
+            }}
+            parseErrors
+        }}
+    }}
+    """
+    df= fetch_shopifyql(query, access_token, graphql_url, start_date, end_date, sink=sink)
+    return df.rename(columns=SHOPIFY_RENAME_MAPS["incl_returns"])
+
+def fetch_shopify_tax(start_date, end_date, access_token, graphql_url, sink=None):
+    query = """
+    query {{
+        shopifyqlQuery(
+            query: "
+            FROM sales_taxes
+            SHOW sales_taxes
+            GROUP BY line_item_id, order_id, day, order_fulfillment_status,
+                     order_payment_status, order_name, product_title,
+                     product_variant_title, product_variant_sku,
+                     product_type, tax_country, tax_region, tax_name,
+                     tax_rate, sales_channel, filed_by_channel, is_canceled_order
+            SINCE {start_date} UNTIL {end_date}
+            ORDER BY order_id ASC
+            LIMIT {limit}
+            OFFSET {offset}
+            VISUALIZE sales_taxes TYPE table
+            "
+        ) {{
+            tableData {{
+                columns {{ name }}
+                rows
+            }}
+            parseErrors
+        }}
+    }}
+    """
+    df= fetch_shopifyql(query, access_token, graphql_url, start_date, end_date, sink=sink)
+    return df.rename(columns=SHOPIFY_RENAME_MAPS["tax"])
+
+# --------------------------------------------------
+# Recon summary reports
+#
+# Recon only needs, per order, the total split by order/return, the
+# date and the tax rate. These pull that at order level instead of per
+# sale line, so busy months take a fraction of the rows and pages. The
+# columns keep the names of the line-level sheets they stand in for.
+#
+# Recon's tax rate is the mean over the line-level tax rows, so an order
+# with lines at different rates needs the number of lines per rate.
+# ShopifyQL has no row count, so tax is still pulled per tax line (with
+# only the columns that tell lines apart) and each page is collapsed to
+# one row per order and rate, with its line count, before it is kept.
+# --------------------------------------------------
+def fetch_shopify_order_totals(start_date, end_date, access_token, graphql_url, sink=None):
+    query = """
+    query {{
+        shopifyqlQuery(
+            query: "
+            FROM sales
+            SHOW gross_sales, discounts, returns, net_sales,
+                 shipping_charges, taxes, total_sales
+            GROUP BY order_id, order_name, day, order_or_return
+            SINCE {start_date} UNTIL {end_date}
+            ORDER BY day ASC, order_id ASC
+            LIMIT {limit}
+            OFFSET {offset}
+            "
+        ) {{
+            tableData {{
+                columns {{ name }}
+                rows
+            }}
+            parseErrors
+        }}
+    }}
+    """
+    df= fetch_shopifyql(query, access_token, graphql_url, start_date, end_date, sink=sink)
+    return df.rename(columns=SHOPIFY_RENAME_MAPS["incl_returns"])
+
+def fetch_shopify_order_tax(start_date, end_date, access_token, graphql_url, sink=None):
+    query = """
+    query {{
+        shopifyqlQuery(
+            query: "
+            FROM sales_taxes
+            SHOW sales_taxes
+            GROUP BY order_id, order_name, tax_rate, line_item_id, day, tax_name
+            SINCE {start_date} UNTIL {end_date}
+            ORDER BY order_id ASC
+            LIMIT {limit}
+            OFFSET {offset}
+            VISUALIZE sales_taxes TYPE table
+            "
+        ) {{
+            tableData {{
+                columns {{ name }}
+                rows
+            }}
+            parseErrors
+        }}
+    }}
+    """
+    pages = []
+
+    def keep(offset, frame):
+        frame = count_tax_lines(frame)
+        if sink is not None:
+            sink(offset, frame)
+        else:
+            pages.append(frame)
+
+    fetch_shopifyql(query, access_token, graphql_url, start_date, end_date, sink=keep)
+    df = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+    return df.rename(columns=SHOPIFY_RENAME_MAPS["tax"])
+
+def count_tax_lines(frame):
+    """Tax lines of a page as one row per order and rate, with ``tax_lines`` counting them."""
+    frame = frame.assign(sales_taxes=pd.to_numeric(frame["sales_taxes"], errors="coerce"))
+    return (
+        frame.groupby(["order_id", "order_name", "tax_rate"], sort=False, dropna=False)
+        .agg(sales_taxes=("sales_taxes", "sum"), tax_lines=("sales_taxes", "size"))
+        .reset_index()
+    )
+
+# --------------------------------------------------
+# Public API: fetch all reports (live + archive)
+# --------------------------------------------------
+SHOPIFY_REPORTS = {
+    "Shopify payments": fetch_shopify_payments,
+    "Shopify incl. returns": fetch_shopify_incl_returns,
+    "Shopify Tax": fetch_shopify_tax,
+}
+
+# Query profiles: "detail" fetches the line-level sheets, "summary"
+# only the order-level aggregates Recon needs for SUMMARY_SHEETS, which
+# are then left out of the workbook
+SUMMARY_SHEETS = ["Shopify incl. returns", "Shopify Tax"]
+SHOPIFY_PROFILES = {
+    "detail": SHOPIFY_REPORTS,
+    "summary": {
+        **SHOPIFY_REPORTS,
+        "Shopify incl. returns": fetch_shopify_order_totals,
+        "Shopify Tax": fetch_shopify_order_tax,
+    },
+}
+
+def workbook_sheets(sheets, profile="detail"):
+    """The sheets of ``sheets`` that go in the workbook under ``profile``."""
+    if profile == "detail":
+        return sheets
+    return {sheet: df for sheet, df in sheets.items() if sheet not in SUMMARY_SHEETS}
+
+def fetch_shopify_report(sheet, start_date, end_date, profile="detail"):
+    """One Shopify sheet, live and archive stores combined."""
+    fetch = SHOPIFY_PROFILES[profile][sheet]
+    df = pd.concat([
+        fetch(start_date, end_date, token, graphql_url)
+        for token, graphql_url in shopify_stores()
+    ], ignore_index=True)
+    return apply_schema(df, sheet)
+
+def fetch_shopify_reports(start_date, end_date, profile="detail"):
+    return {
+        sheet: fetch_shopify_report(sheet, start_date, end_date, profile)
+        for sheet in SHOPIFY_REPORTS
+    }
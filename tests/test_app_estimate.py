@@ -0,0 +1,63 @@
+"""
+When the Streamlit page runs the run estimate, and what happens when it
+fails.
+"""
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import services.estimate  # noqa: E402
+from services.estimate import ESTIMATE_COLUMNS, RunEstimate  # noqa: E402
+
+APP = str(Path(__file__).resolve().parents[1] / "app.py")
+PERIOD = (date(2024, 4, 1), date(2024, 4, 30))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def estimate_run(start_date, end_date, shopify_profile="detail"):
+        calls.append((start_date, end_date))
+        if start_date.year == 2023:
+            raise ConnectionError("ITSP is down")
+        sources = pd.DataFrame([["ITSP Sales", 10, 250, 1, 1, 1.0, 0.1]], columns=ESTIMATE_COLUMNS)
+        return RunEstimate(sources, "pandas", 1.0, 1.0, [])
+
+    monkeypatch.setattr(services.estimate, "estimate_run", estimate_run)
+    return calls
+
+
+def test_not_estimated_on_page_load(calls):
+    at = AppTest.from_file(APP).run()
+    assert not at.exception
+    assert calls == []
+
+    # Other widgets rerun the page without counting the period
+    at.checkbox[0].check().run()
+    assert calls == []
+
+
+def test_estimated_when_the_range_changes(calls):
+    at = AppTest.from_file(APP).run()
+    at.date_input[0].set_value(PERIOD).run()
+    assert calls == [PERIOD]
+    assert at.expander[0].label.startswith("Run plan: 10 rows")
+
+    # Kept for the period
+    at.checkbox[0].check().run()
+    assert calls == [PERIOD]
+
+
+def test_failed_estimate_falls_back_to_pandas(calls):
+    at = AppTest.from_file(APP).run()
+    at.date_input[0].set_value((date(2023, 4, 1), date(2023, 4, 30))).run()
+    assert not at.exception
+    assert "ITSP is down" in at.warning[0].value
+    assert not at.expander
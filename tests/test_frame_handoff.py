@@ -0,0 +1,77 @@
+"""
+Handoff files of utils.frame_handoff: round trip, and that none are
+left behind.
+"""
+import os
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import frame_handoff, xlsx_writer
+from utils.frame_handoff import FrameFile, open_frame, release_frame, share_frame, sweep_stale_frames
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(autouse=True)
+def handoff_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(frame_handoff, "HANDOFF_DIR", str(tmp_path))
+    monkeypatch.setattr(frame_handoff, "MIN_HANDOFF_CELLS", 1)
+    return tmp_path
+
+
+def _frame():
+    return pd.DataFrame({"Amount": np.arange(100, dtype=float), "Order": [f"#{i}" for i in range(100)]})
+
+
+def test_round_trip(handoff_dir):
+    df = _frame()
+    frame = share_frame(df)
+    assert isinstance(frame, FrameFile)
+    pd.testing.assert_frame_equal(open_frame(frame), df)
+    release_frame(frame)
+    assert not os.listdir(handoff_dir)
+
+
+def test_files_are_removed_when_a_worker_fails(handoff_dir, monkeypatch):
+    def submit(fn, *args):
+        future = Future()
+        future.set_exception(RuntimeError("worker died"))
+        return future
+
+    monkeypatch.setattr(xlsx_writer, "submit", submit)
+    with pytest.raises(RuntimeError):
+        xlsx_writer.sheet_parts({"ITSP Sales": _frame(), "Old ITSP": _frame()})
+    with pytest.raises(RuntimeError):
+        xlsx_writer.serialize_sheet("ITSP Sales", _frame())
+    assert not os.listdir(handoff_dir)
+
+
+def test_files_are_removed_when_a_later_frame_fails(handoff_dir, monkeypatch):
+    shared = []
+
+    def share_frame_once(df):
+        if shared:
+            raise MemoryError
+        shared.append(share_frame(df))
+        return shared[-1]
+
+    monkeypatch.setattr(xlsx_writer, "share_frame", share_frame_once)
+    with pytest.raises(MemoryError):
+        xlsx_writer.sheet_parts({"ITSP Sales": _frame(), "Old ITSP": _frame()})
+    assert shared and not os.listdir(handoff_dir)
+
+
+def test_sweep_removes_only_stale_files(handoff_dir):
+    stale, fresh = share_frame(_frame()), share_frame(_frame())
+    other = handoff_dir / "notes.arrow"
+    other.write_bytes(b"")
+    old = time.time() - frame_handoff.STALE_HANDOFF_SECONDS - 60
+    for path in (stale.path, str(other)):
+        os.utime(path, (old, old))
+
+    sweep_stale_frames()
+    assert sorted(os.listdir(handoff_dir)) == sorted([os.path.basename(fresh.path), "notes.arrow"])
@@ -0,0 +1,61 @@
+"""
+Total Qty of ITSP Sales, in both engines, for an order whose lines do
+not add up to its ``quantity``.
+"""
+import json
+
+import pandas as pd
+import pytest
+
+from services import itsperfect_sales
+from utils.partitions import DEFAULT_PARTITION
+
+ORDER = {
+    "id": 50001, "date": "2024-04-02 10:00:00",
+    "warehouse": {"warehouse": "WH1"}, "customer": {"id": 1, "customer_name": "C1"},
+    "reference": "#1001", "country": {"iso2": "NL"},
+    "shipping_costs_lcy": 5.0, "shipping_costs_fcy": 5.0, "discount_lcy": 0, "discount_fcy": 0,
+    "subsidiary": {"subsidiary": DEFAULT_PARTITION[0]}, "type": 2, "status": 1,
+    "webshop": {"webshop": "web"}, "marketplace_channel": None,
+    "currency": {"iso": "EUR"}, "amount_lcy": 100.0, "amount_fcy": 100.0,
+    "vat_amount_lcy": 21.0, "vat_amount_fcy": 21.0, "creation_date": "2024-04-01",
+    "b2b_b2c_order": 2,
+    "payments": [{"date": "2024-04-02", "amount_rcy": "1.5", "payment_method": {"payment_method": "ideal"}}],
+    # Lines say 3, the order says 5
+    "quantity": 5,
+    "lines": [{"quantity": 1}, {"quantity": 2}],
+}
+LINES_QTY = 3
+
+
+@pytest.fixture(autouse=True)
+def itsp_url(monkeypatch):
+    monkeypatch.setenv("ITSP_BASE_URL", "https://itsp.invalid/api/v2")
+
+
+def test_lines_are_requested():
+    url = itsperfect_sales.sales_orders_url("2024-04-01 00:00:00", "2024-04-30 23:59:59")
+    assert "lines" in url.split("includes=", 1)[1].split(",")
+
+
+def test_total_qty_sums_the_lines(monkeypatch):
+    monkeypatch.setattr(itsperfect_sales, "get_itsperfect_token", lambda: "token")
+    monkeypatch.setattr(itsperfect_sales, "fetch_paginated", lambda *a, **k: pd.DataFrame([ORDER]))
+    df = itsperfect_sales.fetch_sales_orders("2024-04-01 00:00:00", "2024-04-30 23:59:59")
+
+    assert df["Total Qty"].tolist() == [LINES_QTY]
+    assert df["Payment amount (LCY)"].tolist() == [1.5 * LINES_QTY]
+
+
+def test_total_qty_sums_the_lines_out_of_core(tmp_path):
+    duckdb = pytest.importorskip("duckdb")
+    from utils.lazy_engine import _load_itsp_sales
+
+    (tmp_path / "itsp_sales").mkdir()
+    (tmp_path / "itsp_sales" / "rows-000000000000.json").write_text(json.dumps([ORDER]))
+    con = duckdb.connect()
+    _load_itsp_sales(con, str(tmp_path))
+    qty, payment = con.execute('SELECT "Total Qty", "Payment amount (LCY)" FROM itsp_sales').fetchone()
+    con.close()
+
+    assert (qty, payment) == (LINES_QTY, 1.5 * LINES_QTY)
@@ -0,0 +1,56 @@
+"""
+Token refresh of utils.pagination when page workers hit a 401 together.
+"""
+import threading
+import types
+
+from utils import pagination
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {"X-Pagination-Page-Count": "1"}
+        self.content = b"[]"
+
+    def raise_for_status(self):
+        assert self.status_code == 200
+
+
+def test_concurrent_401_refreshes_once(monkeypatch):
+    workers = 8
+    barrier = threading.Barrier(workers)
+    tokens = []
+    sent = []
+
+    def get(url, headers, timeout):
+        sent.append(headers)
+        if headers["Authorization"] == "Bearer stale":
+            # Every worker gets its 401 before any of them refreshes
+            barrier.wait()
+            return _Response(401)
+        return _Response(200)
+
+    def new_token():
+        tokens.append(1)
+        return f"fresh{len(tokens)}"
+
+    fake = types.SimpleNamespace(get=get, Timeout=TimeoutError)
+    monkeypatch.setattr(pagination, "requests", fake)
+    monkeypatch.setattr(pagination, "get_itsperfect_token", new_token)
+
+    headers = {"Authorization": "Bearer stale"}
+    threads = [
+        threading.Thread(target=pagination._get_page, args=("u?x=1", headers, 10, page, None))
+        for page in range(1, workers + 1)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(tokens) == 1
+    assert headers == {"Authorization": "Bearer fresh1"}
+    # Each request carried its own copy of the headers
+    assert all(h is not headers for h in sent)
+    assert [h["Authorization"] for h in sent].count("Bearer fresh1") == workers
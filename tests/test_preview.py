@@ -0,0 +1,117 @@
+"""
+The totals preview (services.preview) against build_recon_frame on the
+same orders.
+"""
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from services import preview
+from utils.partitions import DEFAULT_PARTITION, Partition
+from utils.recon import build_recon_frame
+
+OTHER_PARTITION = Partition("Fab BV", "B2B order", None)
+
+# Every order at 21%, so the period's average VAT is each order's
+SALES = [
+    # reference, shipping, amount, vat, channel
+    ("#1001", 5.0, 100.0, 22.05, 2),
+    ("#1002", 0.0, 50.0, 10.5, 2),
+    ("#2001", 10.0, 300.0, 65.1, 1),
+]
+# reference, quantity, amount
+RETURNS = [("#1001", 1, 40.0)]
+# Old ITSP: reference, shipping, total qty
+OLD = [("#1001", 5.0, 2), ("#1002", 0.0, 1)]
+SHOPIFY = {"order": 127.05 + 60.5, "return": -48.4}
+
+
+def _api_rows(rows, fields):
+    return pd.DataFrame([
+        {**dict(zip(fields, row[:-1])), "subsidiary": {"subsidiary": "Fab BV"},
+         "b2b_b2c_order": row[-1], "marketplace_channel": None}
+        for row in rows
+    ])
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    monkeypatch.setenv("ITSP_BASE_URL", "https://itsp.invalid/api/v2")
+    monkeypatch.setattr(preview, "get_itsperfect_token", lambda: "token")
+
+    def fetch_paginated(url, headers, as_frame=False):
+        if "/sales_return_orders?" in url:
+            return _api_rows([(*r[2:], 2) for r in RETURNS], ["amount_lcy"])
+        return _api_rows([r[1:] for r in SALES], ["shipping_costs_lcy", "amount_lcy", "vat_amount_lcy"])
+
+    monkeypatch.setattr(preview, "fetch_paginated", fetch_paginated)
+    monkeypatch.setattr(preview, "fetch_shopify_totals", lambda start, end: dict(SHOPIFY))
+
+
+def _recon(old=OLD):
+    b2c = [r for r in SALES if r[-1] == 2]
+    sheets = {
+        "ITSP Sales": pd.DataFrame({
+            "Reference": [r[0] for r in b2c],
+            "Date": pd.to_datetime(["2024-04-02"] * len(b2c)),
+            "Shipping costs": [r[1] for r in b2c],
+            "Amount": [r[2] for r in b2c],
+            "VAT value": [r[3] for r in b2c],
+        }),
+        "ITSP Returns": pd.DataFrame({
+            "Comments": [r[0] for r in RETURNS],
+            "Quantity": [r[1] for r in RETURNS],
+            "Amount": [r[2] for r in RETURNS],
+        }),
+        "Old ITSP": pd.DataFrame({
+            "Reference": [r[0] for r in old],
+            "Shipping costs": [r[1] for r in old],
+            "Total Qty": [r[2] for r in old],
+            "VAT %": [0.21] * len(old),
+        }),
+        "Shopify incl. returns": pd.DataFrame({
+            "Order": ["#1001", "#1002", "#1001"],
+            "Date": pd.to_datetime(["2024-04-02", "2024-04-03", "2024-04-10"]),
+            "Total sales": [127.05, 60.5, -48.4],
+            "Sale type": ["order", "order", "return"],
+        }),
+        "Shopify Tax": pd.DataFrame({"Order": ["#1001", "#1002"], "Rate": [0.21, 0.21]}),
+    }
+    return build_recon_frame(sheets)
+
+
+def _preview():
+    return preview.preview_totals(date(2024, 4, 1), date(2024, 4, 30), [DEFAULT_PARTITION, OTHER_PARTITION])
+
+
+def test_preview_matches_recon(fetched):
+    totals = _preview().set_index("Partition")
+    row = totals.loc["Fab BV / B2C order"]
+    recon = _recon()
+
+    assert row["ITSP orders"] == 2 and row["ITSP returns"] == 1
+    for ours, theirs in [
+        ("ITSP Sales", "ITSP Sales"), ("ITSP Return excl. shipping", "ITSP Return"),
+        ("Total ITSP", "Total ITSP"), ("Shopify Sales", "Shopify Sales"),
+        ("Shopify Return", "Shopify Return"), ("Total Shopify", "Total Shopify"), ("Delta", "Delta"),
+    ]:
+        assert row[ours] == pytest.approx(recon[theirs].sum(), abs=0.005), ours
+    assert preview.reconciles(totals)
+
+
+def test_preview_leaves_out_the_original_shipping(fetched):
+    # #1001 came back whole: Recon adds its shipping, the preview does not
+    recon = _recon(old=[("#1001", 5.0, 1), ("#1002", 0.0, 1)])
+    row = _preview().set_index("Partition").loc["Fab BV / B2C order"]
+    assert row["ITSP Return excl. shipping"] - recon["ITSP Return"].sum() == pytest.approx(5.0 * 1.21)
+
+
+def test_shopify_is_compared_with_the_default_partition_only(fetched):
+    other = _preview().set_index("Partition").loc["Fab BV / B2B order"]
+    assert other["ITSP orders"] == 1
+    assert other["Total ITSP"] == pytest.approx(375.1)
+    assert other[["Shopify Sales", "Shopify Return", "Total Shopify", "Delta"]].isna().all()
+
+    only_other = preview.preview_totals(date(2024, 4, 1), date(2024, 4, 30), [OTHER_PARTITION])
+    assert not preview.reconciles(only_other)
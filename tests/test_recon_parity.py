@@ -0,0 +1,130 @@
+"""
+Recon totals of both engines against the formulas of the formula
+workbook (utils.excel.add_itsp_returns_columns and
+fill_reconciliation_formulas), transcribed cell by cell.
+"""
+import math
+
+import pandas as pd
+import pytest
+
+from services.shopify_service import SHOPIFY_RENAME_MAPS, count_tax_lines
+from utils.recon import build_recon_frame
+
+OLD_ITSP = pd.DataFrame({
+    "Reference": ["#1001", "#1001", "#1002", "#1003", "#1005"],
+    "Shipping costs": [5.95, 0.0, 4.5, None, 3.0],
+    "Total Qty": [2, 1, 1, 2, 1],
+    "VAT %": [0.2134, 0.09, 0.21, 0.0875, 0.21],
+})
+ITSP_RETURNS = pd.DataFrame({
+    "Comments": ["#1001", "#1002", "#1003", "#1004"],
+    "Quantity": [3, 1, 1, 1],
+    "Amount": [50.0, 20.0, 10.0, 8.0],
+    # Never part of the total, the original order's shipping is
+    "Postage costs": [7.0, 7.0, 7.0, 7.0],
+})
+ITSP_SALES = pd.DataFrame({
+    "Reference": ["#1001", "#1002", "#1005"],
+    "Date": pd.to_datetime(["2024-04-02", "2024-04-03", "2024-04-04"]),
+    "Shipping costs": [5.95, 4.5, 3.0],
+    "Amount": [100.0, 20.0, 30.0],
+    "VAT value": [22.25, 5.15, 6.93],
+})
+SHOPIFY = pd.DataFrame({
+    "Order": ["#1001", "#1001", "#1002", "#1003"],
+    "Date": pd.to_datetime(["2024-04-02", "2024-04-10", "2024-04-03", "2024-04-05"]),
+    "Total sales": [128.2, -68.0, 29.65, -10.88],
+    "Sale type": ["order", "return", "order", "return"],
+})
+# Two lines of #1001 at 21%, one at 9%
+SHOPIFY_TAX = pd.DataFrame({
+    "Order ID": [1, 1, 1, 2],
+    "Order": ["#1001", "#1001", "#1001", "#1002"],
+    "Rate": [0.21, 0.21, 0.09, 0.21],
+    "Amount": [10.5, 4.2, 1.8, 4.2],
+})
+
+SHEETS = {
+    "Shopify incl. returns": SHOPIFY,
+    "Shopify Tax": SHOPIFY_TAX,
+    "ITSP Sales": ITSP_SALES,
+    "ITSP Returns": ITSP_RETURNS,
+    "Old ITSP": OLD_ITSP,
+}
+
+
+def _vlookup(df, key_col, key, col):
+    match = df[df[key_col] == key]
+    if match.empty:
+        return None
+    value = match[col].iloc[0]
+    return 0.0 if pd.isna(value) else float(value)
+
+
+def formula_recon():
+    """Columns E and K-M of the Recon sheet, as the formulas compute them."""
+    returns = ITSP_RETURNS.copy()
+    # O, P, Q, R of ITSP Returns
+    totals = []
+    for _, r in returns.iterrows():
+        ship = _vlookup(OLD_ITSP, "Reference", r["Comments"], "Shipping costs") or 0.0
+        qty = OLD_ITSP.loc[OLD_ITSP["Reference"] == r["Comments"], "Total Qty"].sum()
+        ship_return = ship if r["Quantity"] == qty else 0.0
+        vat = round(_vlookup(OLD_ITSP, "Reference", r["Comments"], "VAT %") or 0.0, 2)
+        totals.append((r["Amount"] + ship_return) * (1 + vat))
+    returns["R"] = totals
+
+    orders = sorted(set(SHOPIFY["Order"]) | set(ITSP_SALES["Reference"]) | set(ITSP_RETURNS["Comments"]))
+    rows = {}
+    for order in orders:
+        rates = SHOPIFY_TAX.loc[SHOPIFY_TAX["Order"] == order, "Rate"]
+        vat = rates.mean() if len(rates) else 0.0
+        old_vat = _vlookup(OLD_ITSP, "Reference", order, "VAT %")
+        sales = ITSP_SALES[ITSP_SALES["Reference"] == order]
+        itsp_sales = (sales["Shipping costs"] + sales["Amount"] + sales["VAT value"]).sum()
+        itsp_return = -returns.loc[returns["Comments"] == order, "R"].sum()
+        rows[order.lstrip("#")] = {
+            "VAT %": vat,
+            "VAT % (Old)": vat if old_vat is None else old_vat,
+            "ITSP Sales": itsp_sales,
+            "ITSP Return": itsp_return,
+            "Total ITSP": round(itsp_sales + itsp_return, 2),
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def summary_tax():
+    """SHOPIFY_TAX as the summary profile fetches it."""
+    raw = {name: col for col, name in SHOPIFY_RENAME_MAPS["tax"].items()}
+    lines = count_tax_lines(SHOPIFY_TAX.rename(columns=raw))
+    return lines.rename(columns=SHOPIFY_RENAME_MAPS["tax"])
+
+
+def _lazy_recon(sheets):
+    duckdb = pytest.importorskip("duckdb")
+    from utils.lazy_engine import _recon
+
+    con = duckdb.connect()
+    for name, sheet in [
+        ("shop", "Shopify incl. returns"), ("tax", "Shopify Tax"), ("sales", "ITSP Sales"),
+        ("ret", "ITSP Returns"), ("old", "Old ITSP"),
+    ]:
+        df = sheets[sheet]
+        con.register(name, df.assign(_row=range(len(df))))
+    recon = _recon(con, "shop", "tax", "sales", "ret", "old", "Reference")
+    con.close()
+    return recon.set_index(recon["Order Ref"].str.lstrip("#"))
+
+
+@pytest.mark.parametrize("profile", ["detail", "summary"])
+@pytest.mark.parametrize("engine", ["pandas", "duckdb"])
+def test_recon_matches_formula_sheet(engine, profile):
+    sheets = SHEETS if profile == "detail" else {**SHEETS, "Shopify Tax": summary_tax()}
+    recon = build_recon_frame(sheets) if engine == "pandas" else _lazy_recon(sheets)
+    expected = formula_recon()
+
+    assert sorted(recon.index) == sorted(expected.index)
+    for order, row in expected.iterrows():
+        for col, value in row.items():
+            assert math.isclose(recon.loc[order, col], value, abs_tol=1e-9), (order, col)
@@ -0,0 +1,37 @@
+"""
+Incremental recon (utils.recon_state) against a full build_recon_frame.
+"""
+import pandas as pd
+
+from test_recon_parity import SHEETS
+from utils import recon_state
+from utils.recon import build_recon_frame
+from utils.recon_state import incremental_recon, state_key
+
+
+def test_unchanged_orders_reuse_stored_rows(tmp_path):
+    key = state_key("2024-04-01", "2024-04-30")
+    first, changes = incremental_recon(SHEETS, key, state_dir=tmp_path)
+    assert changes.empty
+
+    # A stored row is served as is while its order's inputs are unchanged
+    state = recon_state.load_state(key, tmp_path)
+    state["recon"].loc["1001", "Total ITSP"] = -1.0
+    recon_state.save_state(key, state["fingerprints"], state["recon"], tmp_path)
+    again, changes = incremental_recon(SHEETS, key, state_dir=tmp_path)
+    assert again.loc["1001", "Total ITSP"] == -1.0
+    assert changes.empty
+
+
+def test_version_bump_drops_stored_rows(tmp_path, monkeypatch):
+    key = state_key("2024-04-01", "2024-04-30")
+    incremental_recon(SHEETS, key, state_dir=tmp_path)
+    state = recon_state.load_state(key, tmp_path)
+    state["recon"]["Total ITSP"] = -1.0
+    recon_state.save_state(key, state["fingerprints"], state["recon"], tmp_path)
+
+    monkeypatch.setattr(recon_state, "RECON_STATE_VERSION", recon_state.RECON_STATE_VERSION + 1)
+    new_key = state_key("2024-04-01", "2024-04-30")
+    assert new_key != key
+    recon, _ = incremental_recon(SHEETS, new_key, state_dir=tmp_path)
+    pd.testing.assert_frame_equal(recon.sort_index(), build_recon_frame(SHEETS).sort_index())
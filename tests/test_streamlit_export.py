@@ -0,0 +1,109 @@
+"""
+Smoke test of the direct xlsx writer under ``streamlit run``: a page
+exports a workbook through utils.excel, driven over the websocket the
+way a browser session is.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import zipfile
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("streamlit")
+
+from streamlit.proto.BackMsg_pb2 import BackMsg  # noqa: E402
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg  # noqa: E402
+from tornado.websocket import websocket_connect  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+
+PAGE = '''
+import os
+
+import pandas as pd
+import streamlit as st
+
+if __name__ == "__mp_main__":
+    raise RuntimeError("a sheet writer re-ran the page")
+
+from utils.excel import export_to_excel
+
+sheets = {
+    "ITSP Sales": pd.DataFrame({"Reference": ["#1001", "#1002"], "Amount": [10.0, 20.0]}),
+    "Old ITSP": pd.DataFrame({"Reference": ["#1001"], "Total Qty": [1]}),
+}
+recon = pd.DataFrame({"Order Ref": ["#1001", "#1002"], "Total ITSP": [10.0, 20.0]})
+output = export_to_excel(sheets, recon_df=recon)
+with open(os.environ["SMOKE_OUTPUT"], "wb") as f:
+    f.write(output.getvalue())
+st.write("exported")
+'''
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_healthy(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert server.poll() is None, "streamlit exited"
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError("streamlit did not start")
+
+
+async def _run_page(port):
+    """Run the page once, return the exceptions it showed."""
+    ws = await websocket_connect(f"ws://127.0.0.1:{port}/_stcore/stream", subprotocols=["streamlit"])
+    rerun = BackMsg()
+    rerun.rerun_script.query_string = ""
+    await ws.write_message(rerun.SerializeToString(), binary=True)
+    exceptions = []
+    try:
+        while True:
+            raw = await asyncio.wait_for(ws.read_message(), 120)
+            assert raw is not None, "session closed"
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            kind = msg.WhichOneof("type")
+            if kind == "delta" and msg.delta.new_element.WhichOneof("type") == "exception":
+                exceptions.append(msg.delta.new_element.exception.message)
+            elif kind == "script_finished":
+                return exceptions
+    finally:
+        ws.close()
+
+
+def test_export_under_streamlit_run(tmp_path):
+    page = tmp_path / "page.py"
+    page.write_text(PAGE)
+    output = tmp_path / "recon.xlsx"
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH=str(ROOT), SMOKE_OUTPUT=str(output))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", str(page), "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=tmp_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_healthy(port, server)
+        exceptions = asyncio.run(_run_page(port))
+    finally:
+        server.terminate()
+        server.wait(30)
+
+    assert exceptions == []
+    with zipfile.ZipFile(output) as xlsx:
+        assert "xl/worksheets/sheet1.xml" in xlsx.namelist()
@@ -0,0 +1,106 @@
+"""
+The direct xlsx writer (utils.xlsx_writer) against the openpyxl path of
+utils.excel.export_to_excel: both workbooks are read back with openpyxl
+and compared cell by cell.
+"""
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from utils.excel import SHEET_ORDER, export_to_excel
+from utils.recon import RECON_COLUMNS
+
+ROWS = 4
+
+
+def _frame(columns):
+    """``columns`` filled with text, numbers, dates and blanks in turn."""
+    data = {}
+    for i, col in enumerate(columns):
+        kind = i % 5
+        if kind == 0:
+            data[col] = [f"#{1000 + r}" if r != 2 else None for r in range(ROWS)]
+        elif kind == 1:
+            data[col] = pd.to_datetime(["2024-04-02 10:30:00", None, "2024-04-05 00:00:00", "2024-04-30 23:59:59"])
+        elif kind == 2:
+            data[col] = [1.5, np.nan, -2.25, 1e6]
+        elif kind == 3:
+            data[col] = [1, 2, 3, 4]
+        else:
+            data[col] = ["a & b", "<x>", "", "Zoë"]
+    return pd.DataFrame(data)
+
+
+def _sheets():
+    """Every sheet export_to_excel writes, with the column counts the formulas expect."""
+    widths = {
+        "ITSP Sales": 27, "ITSP Returns": 13, "Shopify incl. returns": 22,
+        "Old ITSP": 26, "Shopify payments": 12, "Shopify Tax": 14, "Backend": 6,
+        "Changes": 8,
+    }
+    # Not in workbook order, export_to_excel orders the tabs
+    order = ["Backend", "Shopify Tax", "ITSP Returns", "Old ITSP", "ITSP Sales",
+             "Shopify payments", "Changes", "Shopify incl. returns"]
+    return {sheet: _frame([f"{sheet[:4]} {i}" for i in range(widths[sheet])]) for sheet in order}
+
+
+def _recon():
+    recon = _frame(RECON_COLUMNS)
+    recon["Order Ref"] = [f"#{1000 + r}" for r in range(ROWS)]
+    return recon
+
+
+def _read(engine):
+    sheets = _sheets()
+    output = export_to_excel(sheets, recon_df=_recon(), engine=engine)
+    return load_workbook(BytesIO(output.getvalue()))
+
+
+def _fill(cell):
+    fill = cell.fill
+    if fill is None or fill.fill_type is None:
+        return None
+    return fill.fill_type, fill.fgColor.rgb[-6:]
+
+
+def _tab_color(ws):
+    color = ws.sheet_properties.tabColor
+    return color.rgb[-6:] if color is not None else None
+
+
+@pytest.fixture(scope="module")
+def workbooks():
+    return _read("openpyxl"), _read("direct")
+
+
+def test_sheet_order(workbooks):
+    expected, actual = workbooks
+    assert actual.sheetnames == expected.sheetnames
+    assert expected.sheetnames == sorted(expected.sheetnames, key=SHEET_ORDER.index)
+
+
+def test_sheet_properties(workbooks):
+    expected, actual = workbooks
+    for name in expected.sheetnames:
+        want, got = expected[name], actual[name]
+        assert got.auto_filter.ref == want.auto_filter.ref, name
+        assert _tab_color(got) == _tab_color(want), name
+        assert (got.max_row, got.max_column) == (want.max_row, want.max_column), name
+
+
+def test_cells(workbooks):
+    expected, actual = workbooks
+    for name in expected.sheetnames:
+        want_rows = expected[name].iter_rows()
+        got_rows = actual[name].iter_rows()
+        for want_row, got_row in zip(want_rows, got_rows):
+            for want, got in zip(want_row, got_row):
+                where = (name, want.coordinate)
+                # Formulas read back as their text
+                assert got.value == want.value, where
+                assert got.number_format == want.number_format, where
+                assert _fill(got) == _fill(want), where
+                assert bool(got.font.b) == bool(want.font.b), where
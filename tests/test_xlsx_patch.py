@@ -0,0 +1,106 @@
+"""
+Round trip of utils.xlsx_patch: a reference workbook with sheets, names
+and styles of its own is patched, then opened with openpyxl.
+"""
+from io import BytesIO
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, PatternFill
+from openpyxl.workbook.defined_name import DefinedName
+
+from utils.recon import RECON_COLUMNS
+from utils.xlsx_patch import patch_reference
+
+OLD_COLUMNS = ["Reference", "Shipping costs", "Total Qty"]
+
+
+def _reference():
+    wb = Workbook()
+    backend = wb.active
+    backend.title = "Backend"
+    backend.append(["Code", "Rate"])
+    backend.append(["NL", 0.21])
+    backend.append(["DE", 0.19])
+
+    notes = wb.create_sheet("Notes")
+    notes["A1"] = "Checked by"
+    notes["A1"].font = Font(bold=True, color="FFFF0000")
+    notes["B1"] = 1234.5
+    notes["B1"].number_format = "0.000%"
+    notes["B1"].fill = PatternFill("solid", start_color="FF00FF00", end_color="FF00FF00")
+
+    old = wb.create_sheet("Old ITSP")
+    old.append(OLD_COLUMNS)
+    old.append(["#1000", 5.95, 2])
+    old.auto_filter.ref = "A1:C2"
+
+    wb.create_sheet("Pivot")["A1"] = "=SUM(Backend!B2:B3)"
+
+    wb.defined_names["Rates"] = DefinedName("Rates", attr_text="Backend!$B$2:$B$3")
+    notes.defined_names["Signed"] = DefinedName("Signed", attr_text="Notes!$B$1")
+    wb.active = wb.index(notes)
+
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def _patched():
+    sheets = {
+        "ITSP Sales": pd.DataFrame({"Reference": ["#1001"], "Amount": [10.0]}),
+        "Shopify payments": pd.DataFrame({"Order": ["#1001"], "Date": pd.to_datetime(["2024-04-02"])}),
+        "Backend": pd.DataFrame({"Code": ["NL"], "Rate": [0.21]}),
+        "Old ITSP": pd.DataFrame({"Reference": ["#1000", "#1001"], "Shipping costs": [5.95, 4.5],
+                                  "Total Qty": [2, 1]}),
+    }
+    recon = pd.DataFrame([[None] * len(RECON_COLUMNS)], columns=RECON_COLUMNS).assign(**{"Order Ref": "#1001"})
+    appends = {"Old ITSP": sheets["Old ITSP"].iloc[1:]}
+    output = patch_reference(_reference(), sheets, recon, appends)
+    return load_workbook(BytesIO(output.getvalue()))
+
+
+def test_sheet_order_keeps_the_reference_sheets_in_place():
+    wb = _patched()
+    # Known sheets in the usual order, Notes and Pivot after the sheet they followed
+    assert wb.sheetnames == [
+        "Recon", "ITSP Sales", "Old ITSP", "Pivot", "Shopify payments", "Backend", "Notes",
+    ]
+    assert wb.active.title == "Notes"
+
+
+def test_reference_content_survives():
+    wb = _patched()
+    notes = wb["Notes"]
+    assert notes["A1"].value == "Checked by"
+    assert notes["A1"].font.b and notes["A1"].font.color.rgb == "FFFF0000"
+    assert notes["B1"].number_format == "0.000%"
+    assert notes["B1"].fill.fgColor.rgb == "FF00FF00"
+    assert wb["Pivot"]["A1"].value == "=SUM(Backend!B2:B3)"
+    assert [c.value for c in wb["Backend"]["A"]] == ["Code", "NL", "DE"]
+
+    assert wb.defined_names["Rates"].attr_text == "Backend!$B$2:$B$3"
+    assert wb["Notes"].defined_names["Signed"].attr_text == "Notes!$B$1"
+
+
+def test_generated_sheets_and_appended_rows():
+    wb = _patched()
+    old = wb["Old ITSP"]
+    assert [[c.value for c in row] for row in old.iter_rows()] == [
+        OLD_COLUMNS, ["#1000", 5.95, 2], ["#1001", 4.5, 1],
+    ]
+    assert old.auto_filter.ref == "A1:C3"
+
+    sales = wb["ITSP Sales"]
+    assert [c.value for c in sales[1]][:2] == ["Reference", "Amount"]
+    assert sales["A1"].font.b
+    assert sales["A2"].value == "#1001"
+    # Extra formula columns, with their fill and format
+    assert sales["C2"].value == "=H2+P2+Q2"
+    assert sales["C1"].fill.fgColor.rgb.endswith("DAE9F8")
+    assert sales["E2"].number_format == "dd/mm/yyyy"
+    assert sales.auto_filter.ref == "A1:E2"
+
+    payments = wb["Shopify payments"]
+    assert payments["B2"].value == pd.Timestamp("2024-04-02")
+    assert wb["Recon"]["A2"].value == "#1001"
@@ -1,16 +1,16 @@
-import requests
-import streamlit as st
-
-BASE_URL = st.secrets["ITSP_BASE_URL"]
-USERNAME = st.secrets["ITSP_USERNAME"]
-PASSWORD = st.secrets["ITSP_PASSWORD"]
-
-def get_itsperfect_token():
-    r = requests.post(
-        f"{BASE_URL}/authentication",
-        json={"username": USERNAME, "password": PASSWORD}
-    )
-    r.raise_for_status()
-
-    return r.json()["token"]
-
+from utils.config import setting
+from utils.hedging import request_timeout
+from utils.helpers import lazy_import
+
+requests = lazy_import("requests")
+
+def get_itsperfect_token():
+    r = requests.post(
+        f"{setting('ITSP_BASE_URL')}/authentication",
+        json={"username": setting("ITSP_USERNAME"), "password": setting("ITSP_PASSWORD")},
+        timeout=request_timeout(),
+    )
+    r.raise_for_status()
+
+    return r.json()["token"]
+
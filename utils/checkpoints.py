@@ -0,0 +1,107 @@
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import time
+
+from utils.helpers import private_dir, user_temp_dir
+
+# --------------------------------------------------
+# Page checkpoints
+#
+# Every page of a pull (one ITSP URL, or one ShopifyQL query over one
+# period) is written to disk as it arrives, named after its offset, the
+# page size it was asked with and the rows it held. A pull that failed
+# halfway resumes after the pages it already has, and pulling the same
+# thing again shortly after replays them without a request.
+#
+# Pages are pickles, so they are kept in a directory only their user can
+# write to (utils.helpers.private_dir).
+# --------------------------------------------------
+CHECKPOINT_DIR = os.environ.get(
+    "RECON_CHECKPOINT_DIR", user_temp_dir("ecom_recon_pages")
+)
+
+# Pages older than this are fetched again, like an open period in the
+# output cache (utils.output_cache.OPEN_PERIOD_TTL)
+CHECKPOINT_TTL = 15 * 60
+
+_PAGE_NAME = re.compile(r"^(\d+)-(\d+)-(\d+)(-last)?\.pkl$")
+
+
+def clear_checkpoints(directory=CHECKPOINT_DIR):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def _prune(directory, ttl):
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - ttl
+    for entry in os.scandir(directory):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class PageCheckpoints:
+    """Pages of one pull kept on disk, ``identity`` naming the pull."""
+
+    def __init__(self, *identity, directory=CHECKPOINT_DIR, ttl=CHECKPOINT_TTL):
+        private_dir(directory)
+        _prune(directory, ttl)
+        key = hashlib.sha256(repr(identity).encode()).hexdigest()
+        self.path = os.path.join(directory, key)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _pages(self):
+        """``{offset: (limit, rows, last, file name)}`` of the saved pages."""
+        pages = {}
+        for name in os.listdir(self.path):
+            m = _PAGE_NAME.match(name)
+            if m:
+                offset, limit, rows = int(m[1]), int(m[2]), int(m[3])
+                # Several page sizes may have landed on one offset, the
+                # longest page covers the most
+                if offset not in pages or rows > pages[offset][1]:
+                    pages[offset] = (limit, rows, bool(m[4]), name)
+        return pages
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name), "rb") as f:
+            return pickle.load(f)
+
+    def save(self, offset, limit, rows, page, last=False):
+        """Keep ``page`` (``rows`` rows from ``offset``, asked with ``limit``)."""
+        name = f"{offset:012d}-{limit}-{rows}" + ("-last" if last else "") + ".pkl"
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(page, f)
+        os.replace(path + ".tmp", path)
+
+    def load(self, offset, limit):
+        """The page saved for ``offset`` asked with ``limit``, or None."""
+        for name in os.listdir(self.path):
+            m = _PAGE_NAME.match(name)
+            if m and int(m[1]) == offset and int(m[2]) == limit:
+                return self._read(name)
+        return None
+
+    def resume(self):
+        """
+        Saved pages running on from offset 0 without a gap.
+
+        Returns ``(pages, end, complete)``: ``(offset, page)`` pairs in
+        order, the offset right after them, and whether they reach the
+        last page of the pull.
+        """
+        saved = self._pages()
+        pages, offset = [], 0
+        while offset in saved:
+            _, rows, last, name = saved[offset]
+            pages.append((offset, self._read(name)))
+            offset += rows
+            if last:
+                return pages, offset, True
+            if rows == 0:
+                break
+        return pages, offset, False
@@ -0,0 +1,61 @@
+import os
+import sys
+
+# --------------------------------------------------
+# Settings
+#
+# Looked up on first use, in order: values passed to configure(), the
+# environment, then the Streamlit secrets. Nothing is read at import
+# time, and streamlit is only asked when the app already runs under it;
+# otherwise secrets.toml is read directly.
+# --------------------------------------------------
+_overrides = {}
+_file_secrets = None
+
+
+def configure(**values):
+    """Set settings explicitly (CLI, workers, tests)."""
+    _overrides.update(values)
+
+
+def secrets_paths():
+    # Same places Streamlit looks, the project one last so it wins
+    return [
+        os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+        os.path.join(os.getcwd(), ".streamlit", "secrets.toml"),
+    ]
+
+
+def _secrets():
+    if "streamlit" in sys.modules:
+        return sys.modules["streamlit"].secrets
+
+    global _file_secrets
+    if _file_secrets is None:
+        import tomllib
+
+        secrets = {}
+        for path in secrets_paths():
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    secrets.update(tomllib.load(f))
+        _file_secrets = secrets
+    return _file_secrets
+
+
+_MISSING = object()
+
+
+def setting(name, default=_MISSING):
+    if name in _overrides:
+        return _overrides[name]
+    if name in os.environ:
+        return os.environ[name]
+    try:
+        return _secrets()[name]
+    except (KeyError, FileNotFoundError):
+        if default is not _MISSING:
+            return default
+        raise KeyError(
+            f"{name} is not configured: set it in the environment or in .streamlit/secrets.toml"
+        ) from None
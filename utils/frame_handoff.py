@@ -0,0 +1,103 @@
+import glob
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+# --------------------------------------------------
+# Frame handoff to worker processes
+#
+# A DataFrame submitted to a process pool is pickled, pushed through a
+# pipe and unpickled on the other side. Instead, the frame is written
+# once as an Arrow IPC file in shared memory (/dev/shm where there is
+# one) and only its path crosses the pipe; the worker memory-maps it,
+# so numeric (and datetime) columns without nulls are used in place
+# without a copy. Text columns are still built as Python objects by
+# to_pandas(), as unpickling would, so text-heavy sheets mostly save
+# the pipe.
+#
+# The parent removes the file once its worker is done, crashed or not.
+# Files left behind by a parent that died are swept when the next pool
+# starts (sweep_stale_frames).
+#
+# Frames Arrow cannot represent as they are (columns mixing types, such
+# as Old ITSP dates read as text next to new timestamps) and small ones
+# are handed over as before. Without pyarrow everything is.
+# --------------------------------------------------
+HANDOFF_DIR = os.environ.get(
+    "RECON_HANDOFF_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+# Below this many cells, pickling is cheaper than a file
+MIN_HANDOFF_CELLS = 50_000
+
+# Handoff files older than this belong to no running export
+STALE_HANDOFF_SECONDS = 6 * 3600
+
+HANDOFF_PREFIX = "ecom_recon_"
+
+FrameFile = namedtuple("FrameFile", ["path"])
+
+
+def _arrow():
+    try:
+        import pyarrow
+    except ImportError:  # optional, frames are pickled without it
+        return None
+    return pyarrow
+
+
+def share_frame(df):
+    """What to send to a worker for ``df``: a FrameFile, or ``df`` itself."""
+    pa = _arrow()
+    if pa is None or df.size < MIN_HANDOFF_CELLS:
+        return df
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return df
+
+    fd, path = tempfile.mkstemp(prefix=HANDOFF_PREFIX, suffix=".arrow", dir=HANDOFF_DIR)
+    os.close(fd)
+    try:
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    except BaseException:
+        release_frame(FrameFile(path))
+        raise
+    return FrameFile(path)
+
+
+def open_frame(frame):
+    """
+    The DataFrame behind what share_frame() returned (in the worker).
+    Only null-free numeric columns point into the map, see above.
+    """
+    if not isinstance(frame, FrameFile):
+        return frame
+    pa = _arrow()
+    # The map stays open for as long as the frame's buffers point into it
+    table = pa.ipc.open_file(pa.memory_map(frame.path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def release_frame(frame):
+    """Remove the file behind a FrameFile once its worker is done."""
+    if isinstance(frame, FrameFile):
+        try:
+            os.remove(frame.path)
+        except FileNotFoundError:
+            pass
+
+
+def sweep_stale_frames(max_age=STALE_HANDOFF_SECONDS):
+    """Remove this user's handoff files older than ``max_age`` seconds."""
+    cutoff = time.time() - max_age
+    for path in glob.glob(os.path.join(HANDOFF_DIR, f"{HANDOFF_PREFIX}*.arrow")):
+        try:
+            st = os.stat(path)
+            mine = not hasattr(os, "getuid") or st.st_uid == os.getuid()
+            if mine and st.st_mtime < cutoff:
+                os.remove(path)
+        except OSError:  # gone already, or not ours to remove
+            pass
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.config import setting
+
+# --------------------------------------------------
+# Request timeouts and hedged requests
+#
+# Every request gets a connect and a read timeout, so a hung connection
+# fails (and is retried) instead of stalling the run. With RECON_HEDGE
+# set, a page that is slower than most pages of its pull so far is
+# requested a second time and whichever answer comes first is kept
+# (see utils.planner.PagePlan.hedge_delay for when, and how many).
+# --------------------------------------------------
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# A request that timed out is tried again this many times
+TIMEOUT_RETRIES = 2
+
+HEDGE_THREADS = 32
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def request_timeout():
+    """``(connect, read)`` seconds, RECON_CONNECT_TIMEOUT / RECON_READ_TIMEOUT if set."""
+    return (
+        float(setting("RECON_CONNECT_TIMEOUT", CONNECT_TIMEOUT)),
+        float(setting("RECON_READ_TIMEOUT", READ_TIMEOUT)),
+    )
+
+
+def hedging_enabled():
+    return str(setting("RECON_HEDGE", "")).lower() in ("1", "true", "yes")
+
+
+def _hedge_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="hedge")
+        return _pool
+
+
+def hedged(call, plan):
+    """
+    ``call()``, issued a second time if it takes longer than
+    ``plan.hedge_delay()`` and ``plan`` has hedges left; the first
+    successful answer wins. The slower request is left to finish and
+    its answer dropped.
+    """
+    delay = plan.hedge_delay() if hedging_enabled() else None
+    if delay is None:
+        return call()
+
+    pool = _hedge_pool()
+    first = pool.submit(call)
+    done, _ = wait([first], timeout=delay)
+    if done or not plan.take_hedge():
+        return first.result()
+
+    pending = {first, pool.submit(call)}
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        answered = [f for f in done if f.exception() is None]
+        if answered:
+            return answered[0].result()
+        if not pending:
+            return done.pop().result()
@@ -1,2 +1,69 @@
-def safe_get(d, key, default=None):
-    return d.get(key, default) if isinstance(d, dict) else default
\ No newline at end of file
+import importlib
+import json
+import os
+import stat
+import tempfile
+
+try:
+    import orjson
+except ImportError:  # optional fast decoder
+    orjson = None
+
+
+class LazyModule:
+    """Stand-in for a module, imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def safe_get(d, key, default=None):
+    return d.get(key, default) if isinstance(d, dict) else default
+
+def decode_json(response):
+    """Decode a JSON response (or body), using orjson when it is installed."""
+    content = response if isinstance(response, bytes) else response.content
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def encode_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+# --------------------------------------------------
+# Private directories
+#
+# State, checkpoints and the output cache are pickled to disk, and
+# unpickling runs whatever the file says. They are kept in directories
+# only the current user can write to, and a directory someone else owns
+# (say, created in /tmp beforehand) is refused rather than read.
+# --------------------------------------------------
+def user_temp_dir(name):
+    """Default location ``name`` in the temp directory, one per user."""
+    suffix = f"-{os.getuid()}" if hasattr(os, "getuid") else ""
+    return os.path.join(tempfile.gettempdir(), name + suffix)
+
+def private_dir(path):
+    """``path``, created 0700 if missing; PermissionError if another user controls it."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        return path
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a directory of this user, refusing to use it")
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
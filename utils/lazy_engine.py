@@ -0,0 +1,619 @@
+import os
+import tempfile
+
+from services.itsperfect_returns import returns_url
+from services.itsperfect_sales import (
+    B2B_B2C_MAP,
+    STATUS_MAP,
+    TOTAL_QTY_FROM_LINES,
+    TYPE_MAP,
+    sales_orders_url,
+)
+from services.shopify_service import (
+    SHOPIFY_PROFILES,
+    SHOPIFY_RENAME_MAPS,
+    SUMMARY_SHEETS,
+    shopify_stores,
+)
+from utils.auth import get_itsperfect_token
+from utils.helpers import lazy_import
+from utils.order_keys import BARE_REF_PATTERN, COMMENT_REF_PATTERN
+from utils.pagination import fetch_paginated
+from utils.recon import RECON_COLUMNS
+from utils.schema import SHEET_SCHEMAS
+from utils.xlsx_writer import assemble_workbook, serialize_sheet, stream_sheet_part
+
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Out-of-core engine
+#
+# Same outputs as the pandas path, but fetched pages are spilled to disk
+# as they arrive and the ITSP transforms, the Old ITSP dedupe and the
+# reconciliation run in DuckDB over those files, with a memory cap and
+# all cores. Only the final sheets are materialized as DataFrames.
+# --------------------------------------------------
+# Shopify sheet -> spill directory and rename map
+SHOPIFY_SLUGS = {
+    "Shopify payments": "payments",
+    "Shopify incl. returns": "incl_returns",
+    "Shopify Tax": "tax",
+}
+
+DEFAULT_MEMORY_LIMIT = "2GB"
+
+
+def _connect(work_dir, memory_limit):
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError(
+            "The out-of-core engine needs duckdb and pyarrow "
+            "(pip install duckdb pyarrow)"
+        ) from e
+
+    con = duckdb.connect(os.path.join(work_dir, "recon.duckdb"))
+    con.execute(f"SET threads = {os.cpu_count() or 1}")
+    con.execute(f"SET memory_limit = '{memory_limit}'")
+    con.execute(f"SET temp_directory = '{os.path.join(work_dir, 'tmp')}'")
+    # Row order is carried explicitly in _row columns
+    con.execute("SET preserve_insertion_order = false")
+    return con
+
+
+def _ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _case(expr, mapping):
+    whens = " ".join(f"WHEN {k} THEN {_literal(v)}" for k, v in mapping.items())
+    return f"CASE {expr} {whens} END"
+
+
+def _order_key(expr):
+    """SQL twin of utils.order_keys.normalize_order_keys."""
+    return (
+        f"NULLIF(upper(ltrim(regexp_replace(CAST({expr} AS VARCHAR), "
+        f"'\\s+', '', 'g'), '#')), '')"
+    )
+
+
+# --------------------------------------------------
+# Spilling fetched pages to disk
+# --------------------------------------------------
+def _itsp_sink(directory):
+    os.makedirs(directory, exist_ok=True)
+
+    def sink(offset, content):
+        with open(os.path.join(directory, f"rows-{offset:012d}.json"), "wb") as f:
+            f.write(content)
+
+    return sink
+
+
+def _shopify_sink(directory, store):
+    os.makedirs(directory, exist_ok=True)
+
+    def sink(offset, frame):
+        path = os.path.join(directory, f"{store}-{offset:012d}.parquet")
+        frame.astype("string").to_parquet(path, index=False)
+
+    return sink
+
+
+def spill_sources(work_dir, start_date, end_date, shopify_profile="detail"):
+    """Fetch every source for the period into ``work_dir``, page by page."""
+    date_from, date_to = f"{start_date} 00:00:00", f"{end_date} 23:59:59"
+
+    for name, url in [
+        ("itsp_sales", sales_orders_url(date_from, date_to)),
+        ("itsp_returns", returns_url(date_from, date_to)),
+    ]:
+        headers = {"Authorization": f"Bearer {get_itsperfect_token()}"}
+        fetch_paginated(url, headers, sink=_itsp_sink(os.path.join(work_dir, name)))
+
+    for sheet, slug in SHOPIFY_SLUGS.items():
+        fetch = SHOPIFY_PROFILES[shopify_profile][sheet]
+        for store, (token, url) in enumerate(shopify_stores()):
+            fetch(str(start_date), str(end_date), token, url,
+                  sink=_shopify_sink(os.path.join(work_dir, slug), store))
+
+
+# --------------------------------------------------
+# Loading spilled pages into typed tables
+# --------------------------------------------------
+def _files(directory, suffix):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(suffix)
+    )
+
+
+def _load_itsp_objects(con, table, directory):
+    """One row per ITSP object, with _row following the order of the pull."""
+    files = _files(directory, ".json")
+    if not files:
+        con.execute(f"CREATE OR REPLACE TABLE {table} (_row BIGINT, o JSON)")
+        return
+    file_list = "[" + ", ".join(_literal(f) for f in files) + "]"
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {table} AS
+        WITH pages AS (
+            SELECT CAST(regexp_extract(filename, 'rows-(\\d+)', 1) AS BIGINT) AS first_row,
+                   CAST(CAST(content AS JSON) AS JSON[]) AS docs
+            FROM read_text({file_list})
+        ),
+        items AS (
+            -- Unnesting the array keeps one copy of each object, not of each page
+            SELECT first_row, unnest(docs) AS o, generate_subscripts(docs, 1) AS idx
+            FROM pages
+        )
+        SELECT row_number() OVER (ORDER BY first_row, idx) AS _row, o
+        FROM items
+    """)
+
+
+# Same source for Total Qty as services.itsperfect_sales
+_TOTAL_QTY = (
+    "CASE WHEN json_type(o->'$.lines') = 'ARRAY' "
+    "THEN COALESCE(list_sum(CAST(o->>'$.lines[*].quantity' AS DOUBLE[])), 0) ELSE 0 END"
+    if TOTAL_QTY_FROM_LINES
+    else "COALESCE(TRY_CAST(o->>'$.quantity' AS DOUBLE), 0)"
+)
+
+
+def _load_itsp_sales(con, work_dir):
+    _load_itsp_objects(con, "itsp_sales_raw", os.path.join(work_dir, "itsp_sales"))
+    con.execute(f"""
+        CREATE OR REPLACE TABLE itsp_sales AS
+        WITH base AS (
+            SELECT _row, o, {_TOTAL_QTY} AS total_qty
+            FROM itsp_sales_raw
+        )
+        SELECT
+            _row,
+            CAST(o->>'$.id' AS BIGINT) AS "Order no.",
+            TRY_CAST(o->>'$.date' AS TIMESTAMP) AS "Date",
+            o->>'$.warehouse.warehouse' AS "Warehouse",
+            TRY_CAST(o->>'$.customer.id' AS BIGINT) AS "Customer ID",
+            o->>'$.customer.customer_name' AS "Customer",
+            o->>'$.reference' AS "Reference",
+            o->>'$.country.iso2' AS "Country",
+            TRY_CAST(o->>'$.shipping_costs_lcy' AS DOUBLE) AS "Shipping costs",
+            TRY_CAST(o->>'$.discount_lcy' AS DOUBLE) AS "Discount",
+            o->>'$.subsidiary.subsidiary' AS "Subsidiary",
+            {_case("TRY_CAST(o->>'$.type' AS INTEGER)", TYPE_MAP)} AS "Type",
+            {_case("TRY_CAST(o->>'$.status' AS INTEGER)", STATUS_MAP)} AS "Status",
+            o->>'$.webshop.webshop' AS "Webshop",
+            {_case("TRY_CAST(o->>'$.b2b_b2c_order' AS INTEGER)", B2B_B2C_MAP)} AS "Channel",
+            o->>'$.currency.iso' AS "Currency",
+            TRY_CAST(o->>'$.amount_lcy' AS DOUBLE) AS "Amount",
+            TRY_CAST(o->>'$.vat_amount_lcy' AS DOUBLE) AS "VAT value",
+            o->>'$.creation_date' AS "Creation date",
+            list_min(list_filter(o->>'$.payments[*].date', d -> d IS NOT NULL AND d <> '')) AS "Payment date",
+            CASE WHEN json_type(o->'$.payments') = 'ARRAY'
+                 THEN COALESCE(list_sum(CAST(o->>'$.payments[*].amount_rcy' AS DOUBLE[])), 0) * total_qty
+                 ELSE 0 END AS "Payment amount (LCY)",
+            o->>'$.payments[0].payment_method.payment_method' AS "Payment method",
+            total_qty AS "Total Qty",
+            TRY_CAST(o->>'$.amount_fcy' AS DOUBLE)
+                + TRY_CAST(o->>'$.discount_fcy' AS DOUBLE) AS "Subtotaal excl VAT",
+            TRY_CAST(o->>'$.amount_fcy' AS DOUBLE)
+                + TRY_CAST(o->>'$.shipping_costs_fcy' AS DOUBLE)
+                + TRY_CAST(o->>'$.vat_amount_fcy' AS DOUBLE) AS "Total incl. VAT",
+            o->>'$.marketplace_channel.channel' AS "Marketplace"
+        FROM base
+    """)
+
+
+def _load_itsp_returns(con, work_dir):
+    _load_itsp_objects(con, "itsp_returns_raw", os.path.join(work_dir, "itsp_returns"))
+    con.execute(f"""
+        CREATE OR REPLACE TABLE itsp_returns AS
+        SELECT
+            _row,
+            CAST(o->>'$.id' AS BIGINT) AS "Order no.",
+            TRY_CAST(o->>'$.date' AS TIMESTAMP) AS "Date",
+            o->>'$.warehouse.warehouse' AS "Warehouse",
+            TRY_CAST(o->>'$.customer.id' AS BIGINT) AS "Customer ID",
+            o->>'$.customer.customer_name' AS "Customer",
+            TRY_CAST(o->>'$.return_costs_lcy' AS DOUBLE) AS "Return costs",
+            TRY_CAST(o->>'$.discount_lcy' AS DOUBLE) AS "Discount",
+            o->>'$.remarks' AS "Comments",
+            o->>'$.country.iso2' AS "Country",
+            o->>'$.subsidiary.subsidiary' AS "Subsidiary",
+            TRY_CAST(o->>'$.quantity' AS DOUBLE) AS "Quantity",
+            TRY_CAST(o->>'$.amount_lcy' AS DOUBLE) AS "Amount",
+            TRY_CAST(o->>'$.postage_costs_lcy' AS DOUBLE) AS "Postage costs",
+            {_case("TRY_CAST(o->>'$.b2b_b2c_order' AS INTEGER)", B2B_B2C_MAP)} AS "Channel",
+            o->>'$.marketplace_channel.channel' AS "Marketplace"
+        FROM itsp_returns_raw
+    """)
+
+
+def _load_shopify(con, work_dir, sheet, slug):
+    """Renamed and typed Shopify sheet, or None when nothing was fetched."""
+    files = _files(os.path.join(work_dir, slug), ".parquet")
+    if not files:
+        return None
+
+    file_list = "[" + ", ".join(_literal(f) for f in files) + "]"
+    source = f"read_parquet({file_list}, filename = true, file_row_number = true, union_by_name = true)"
+    columns = [
+        c for c in con.execute(f"SELECT * FROM {source} LIMIT 0").df().columns
+        if c not in ("filename", "file_row_number")
+    ]
+
+    rename = SHOPIFY_RENAME_MAPS[slug]
+    schema = SHEET_SCHEMAS.get(sheet, {})
+    select = []
+    for col in columns:
+        name = rename.get(col, col)
+        spec = schema.get(name)
+        expr = _ident(col)
+        if spec and spec["dtype"] == "numeric":
+            expr = f"TRY_CAST({expr} AS DOUBLE)"
+        elif spec and spec["dtype"] == "date":
+            expr = f"TRY_CAST({expr} AS TIMESTAMP)"
+        select.append(f"{expr} AS {_ident(name)}")
+
+    table = f"shopify_{slug}"
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {table} AS
+        SELECT row_number() OVER (ORDER BY filename, file_row_number) AS _row,
+               {", ".join(select)}
+        FROM {source}
+    """)
+    return table
+
+
+# --------------------------------------------------
+# Per-partition outputs
+# --------------------------------------------------
+def _partition_table(con, source, table, partition):
+    subsidiary, channel, marketplace = partition
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {table} AS
+        SELECT * FROM {source}
+        WHERE "Subsidiary" IS NOT DISTINCT FROM ?
+          AND "Channel" IS NOT DISTINCT FROM ?
+          AND COALESCE("Marketplace", '') = ?
+    """, [subsidiary, channel, marketplace or ""])
+
+
+def _new_old_itsp_table(con, sales_table, table, old_columns):
+    """
+    SQL twin of services.generation.merge_old_itsp: this period's orders
+    not in Old ITSP yet, in Old ITSP's columns, into ``table``. Their
+    _row numbers follow on from the rows of old_itsp.
+    """
+    select = []
+    for col in old_columns:
+        if col == "Order no.":
+            select.append('CAST(s."Order no." AS VARCHAR) AS "Order no."')
+        elif col == "VAT %":
+            select.append(
+                'COALESCE(CASE WHEN s."Shipping costs" + s."Amount" = 0 THEN 0 '
+                'ELSE s."VAT value" / (s."Shipping costs" + s."Amount") END, 0) AS "VAT %"'
+            )
+        elif col == "Marketplace > Channel":
+            select.append('NULL AS "Marketplace > Channel"')
+        else:
+            select.append(f"s.{_ident(col)}")
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {table} AS
+        SELECT {", ".join(select)},
+               (SELECT count(*) FROM old_itsp) + row_number() OVER (ORDER BY s._row) AS _row
+        FROM {sales_table} s
+        WHERE CAST(s."Order no." AS VARCHAR) NOT IN (
+            SELECT "Order no." FROM old_itsp WHERE "Order no." IS NOT NULL
+        )
+    """)
+
+
+def _merged_old_itsp_view(con, new_table, view, old_key):
+    """Old ITSP plus ``new_table``, with the columns Recon reads."""
+    columns = ", ".join(_ident(c) for c in [old_key, "VAT %", "Shipping costs", "Total Qty"])
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW {view} AS
+        SELECT {columns}, rowid AS _row FROM old_itsp
+        UNION ALL
+        SELECT {columns}, _row FROM {new_table}
+    """)
+
+
+def _recon(con, shopify_table, tax_table, sales_table, returns_table, old_table, old_key):
+    """SQL twin of utils.recon.build_recon_frame."""
+    empty_shop = 'SELECT NULL::BIGINT AS _row, NULL::VARCHAR AS "Order", NULL::TIMESTAMP AS "Date", ' \
+                 'NULL::DOUBLE AS "Total sales", NULL::VARCHAR AS "Sale type" WHERE false'
+    empty_tax = 'SELECT NULL::VARCHAR AS "Order", NULL::DOUBLE AS "Rate" WHERE false'
+    shop_src = shopify_table or f"({empty_shop})"
+    tax_src = tax_table or f"({empty_tax})"
+    # Summary rows stand for "Lines" tax lines each (see utils.recon.tax_rates)
+    tax_columns = con.execute(f"SELECT * FROM {tax_src} LIMIT 0").df().columns
+    lines = '"Lines"' if "Lines" in tax_columns else "1"
+
+    recon = con.execute(f"""
+        WITH
+        shop AS (
+            SELECT _row, {_order_key('"Order"')} AS k, "Order" AS label, "Date",
+                   "Total sales" AS total, "Sale type" AS sale_type
+            FROM {shop_src}
+        ),
+        tax AS (
+            SELECT {_order_key('"Order"')} AS k,
+                   sum("Rate" * {lines}) / sum({lines}) FILTER (WHERE "Rate" IS NOT NULL) AS rate
+            FROM {tax_src} GROUP BY ALL
+        ),
+        sales AS (
+            SELECT _row, {_order_key('"Reference"')} AS k, "Reference" AS label, "Date",
+                   COALESCE("Shipping costs", 0) + COALESCE("Amount", 0)
+                   + COALESCE("VAT value", 0) AS total
+            FROM {sales_table}
+        ),
+        ret_refs AS (
+            SELECT *, list_distinct(list_transform(
+                       regexp_extract_all(trim("Comments"), {_literal(COMMENT_REF_PATTERN)}, 1),
+                       x -> upper(x))) AS refs
+            FROM {returns_table}
+        ),
+        ret AS (
+            SELECT *,
+                CASE WHEN len(refs) = 1 THEN refs[1]
+                     WHEN COALESCE(len(refs), 0) = 0
+                          AND regexp_full_match(trim("Comments"), {_literal(BARE_REF_PATTERN)})
+                     THEN upper(ltrim(trim("Comments"), '#'))
+                END AS k
+            FROM ret_refs
+        ),
+        old AS (
+            -- First row per order, like the VLOOKUPs of the formula sheets
+            SELECT {_order_key(_ident(old_key))} AS k,
+                   first(TRY_CAST("VAT %" AS DOUBLE) ORDER BY _row) AS vat,
+                   first(TRY_CAST("Shipping costs" AS DOUBLE) ORDER BY _row) AS shipping,
+                   COALESCE(sum("Total Qty"), 0) AS qty
+            FROM {old_table} GROUP BY ALL
+        ),
+        orders AS (
+            SELECT k FROM shop WHERE k IS NOT NULL
+            UNION SELECT k FROM sales WHERE k IS NOT NULL
+            UNION SELECT k FROM ret WHERE k IS NOT NULL
+        ),
+        shop_agg AS (
+            SELECT k, arg_min(label, _row) AS label, max("Date") AS date,
+                   sum(CASE WHEN sale_type = 'order' THEN total ELSE 0 END) AS sales,
+                   sum(CASE WHEN sale_type = 'return' THEN total ELSE 0 END) AS returns
+            FROM shop WHERE k IS NOT NULL GROUP BY k
+        ),
+        sales_agg AS (
+            SELECT k, arg_min(label, _row) AS label, max("Date") AS date, sum(total) AS total
+            FROM sales WHERE k IS NOT NULL GROUP BY k
+        ),
+        ret_agg AS (
+            SELECT r.k, sum(
+                (COALESCE(r."Amount", 0)
+                 + CASE WHEN r."Quantity" = o.qty THEN COALESCE(o.shipping, 0) ELSE 0 END)
+                * (1 + COALESCE(round_even(o.vat, 2), 0))
+            ) AS total
+            FROM ret r LEFT JOIN old o ON o.k = r.k
+            WHERE r.k IS NOT NULL GROUP BY r.k
+        ),
+        joined AS (
+            SELECT
+                orders.k,
+                COALESCE(sh.label, sa.label, orders.k) AS "Order Ref",
+                COALESCE(sh.date, sa.date) AS "Date",
+                COALESCE(t.rate, 0) AS vat,
+                o.vat AS old_vat,
+                o.k IS NOT NULL AS in_itsp,
+                COALESCE(sa.total, 0) AS itsp_sales,
+                -COALESCE(ra.total, 0) AS itsp_return,
+                COALESCE(sh.sales, 0) AS shopify_sales,
+                COALESCE(sh.returns, 0) AS shopify_return
+            FROM orders
+            LEFT JOIN shop_agg sh ON sh.k = orders.k
+            LEFT JOIN sales_agg sa ON sa.k = orders.k
+            LEFT JOIN ret_agg ra ON ra.k = orders.k
+            LEFT JOIN tax t ON t.k = orders.k
+            LEFT JOIN old o ON o.k = orders.k
+        )
+        SELECT
+            "Order Ref", "Date", NULL AS "Country",
+            vat AS "VAT %",
+            COALESCE(old_vat, vat) AS "VAT % (Old)",
+            vat - COALESCE(old_vat, vat) AS "Diff",
+            CASE WHEN in_itsp THEN 'Yes' ELSE 'No' END AS "In ITSP?",
+            NULL AS "Cancelled", NULL AS "Gift card", NULL AS "Gift card 2",
+            itsp_sales AS "ITSP Sales",
+            itsp_return AS "ITSP Return",
+            round_even(itsp_sales + itsp_return, 2) AS "Total ITSP",
+            shopify_sales AS "Shopify Sales",
+            shopify_return AS "Shopify Return",
+            round_even(shopify_sales + shopify_return, 2) AS "Total Shopify",
+            round_even(itsp_sales + itsp_return, 2)
+                - round_even(shopify_sales + shopify_return, 2) AS "Delta",
+            NULL AS "Comment"
+        FROM joined
+        ORDER BY k
+    """).df()
+    return recon[RECON_COLUMNS]
+
+
+def _materialize(con, table, drop=()):
+    if table is None:
+        return pd.DataFrame()
+    exclude = ", ".join(["_row", *(_ident(c) for c in drop)])
+    return con.execute(f"SELECT * EXCLUDE ({exclude}) FROM {table} ORDER BY _row").df()
+
+
+def _chunks(con, query):
+    """The result of ``query`` as DataFrames of CHUNK_VECTORS vectors each."""
+    result = con.execute(query)
+    while True:
+        chunk = result.fetch_df_chunk(CHUNK_VECTORS)
+        if chunk.empty:
+            return
+        yield chunk
+
+
+def _load_sources(con, work_dir, old_itsp_df):
+    """
+    Type the spilled pages and Old ITSP into tables. Returns the Shopify
+    tables by sheet, and the Old ITSP column Recon matches orders on.
+    """
+    _load_itsp_sales(con, work_dir)
+    _load_itsp_returns(con, work_dir)
+    shopify_tables = {
+        sheet: _load_shopify(con, work_dir, sheet, slug)
+        for sheet, slug in SHOPIFY_SLUGS.items()
+    }
+
+    # rowid keeps the order of the reference
+    con.execute("SET preserve_insertion_order = true")
+    con.register("old_itsp_df", old_itsp_df)
+    con.execute("CREATE OR REPLACE TABLE old_itsp AS SELECT * FROM old_itsp_df")
+    con.unregister("old_itsp_df")
+    con.execute("SET preserve_insertion_order = false")
+    old_key = "Reference" if "Reference" in old_itsp_df.columns else "Order no."
+    return shopify_tables, old_key
+
+
+def _partition_recon(con, i, partition, shopify_tables, old_key, old_columns):
+    """Partition tables of ITSP sales and returns, the new Old ITSP rows, and Recon."""
+    sales_table, returns_table = f"itsp_sales_{i}", f"itsp_returns_{i}"
+    new_old_table, old_view = f"old_itsp_new_{i}", f"old_itsp_merged_{i}"
+    _partition_table(con, "itsp_sales", sales_table, partition)
+    _partition_table(con, "itsp_returns", returns_table, partition)
+    _new_old_itsp_table(con, sales_table, new_old_table, old_columns)
+
+    # Recon reads the merged Old ITSP, like the pandas path
+    _merged_old_itsp_view(con, new_old_table, old_view, old_key)
+    recon_df = _recon(
+        con,
+        shopify_tables["Shopify incl. returns"],
+        shopify_tables["Shopify Tax"],
+        sales_table,
+        returns_table,
+        old_view,
+        old_key,
+    )
+    return sales_table, returns_table, new_old_table, recon_df
+
+
+def run_lazy(start_date, end_date, old_itsp_df, partitions, shopify_profile="detail",
+             memory_limit=DEFAULT_MEMORY_LIMIT, work_dir=None):
+    """
+    Fetch and transform the period out of core.
+
+    Returns ``{partition: (sheets, recon_df)}`` where ``sheets`` holds the
+    Shopify, ITSP and merged Old ITSP sheets as DataFrames (no Backend).
+    These are materialized in memory; write_lazy() builds the workbooks
+    without that.
+    """
+    with tempfile.TemporaryDirectory(prefix="ecom_recon_", dir=work_dir) as tmp:
+        spill_sources(tmp, start_date, end_date, shopify_profile)
+
+        con = _connect(tmp, memory_limit)
+        try:
+            shopify_tables, old_key = _load_sources(con, tmp, old_itsp_df)
+            shopify_dfs = {
+                sheet: _materialize(con, table) for sheet, table in shopify_tables.items()
+            }
+
+            results = {}
+            for i, partition in enumerate(partitions):
+                sales_table, returns_table, new_old_table, recon_df = _partition_recon(
+                    con, i, partition, shopify_tables, old_key, list(old_itsp_df.columns)
+                )
+                new_rows = _materialize(con, new_old_table)
+                sheets = {
+                    **shopify_dfs,
+                    "ITSP Sales": _materialize(con, sales_table, ["Marketplace"]),
+                    "ITSP Returns": _materialize(con, returns_table, ["Channel", "Marketplace"]),
+                    "Old ITSP": pd.concat([old_itsp_df, new_rows], ignore_index=True),
+                }
+                results[partition] = (sheets, recon_df)
+        finally:
+            con.close()
+
+    return results
+
+
+# --------------------------------------------------
+# Workbooks
+#
+# Sheets go from DuckDB to the direct writer CHUNK_VECTORS vectors
+# (2048 rows each) at a time, so no sheet is ever held whole as a
+# DataFrame: the old Old ITSP rows and the period's new ones are written
+# one after the other from their tables. What stays in memory is the
+# deflated sheet XML, Recon (one row per order) and the small Backend,
+# besides the Old ITSP frame the caller read from the reference.
+# --------------------------------------------------
+CHUNK_VECTORS = 25
+
+
+def _stream_table(con, sheet, sources):
+    """SheetPart from ``(table, columns to leave out)`` pairs, rows in _row order; None if empty."""
+    selects = [
+        f"SELECT * EXCLUDE ({', '.join(['_row', *(_ident(c) for c in drop)])}) FROM {table}"
+        for table, drop in sources if table is not None
+    ]
+    if not selects:
+        return None
+    n_rows = sum(con.execute(f"SELECT count(*) FROM ({q})").fetchone()[0] for q in selects)
+    if not n_rows:
+        return None
+    columns = list(con.execute(f"{selects[0]} LIMIT 0").df().columns)
+
+    def chunks():
+        for q in selects:
+            yield from _chunks(con, f"{q} ORDER BY _row")
+
+    return stream_sheet_part(sheet, columns, n_rows, chunks())
+
+
+def write_lazy(start_date, end_date, old_itsp_df, backend_df, partitions, shopify_profile="detail",
+               memory_limit=DEFAULT_MEMORY_LIMIT, work_dir=None):
+    """
+    Same workbooks as services.generation.generate, through the
+    out-of-core engine: ``{partition: workbook}``.
+    """
+    written = [
+        sheet for sheet in SHOPIFY_SLUGS
+        if not (shopify_profile == "summary" and sheet in SUMMARY_SHEETS)
+    ]
+    with tempfile.TemporaryDirectory(prefix="ecom_recon_", dir=work_dir) as tmp:
+        spill_sources(tmp, start_date, end_date, shopify_profile)
+
+        con = _connect(tmp, memory_limit)
+        try:
+            shopify_tables, old_key = _load_sources(con, tmp, old_itsp_df)
+            old_columns = list(old_itsp_df.columns)
+            # old_itsp has a rowid, not a _row column
+            con.execute("CREATE OR REPLACE TEMP VIEW old_itsp_rows AS SELECT *, rowid AS _row FROM old_itsp")
+
+            shared = [serialize_sheet("Backend", backend_df)]
+            shared += [_stream_table(con, sheet, [(shopify_tables[sheet], ())]) for sheet in written]
+
+            outputs = {}
+            for i, partition in enumerate(partitions):
+                sales_table, returns_table, new_old_table, recon_df = _partition_recon(
+                    con, i, partition, shopify_tables, old_key, old_columns
+                )
+                parts = shared + [
+                    _stream_table(con, "ITSP Sales", [(sales_table, ["Marketplace"])]),
+                    _stream_table(con, "ITSP Returns", [(returns_table, ["Channel", "Marketplace"])]),
+                    _stream_table(con, "Old ITSP", [("old_itsp_rows", ()), (new_old_table, ())]),
+                    serialize_sheet("Recon", recon_df, as_table=False),
+                ]
+                outputs[partition] = assemble_workbook(parts)
+        finally:
+            con.close()
+
+    return outputs
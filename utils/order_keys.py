@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+from utils.helpers import lazy_import
+
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Order key normalization
+#
+# The sources disagree on how an order is referenced: Shopify uses the
+# order name ("#1234"), ITSP sales the Reference field, ITSP returns
+# mention it somewhere in the free-text Comments. Everything is reduced
+# to the same key: no "#", no whitespace, upper case.
+# --------------------------------------------------
+COMMENT_REF_PATTERN = r"#\s*([A-Za-z0-9][A-Za-z0-9_-]*)"
+BARE_REF_PATTERN = r"^#?[A-Za-z0-9_-]*[0-9][A-Za-z0-9_-]*$"
+
+# Key column per source sheet, and whether it is free text
+ORDER_KEY_SOURCES = {
+    "Shopify incl. returns": ("Order", False),
+    "Shopify Tax": ("Order", False),
+    "ITSP Sales": ("Reference", False),
+    "ITSP Returns": ("Comments", True),
+    "Old ITSP": ("Reference", False),
+}
+
+
+def normalize_order_keys(values: pd.Series) -> pd.Series:
+    keys = (
+        values.astype("string")
+        .str.replace(r"\s+", "", regex=True)
+        .str.lstrip("#")
+        .str.upper()
+    )
+    return keys.mask(keys == "")
+
+
+def extract_order_keys(comments: pd.Series):
+    """
+    Pull the order reference out of free-text comments.
+
+    Returns ``(keys, ambiguous)``: the normalized key per row (NA when no
+    single reference was found) and a mask of rows mentioning more than
+    one distinct order.
+    """
+    text = comments.astype("string").str.strip()
+    refs = text.str.findall(COMMENT_REF_PATTERN).map(
+        lambda found: sorted({f.upper() for f in found}) if isinstance(found, list) else []
+    )
+
+    # Comments that are just the reference itself, without a "#"
+    bare = text.str.fullmatch(BARE_REF_PATTERN).fillna(False).astype(bool)
+    refs = refs.where(refs.str.len() > 0, text.where(bare).map(
+        lambda t: [t.lstrip("#").upper()] if isinstance(t, str) else []
+    ))
+
+    ambiguous = refs.str.len() > 1
+    keys = refs.map(lambda r: r[0] if len(r) == 1 else None).astype("string")
+    return keys, ambiguous
+
+
+class OrderIndex:
+    """
+    Hashed index from normalized order key to the row positions of one
+    source frame. Built once per source; lookups are dict lookups.
+    """
+
+    def __init__(self, name, df, column, free_text=False):
+        self.name = name
+        self.df = df
+        self.column = column
+        self.free_text = free_text
+        if df.empty or column not in df.columns:
+            self.keys = pd.Series(pd.NA, index=df.index, dtype="string")
+            ambiguous = pd.Series(False, index=df.index)
+        elif free_text:
+            self.keys, ambiguous = extract_order_keys(df[column])
+        else:
+            self.keys = normalize_order_keys(df[column])
+            ambiguous = pd.Series(False, index=df.index)
+
+        self.positions = (
+            self.keys.groupby(self.keys.values, sort=False).indices
+            if len(self.keys) else {}
+        )
+        self.unkeyed = int(self.keys.isna().sum() - ambiguous.sum())
+        self.ambiguous = int(ambiguous.sum())
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def rows(self, key):
+        """Rows of the source frame for ``key`` (empty frame if unknown)."""
+        return self.df.iloc[self.positions.get(key, [])]
+
+    def aggregate(self, values, how="sum"):
+        """
+        Per-key aggregate of ``values`` (a column name or a Series aligned
+        with the source frame), indexed by normalized key.
+        """
+        if isinstance(values, str):
+            if values not in self.df.columns:
+                return pd.Series(dtype=float)
+            values = self.df[values]
+        return values.groupby(self.keys.values, sort=False).agg(how)
+
+    def first(self, values):
+        """
+        Value of the first row of each key, blank or not, the way a
+        VLOOKUP finds it. Indexed by normalized key.
+        """
+        if isinstance(values, str):
+            if values not in self.df.columns:
+                return pd.Series(dtype=float)
+            values = self.df[values]
+        keys = list(self.positions)
+        firsts = [self.positions[k][0] for k in keys]
+        return pd.Series(values.values[firsts], index=keys)
+
+    def labels(self):
+        """First spelling of each key as it appears in the source."""
+        if self.free_text or self.column not in self.df.columns:
+            return pd.Series(list(self.positions), index=list(self.positions), dtype=object)
+        return self.aggregate(self.column, "first")
+
+
+def build_order_indexes(sheets: dict) -> dict:
+    """Build one OrderIndex per source sheet present in ``sheets``."""
+    indexes = {}
+    for sheet, (column, free_text) in ORDER_KEY_SOURCES.items():
+        df = sheets.get(sheet, pd.DataFrame())
+        if sheet == "Old ITSP" and column not in df.columns:
+            column = "Order no."
+        indexes[sheet] = OrderIndex(sheet, df, column, free_text)
+    return indexes
+
+
+def match_report(indexes: dict) -> pd.DataFrame:
+    """
+    Per source: distinct keys, keys found in no other source, rows
+    without a usable key and rows referencing several orders.
+    """
+    rows = []
+    for name, index in indexes.items():
+        others = set()
+        for other_name, other in indexes.items():
+            if other_name != name:
+                others.update(other.positions)
+        rows.append({
+            "Source": name,
+            "Rows": len(index.df),
+            "Orders": len(index),
+            "Unmatched": sum(1 for k in index.positions if k not in others),
+            "No key": index.unkeyed,
+            "Ambiguous": index.ambiguous,
+        })
+    return pd.DataFrame(rows)
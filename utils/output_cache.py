@@ -0,0 +1,122 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+from utils.helpers import private_dir, user_temp_dir
+from utils.partitions import partition_filename
+
+# --------------------------------------------------
+# Output cache
+#
+# Generated workbooks are kept on disk under a key made of everything
+# that determines them: the period, the reference workbook, the
+# partitions and options, and the version of the source data. Asking
+# again for an unchanged period serves the files from disk.
+#
+# Manifests are pickles, so the cache lives in a directory only its user
+# can write to (utils.helpers.private_dir).
+# --------------------------------------------------
+OUTPUT_CACHE_DIR = os.environ.get(
+    "RECON_OUTPUT_CACHE_DIR", user_temp_dir("ecom_recon_outputs")
+)
+MAX_ENTRIES = 20
+
+# Bump when a change makes previously generated workbooks stale
+CACHE_VERSION = 2
+
+# A period that ended this many days ago no longer changes in ITSP or
+# Shopify; until then its data is taken as fresh for OPEN_PERIOD_TTL
+SETTLED_AFTER_DAYS = 3
+OPEN_PERIOD_TTL = 15 * 60
+
+MANIFEST = "manifest.pkl"
+
+
+def source_version(start_date, end_date, now=None):
+    """
+    Version of the source data of a period: fixed once the period has
+    settled, otherwise the current OPEN_PERIOD_TTL window.
+    """
+    now = time.time() if now is None else now
+    if end_date < date.fromtimestamp(now) - timedelta(days=SETTLED_AFTER_DAYS):
+        return "settled"
+    return f"open-{int(now // OPEN_PERIOD_TTL)}"
+
+
+def output_key(start_date, end_date, reference: bytes, partitions, engine, incremental=False,
+               patch=False, shopify_profile="detail", now=None):
+    digest = hashlib.sha256()
+    for part in [
+        CACHE_VERSION, start_date, end_date, hashlib.sha256(reference).hexdigest(),
+        sorted(map(tuple, partitions), key=repr), engine, incremental, patch,
+        shopify_profile, source_version(start_date, end_date, now),
+    ]:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def load_outputs(key, cache_dir=OUTPUT_CACHE_DIR):
+    """
+    ``{partition: (path, match_report)}`` of a cached run, or None.
+    Match reports are None where the engine does not produce one.
+    """
+    entry = os.path.join(private_dir(cache_dir), key)
+    try:
+        with open(os.path.join(entry, MANIFEST), "rb") as f:
+            manifest = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+    cached = {}
+    for partition, (file_name, report) in manifest.items():
+        path = os.path.join(entry, file_name)
+        if not os.path.exists(path):
+            return None
+        cached[partition] = (path, report)
+
+    os.utime(entry)
+    return cached
+
+
+def store_outputs(key, outputs, match_reports=None, cache_dir=OUTPUT_CACHE_DIR):
+    """Write the workbooks of a run to the cache and return load_outputs(key)."""
+    match_reports = match_reports or {}
+    private_dir(cache_dir)
+    staging = tempfile.mkdtemp(dir=cache_dir, prefix=".tmp-")
+
+    manifest = {}
+    for partition, output in outputs.items():
+        file_name = partition_filename(partition)
+        output.seek(0)
+        with open(os.path.join(staging, file_name), "wb") as f:
+            shutil.copyfileobj(output, f, length=1024 * 1024)
+        manifest[partition] = (file_name, match_reports.get(partition))
+    with open(os.path.join(staging, MANIFEST), "wb") as f:
+        pickle.dump(manifest, f)
+
+    entry = os.path.join(cache_dir, key)
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.replace(staging, entry)
+    except OSError:
+        # Another run stored the same key meanwhile
+        shutil.rmtree(staging, ignore_errors=True)
+
+    prune(cache_dir)
+    return load_outputs(key, cache_dir)
+
+
+def prune(cache_dir=OUTPUT_CACHE_DIR, max_entries=MAX_ENTRIES):
+    """Drop the least recently used entries beyond ``max_entries``."""
+    entries = [
+        e for e in os.scandir(cache_dir)
+        if e.is_dir() and not e.name.startswith(".")
+    ]
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for e in entries[max_entries:]:
+        shutil.rmtree(e.path, ignore_errors=True)
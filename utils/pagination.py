@@ -1,32 +1,134 @@
-import time
-import requests
-from utils.auth import get_itsperfect_token
-
-def fetch_paginated(url, headers, limit=250):
-    all_data = []
-
-    # First, get total pages (optional)
-    r = requests.get(f"{url}&limit={limit}&page=1", headers=headers)
-    r.raise_for_status()
-    total_pages = int(r.headers.get("X-Pagination-Page-Count", 1))
-    
-    for page in range(1, total_pages + 1):
-        while True:
-            r = requests.get(f"{url}&limit={limit}&page={page}", headers=headers)
-            print(f"Fetched {len(all_data)} orders so far...")
-            if r.status_code == 429:
-                # rate limit handling
-                time.sleep(4)
-                continue
-            elif r.status_code == 401:
-                headers["Authorization"] = f"Bearer {get_itsperfect_token()}"
-                continue
-            r.raise_for_status()
-            break
-
-        data = r.json()
-        all_data.extend(data)
-
-
-    return all_data
-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.auth import get_itsperfect_token
+from utils.checkpoints import PageCheckpoints
+from utils.hedging import TIMEOUT_RETRIES, hedged, request_timeout
+from utils.helpers import decode_json, encode_json, lazy_import
+from utils.planner import PagePlan, itsp_endpoint
+
+requests = lazy_import("requests")
+pd = lazy_import("pandas")
+
+# The page workers of one fetch share its headers dict: a 401 refreshes
+# the token once, under this lock, and each request sends its own copy
+_token_lock = threading.Lock()
+
+def _refresh_token(headers, rejected):
+    with _token_lock:
+        # Another worker may have replaced the rejected token already
+        if headers.get("Authorization") == rejected:
+            headers["Authorization"] = f"Bearer {get_itsperfect_token()}"
+
+def _get_page(url, headers, limit, page, plan):
+    timeouts = 0
+    while True:
+        with _token_lock:
+            sent = dict(headers)
+        t0 = time.perf_counter()
+        try:
+            r = requests.get(f"{url}&limit={limit}&page={page}", headers=sent,
+                             timeout=request_timeout())
+        except requests.Timeout:
+            timeouts += 1
+            if timeouts > TIMEOUT_RETRIES:
+                raise
+            continue
+        if r.status_code == 429:
+            # rate limit handling
+            if plan is not None:
+                plan.throttle()
+            time.sleep(4)
+            continue
+        elif r.status_code == 401:
+            _refresh_token(headers, sent.get("Authorization"))
+            continue
+        r.raise_for_status()
+        return r, time.perf_counter() - t0
+
+def count_rows(url, headers):
+    """Rows behind an Itsperfect list URL: the page count of one-row pages."""
+    r, _ = _get_page(url, headers, 1, 1, None)
+    return int(r.headers.get("X-Pagination-Page-Count", len(decode_json(r))))
+
+def fetch_paginated(url, headers, as_frame=False, sink=None):
+    """
+    Fetch every page of an Itsperfect list endpoint.
+
+    Returns a list of dicts, or a DataFrame when ``as_frame`` is set. In the
+    latter case each page is turned into a frame as soon as it is decoded,
+    so the raw dicts of a page can be released before the next one arrives.
+
+    With ``sink``, each page is handed over as ``sink(offset, content)``
+    (``offset`` being the index of its first row, ``content`` the JSON
+    body) and nothing is kept in memory.
+
+    Page size and the number of pages fetched at once are chosen by
+    utils.planner after the first page. Pages are checkpointed (see
+    utils.checkpoints), so a pull of the same URL that failed halfway
+    resumes after the pages it got.
+    """
+    plan = PagePlan(itsp_endpoint(url), "itsp")
+    checkpoints = PageCheckpoints("itsp", url)
+    pages = {}
+
+    def keep(offset, content, rows):
+        if sink is not None:
+            sink(offset, content)
+        else:
+            pages[offset] = pd.DataFrame(rows) if as_frame else rows
+        print(f"Fetched {offset + len(rows)} orders so far...")
+
+    def fetch(limit, page, skip=0):
+        """Keep one page (minus its first ``skip`` rows), return the page count."""
+        offset = (page - 1) * limit + skip
+        saved = checkpoints.load(offset, limit)
+        if saved is not None:
+            content, page_count = saved
+            plan.reuse()
+            keep(offset, content, decode_json(content))
+            return page_count
+
+        r, seconds = hedged(lambda: _get_page(url, headers, limit, page, plan), plan)
+        rows = decode_json(r)
+        plan.observe(seconds, len(r.content), len(rows))
+        rows = rows[skip:]
+        content = encode_json(rows) if skip else r.content
+        page_count = int(r.headers.get("X-Pagination-Page-Count", page))
+        checkpoints.save(offset, limit, len(rows), (content, page_count), last=page >= page_count)
+        keep(offset, content, rows)
+        return page_count
+
+    # Pages an earlier attempt already got
+    resumed, fetched, complete = checkpoints.resume()
+    for offset, (content, _) in resumed:
+        plan.reuse()
+        keep(offset, content, decode_json(content))
+
+    if not complete:
+        # The first page tells the total and how heavy a row is
+        limit = plan.limit
+        first = fetched // limit + 1
+        total_pages = fetch(limit, first, fetched % limit)
+        next_page = first + 1
+
+        if total_pages > first:
+            new_limit, workers = plan.choose(remaining_rows=(total_pages - first) * limit)
+            if new_limit != limit:
+                # Resume right after the rows already fetched, at the new size
+                fetched = first * limit
+                first = fetched // new_limit + 1
+                total_pages = fetch(new_limit, first, fetched % new_limit)
+                limit, next_page = new_limit, first + 1
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda page: fetch(limit, page), range(next_page, total_pages + 1)))
+
+    plan.save()
+
+    ordered = [pages[offset] for offset in sorted(pages)]
+    if as_frame:
+        frames = [f for f in ordered if not f.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    return [row for data in ordered for row in data]
@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+from utils.helpers import lazy_import
+
+pd = lazy_import("pandas")
+
+
+# --------------------------------------------------
+# Export partitions
+#
+# An ITSP pull covers every entity; a partition selects the orders that
+# belong to one export (subsidiary, B2B/B2C channel and marketplace
+# channel, where None means "not sold through a marketplace").
+# --------------------------------------------------
+Partition = namedtuple("Partition", ["subsidiary", "channel", "marketplace"])
+
+DEFAULT_PARTITION = Partition("Fab BV", "B2C order", None)
+
+PARTITION_COLS = ["Subsidiary", "Channel", "Marketplace"]
+
+
+def parse_partitions(text):
+    """
+    Parse one partition per line, written as
+    ``Subsidiary, Channel[, Marketplace]``.
+    """
+    partitions = []
+    for line in text.splitlines():
+        parts = [p.strip() for p in line.split(",")]
+        if not parts[0]:
+            continue
+        if len(parts) < 2:
+            raise ValueError(f"Partition needs a subsidiary and a channel: {line!r}")
+        marketplace = parts[2] if len(parts) > 2 and parts[2] else None
+        partitions.append(Partition(parts[0], parts[1], marketplace))
+    return partitions
+
+
+def partition_label(partition):
+    return " / ".join(p for p in partition if p) or "All"
+
+
+def partition_filename(partition):
+    suffix = "" if partition == DEFAULT_PARTITION else "_" + "_".join(
+        p.replace(" ", "-") for p in partition if p
+    )
+    return f"ecom_recon{suffix}.xlsx"
+
+
+def _partition_keys(df):
+    # Missing values (e.g. no marketplace) are keyed as ""
+    return df[PARTITION_COLS].fillna("")
+
+
+def in_partitions(df, partitions):
+    """Boolean mask of the rows of ``df`` that fall in any of ``partitions``."""
+    wanted = pd.MultiIndex.from_tuples([tuple(v or "" for v in p) for p in partitions])
+    return pd.MultiIndex.from_frame(_partition_keys(df)).isin(wanted)
+
+
+def split_by_partition(df, partitions):
+    """
+    Split ``df`` into one frame per partition in a single pass.
+
+    ``df`` must carry the PARTITION_COLS columns; they are matched as-is
+    and ``Marketplace`` is dropped from the returned frames.
+    """
+    partitions = list(dict.fromkeys(partitions))
+    if "Marketplace" not in df.columns:
+        return {p: df for p in partitions}
+
+    groups = _partition_keys(df).groupby(PARTITION_COLS, sort=False).indices
+
+    return {
+        p: df.iloc[groups.get(tuple(v or "" for v in p), [])].drop(columns="Marketplace")
+        for p in partitions
+    }
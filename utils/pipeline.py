@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.helpers import lazy_import
+
+pd = lazy_import("pandas")
+
+
+# --------------------------------------------------
+# Stage graph
+#
+# A stage runs as soon as all the stages it depends on have finished,
+# and receives their results as keyword arguments, named after the
+# dependency unless ``args`` maps it to another keyword.
+# --------------------------------------------------
+Stage = namedtuple("Stage", ["name", "func", "deps", "args"], defaults=((), None))
+
+
+def run_stages(stages, max_workers=8, profiler=None):
+    """
+    Run ``stages`` on a thread pool, each one as soon as its inputs are
+    ready.
+
+    ``args`` maps dependency names to keyword names when they differ.
+    Returns ``(results, timeline)`` where ``timeline`` has one row per
+    stage with its start/end offsets in seconds. A ``profiler``
+    (utils.profiler.RunProfiler) is told when each stage starts and ends.
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"Stage {s.name!r} depends on unknown stages {missing}")
+
+    results = {}
+    timeline = []
+    lock = threading.Lock()
+    t0 = time.perf_counter()
+
+    def run(stage):
+        start = time.perf_counter() - t0
+        kwargs = {
+            (stage.args or {}).get(dep, dep): results[dep]
+            for dep in stage.deps
+        }
+        if profiler is None:
+            value = stage.func(**kwargs)
+        else:
+            profiler.stage_started(stage.name)
+            try:
+                value = stage.func(**kwargs)
+            finally:
+                profiler.stage_finished(stage.name)
+        end = time.perf_counter() - t0
+        with lock:
+            timeline.append({
+                "Stage": stage.name,
+                "Thread": threading.current_thread().name,
+                "Start (s)": round(start, 3),
+                "End (s)": round(end, 3),
+                "Duration (s)": round(end - start, 3),
+            })
+        return value
+
+    pending = dict(by_name)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as pool:
+        while pending or running:
+            ready = [
+                s for s in pending.values()
+                if all(d in results for d in s.deps)
+            ]
+            for s in ready:
+                del pending[s.name]
+                running[pool.submit(run, s)] = s.name
+
+            if not running:
+                raise ValueError(f"Stages can never run (cycle?): {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    for f in running:
+                        f.cancel()
+                    raise
+
+    timeline_df = pd.DataFrame(timeline).sort_values("Start (s)", ignore_index=True)
+    return results, timeline_df
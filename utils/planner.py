@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from utils.helpers import lazy_import, private_dir, user_temp_dir
+
+pd = lazy_import("pandas")
+
+
+# --------------------------------------------------
+# Page size and concurrency planning
+#
+# The first page of a pull is fetched with the size remembered for the
+# endpoint (or the default), then its latency and bytes per row decide
+# the page size and the number of pages in flight for the rest of the
+# pull. The choice is kept per endpoint for the next run, in a directory
+# only its user can write to: the plans set how hard the APIs are hit.
+# --------------------------------------------------
+PLANS_DIR = os.environ.get("RECON_PLANS_DIR", user_temp_dir("ecom_recon_plans"))
+PLANS_PATH = os.path.join(PLANS_DIR, "plans.json")
+
+PLAN_BOUNDS = {
+    "itsp": {"limit": (25, 500), "step": 25, "default": 250, "workers": (1, 4)},
+    "shopify": {"limit": (1000, 10000), "step": 500, "default": 3000, "workers": (1, 3)},
+}
+
+# A page should stay under both, whichever is hit first
+TARGET_PAGE_BYTES = 2 * 1024 * 1024
+TARGET_PAGE_SECONDS = 3.0
+# One more page in flight per this many seconds a page takes
+SECONDS_PER_WORKER = 1.0
+
+# Hedged requests (utils.hedging): a page slower than this percentile of
+# the pull's pages so far (and at least HEDGE_MIN_DELAY) is requested
+# again, for at most HEDGE_BUDGET of the pull's pages and never once
+# the endpoint has throttled
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 5
+HEDGE_MIN_DELAY = 1.0
+HEDGE_BUDGET = 0.1
+
+_lock = threading.Lock()
+_run_metrics = []
+
+
+def itsp_endpoint(url):
+    """Endpoint key of an ITSP list URL: path plus what it includes."""
+    parts = urlsplit(url)
+    includes = parse_qs(parts.query).get("includes", [""])[0]
+    path = parts.path.rstrip("/").rsplit("/", 1)[-1]
+    return f"itsp:{path}" + (f"?includes={includes}" if includes else "")
+
+
+def shopify_endpoint(graphql_url, query):
+    """Endpoint key of a ShopifyQL query: store plus the dataset it reads."""
+    dataset = re.search(r"FROM\s+(\w+)", query)
+    return f"shopify:{urlsplit(graphql_url).netloc}:{dataset.group(1) if dataset else '?'}"
+
+
+def load_plans(path=PLANS_PATH):
+    private_dir(os.path.dirname(path))
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _round(value, step, bounds):
+    lo, hi = bounds
+    return int(min(hi, max(lo, step * round(value / step))))
+
+
+class PagePlan:
+    """Measurements and choices for one pull of one endpoint."""
+
+    def __init__(self, endpoint, client, path=PLANS_PATH):
+        self.endpoint = endpoint
+        self.bounds = PLAN_BOUNDS[client]
+        self.path = path
+        remembered = load_plans(path).get(endpoint, {})
+        self.limit = _round(remembered.get("limit", self.bounds["default"]),
+                            self.bounds["step"], self.bounds["limit"])
+        self.workers = remembered.get("workers", self.bounds["workers"][0])
+        self.start_limit = self.limit
+        self.seconds = 0.0
+        self.bytes = 0
+        self.rows = 0
+        self.pages = 0
+        self.throttled = 0
+        self.reused = 0
+        self.hedged = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, nbytes, rows):
+        with self._lock:
+            self.seconds += seconds
+            self.bytes += nbytes
+            self.rows += rows
+            self.pages += 1
+            self.latencies.append(seconds)
+
+    def throttle(self):
+        with self._lock:
+            self.throttled += 1
+
+    def hedge_delay(self):
+        """Seconds after which a page request gets hedged, None while too few pages are known."""
+        with self._lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, math.ceil(HEDGE_PERCENTILE * len(latencies)) - 1)
+        return max(HEDGE_MIN_DELAY, latencies[index])
+
+    def take_hedge(self):
+        """Whether one more hedge fits in the budget."""
+        with self._lock:
+            if self.throttled or self.hedged >= HEDGE_BUDGET * self.pages:
+                return False
+            self.hedged += 1
+            return True
+
+    def reuse(self):
+        """A page was taken from a checkpoint instead of fetched."""
+        with self._lock:
+            self.reused += 1
+
+    def choose(self, remaining_rows=None):
+        """Page size and pages in flight for the rest of the pull."""
+        if self.rows:
+            bytes_per_row = self.bytes / self.rows
+            seconds_per_row = self.seconds / self.rows
+            by_bytes = TARGET_PAGE_BYTES / max(bytes_per_row, 1)
+            by_time = TARGET_PAGE_SECONDS / max(seconds_per_row, 1e-6)
+            self.limit = _round(min(by_bytes, by_time), self.bounds["step"], self.bounds["limit"])
+
+            lo, hi = self.bounds["workers"]
+            page_seconds = seconds_per_row * self.limit
+            self.workers = min(hi, max(lo, math.ceil(page_seconds / SECONDS_PER_WORKER)))
+
+        if self.throttled:
+            self.workers = max(self.bounds["workers"][0], self.workers // 2)
+        if remaining_rows is not None:
+            self.workers = max(1, min(self.workers, math.ceil(remaining_rows / self.limit)))
+        return self.limit, self.workers
+
+    def save(self):
+        """Remember the choice for the endpoint and add it to the run metrics."""
+        with _lock:
+            plan = {
+                "limit": self.limit,
+                "workers": self.workers,
+                "bytes_per_row": round(self.bytes / self.rows, 1) if self.rows else None,
+                "seconds_per_page": round(self.seconds / self.pages, 3) if self.pages else None,
+            }
+            # An empty pull says nothing about the endpoint
+            if self.rows:
+                plans = load_plans(self.path)
+                plans[self.endpoint] = plan
+                private_dir(os.path.dirname(self.path))
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(plans, f, indent=2)
+                os.replace(self.path + ".tmp", self.path)
+
+            _run_metrics.append({
+                "Endpoint": self.endpoint,
+                "Start limit": self.start_limit,
+                "Limit": self.limit,
+                "Workers": self.workers,
+                "Pages": self.pages,
+                "Rows": self.rows,
+                "Bytes/row": plan["bytes_per_row"],
+                "Latency (s)": plan["seconds_per_page"],
+                "Throttled": self.throttled,
+                "Reused pages": self.reused,
+                "Hedged": self.hedged,
+            })
+
+
+def take_run_metrics() -> pd.DataFrame:
+    """The plans chosen since the last call, one row per pull."""
+    with _lock:
+        metrics = list(_run_metrics)
+        _run_metrics.clear()
+    return pd.DataFrame(metrics)
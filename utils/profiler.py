@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+from utils.helpers import lazy_import
+
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Run profiler
+#
+# Opt-in for one generation run: a thread samples the stacks of the
+# threads doing work (wall clock, so waiting on the network shows up
+# too) into folded stacks for flamegraph.pl / speedscope, and
+# tracemalloc diffs a snapshot at the start and end of every stage.
+# Nothing here is touched unless a RunProfiler is passed in.
+# --------------------------------------------------
+SAMPLE_INTERVAL = 0.005
+TOP_ALLOCATORS = 10
+TRACEBACK_FRAMES = 1
+
+_IGNORED_FILES = [tracemalloc.__file__, __file__, "<frozen importlib._bootstrap>"]
+
+
+def _frame_name(code):
+    path = code.co_filename
+    short = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+    return f"{code.co_name} ({short}:{code.co_firstlineno})"
+
+
+class RunProfiler:
+    """
+    Context manager profiling what runs inside it.
+
+    Stage runners call stage_started/stage_finished (see
+    utils.pipeline.run_stages) so samples and allocations are labelled
+    by stage; anything else is sampled on the thread that entered the
+    profiler.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, top=TOP_ALLOCATORS):
+        self.interval = interval
+        self.top = top
+        self.samples = Counter()
+        self._active = {}      # thread ident -> stage name
+        self._snapshots = {}   # stage name -> snapshot at its start
+        self._diffs = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -------------------
+    # Run
+    # -------------------
+    def __enter__(self):
+        self._owner = threading.get_ident()
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(TRACEBACK_FRAMES)
+        self._run_snapshot = self._snapshot()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._record("Run", self._run_snapshot, self._snapshot())
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes = peak
+        if self._started_tracing:
+            tracemalloc.stop()
+        return False
+
+    def stage_started(self, name):
+        snapshot = self._snapshot()
+        with self._lock:
+            self._active[threading.get_ident()] = name
+            self._snapshots[name] = snapshot
+
+    def stage_finished(self, name):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            start = self._snapshots.pop(name)
+        self._record(name, start, self._snapshot())
+
+    # -------------------
+    # Sampling
+    # -------------------
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                active = dict(self._active)
+            frames = sys._current_frames()
+            # The owner thread only counts while no stage is running,
+            # otherwise it is just waiting on them
+            if not active and self._owner in frames:
+                active[self._owner] = "Run"
+            for ident, root in active.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(root)
+                self.samples[";".join(reversed(stack))] += 1
+
+    # -------------------
+    # Allocations
+    # -------------------
+    def _snapshot(self):
+        return tracemalloc.take_snapshot()
+
+    def _record(self, stage, start, end):
+        # Diffed only when the results are asked for, off the run's path
+        with self._lock:
+            self._diffs.append((stage, start, end))
+
+    # -------------------
+    # Results
+    # -------------------
+    def folded(self) -> str:
+        """Folded stacks (``frame;frame;... count``), one per line."""
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.samples.items()))
+
+    def allocations(self) -> pd.DataFrame:
+        """Top allocating lines per stage, and for the whole run."""
+        rows = []
+        for stage, start, end in self._diffs:
+            # Stages run concurrently, so the diff also holds what others
+            # allocated meanwhile
+            stats = [
+                stat for stat in end.compare_to(start, "lineno")
+                if stat.size_diff > 0 and stat.traceback[0].filename not in _IGNORED_FILES
+            ]
+            for stat in stats[:self.top]:
+                frame = stat.traceback[0]
+                rows.append({
+                    "Stage": stage,
+                    "Location": f"{frame.filename}:{frame.lineno}",
+                    "Allocated (KiB)": round(stat.size_diff / 1024, 1),
+                    "Blocks": stat.count_diff,
+                })
+        return pd.DataFrame(rows, columns=["Stage", "Location", "Allocated (KiB)", "Blocks"])
+
+    def write(self, directory):
+        """Write profile.folded and allocations.csv, return their paths."""
+        os.makedirs(directory, exist_ok=True)
+        folded = os.path.join(directory, "profile.folded")
+        with open(folded, "w") as f:
+            f.write(self.folded())
+        allocations = os.path.join(directory, "allocations.csv")
+        self.allocations().to_csv(allocations, index=False)
+        return folded, allocations
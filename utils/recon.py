@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from utils.helpers import lazy_import
+from utils.order_keys import build_order_indexes
+
+pd = lazy_import("pandas")
+
+RECON_COLUMNS = [
+    "Order Ref", "Date", "Country", "VAT %",
+    "VAT % (Old)", "Diff", "In ITSP?",
+    "Cancelled", "Gift card", "Gift card 2",
+    "ITSP Sales", "ITSP Return", "Total ITSP",
+    "Shopify Sales", "Shopify Return",
+    "Total Shopify", "Delta", "Comment"
+]
+
+
+def tax_rates(tax) -> pd.Series:
+    """
+    Mean Shopify tax rate per order over its tax lines, as AVERAGEIFS
+    takes it. Rows of the summary profile stand for "Lines" lines each.
+    """
+    df = tax.df
+    if "Rate" not in df.columns:
+        return pd.Series(dtype=float)
+    rates = pd.to_numeric(df["Rate"], errors="coerce")
+    lines = pd.to_numeric(df["Lines"], errors="coerce") if "Lines" in df.columns else 1.0
+    lines = pd.Series(lines, index=df.index).where(rates.notna())
+    return tax.aggregate(rates * lines) / tax.aggregate(lines)
+
+
+def build_recon_frame(sheets: dict, indexes: dict = None) -> pd.DataFrame:
+    """
+    One row per order found in Shopify, ITSP sales or ITSP returns.
+
+    Mirrors the formulas of the full Recon sheet (see
+    utils.excel.fill_reconciliation_formulas), computed per order from
+    the order key indexes instead of per-cell lookups.
+    """
+    if indexes is None:
+        indexes = build_order_indexes(sheets)
+
+    shopify = indexes["Shopify incl. returns"]
+    tax = indexes["Shopify Tax"]
+    itsp_sales = indexes["ITSP Sales"]
+    itsp_returns = indexes["ITSP Returns"]
+    old_itsp = indexes["Old ITSP"]
+
+    orders = sorted(
+        set(shopify.positions) | set(itsp_sales.positions) | set(itsp_returns.positions)
+    )
+    if not orders:
+        return pd.DataFrame(columns=RECON_COLUMNS)
+
+    recon = pd.DataFrame(index=pd.Index(orders, name="Order key"))
+
+    # Display the order as Shopify (or ITSP) spells it
+    recon["Order Ref"] = (
+        shopify.labels().reindex(orders)
+        .fillna(itsp_sales.labels().reindex(orders))
+        .fillna(pd.Series(orders, index=orders))
+    )
+
+    recon["Date"] = (
+        shopify.aggregate("Date", "max").reindex(orders)
+        .fillna(itsp_sales.aggregate("Date", "max").reindex(orders))
+    )
+    recon["Country"] = None
+
+    # -------------------
+    # VAT
+    # -------------------
+    recon["VAT %"] = tax_rates(tax).reindex(orders).fillna(0)
+    # Old ITSP is looked up by its first row per order, like the VLOOKUPs
+    old_vat = pd.to_numeric(old_itsp.first("VAT %"), errors="coerce")
+    recon["VAT % (Old)"] = old_vat.reindex(orders).fillna(recon["VAT %"])
+    recon["Diff"] = recon["VAT %"] - recon["VAT % (Old)"]
+    recon["In ITSP?"] = ["Yes" if o in old_itsp else "No" for o in orders]
+
+    recon["Cancelled"] = None
+    recon["Gift card"] = None
+    recon["Gift card 2"] = None
+
+    # -------------------
+    # ITSP totals
+    # -------------------
+    sales_df = itsp_sales.df
+    if sales_df.empty:
+        recon["ITSP Sales"] = 0.0
+    else:
+        sales_total = (
+            sales_df["Shipping costs"].fillna(0)
+            + sales_df["Amount"].fillna(0)
+            + sales_df["VAT value"].fillna(0)
+        )
+        recon["ITSP Sales"] = itsp_sales.aggregate(sales_total).reindex(orders).fillna(0)
+
+    returns_df = itsp_returns.df
+    if returns_df.empty:
+        recon["ITSP Return"] = 0.0
+    else:
+        # The original order's shipping costs count when the whole order
+        # came back, VAT is the original order's, rounded (see
+        # utils.excel.add_itsp_returns_columns)
+        return_keys = itsp_returns.keys
+        old_qty = old_itsp.aggregate("Total Qty", "sum")
+        old_shipping = pd.to_numeric(old_itsp.first("Shipping costs"), errors="coerce")
+        full_return = returns_df["Quantity"].values == return_keys.map(old_qty).values
+        shipping = pd.Series(
+            return_keys.map(old_shipping).astype(float).fillna(0).values, index=returns_df.index
+        ).where(full_return, 0)
+        vat = return_keys.map(old_vat.round(2)).astype(float).fillna(0).values
+        return_total = (returns_df["Amount"].fillna(0) + shipping) * (1 + vat)
+        recon["ITSP Return"] = -itsp_returns.aggregate(return_total).reindex(orders).fillna(0)
+
+    recon["Total ITSP"] = (recon["ITSP Sales"] + recon["ITSP Return"]).round(2)
+
+    # -------------------
+    # Shopify totals
+    # -------------------
+    shopify_df = shopify.df
+    for col, sale_type in [("Shopify Sales", "order"), ("Shopify Return", "return")]:
+        if shopify_df.empty:
+            recon[col] = 0.0
+            continue
+        total = shopify_df["Total sales"].where(shopify_df["Sale type"] == sale_type, 0)
+        recon[col] = shopify.aggregate(total).reindex(orders).fillna(0)
+
+    recon["Total Shopify"] = (recon["Shopify Sales"] + recon["Shopify Return"]).round(2)
+    recon["Delta"] = recon["Total ITSP"] - recon["Total Shopify"]
+    recon["Comment"] = None
+
+    # Indexed by normalized order key
+    return recon[RECON_COLUMNS]
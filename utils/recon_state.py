@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import os
+import pickle
+import re
+
+from utils.helpers import lazy_import, private_dir, user_temp_dir
+from utils.order_keys import build_order_indexes
+from utils.recon import build_recon_frame
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Incremental reconciliation
+#
+# Every run stores a fingerprint per order of the inputs that feed its
+# Recon row, plus the Recon rows themselves. The next run for the same
+# period only recomputes the orders whose fingerprint changed.
+#
+# That saves the Recon aggregation only: every run still hashes every
+# row of every source (the whole Old ITSP history included), and the
+# workbook is written in full.
+# --------------------------------------------------
+STATE_DIR = os.environ.get("RECON_STATE_DIR", user_temp_dir("ecom_recon_state"))
+
+# Bump whenever build_recon_frame changes, so stored Recon rows of
+# unchanged orders are not served from before the change
+RECON_STATE_VERSION = 2
+
+FINGERPRINT_SOURCES = [
+    "Shopify incl. returns", "Shopify Tax", "ITSP Sales", "ITSP Returns", "Old ITSP",
+]
+
+CHANGES_COLUMNS = [
+    "Order Ref", "Change",
+    "Total ITSP (previous)", "Total ITSP",
+    "Total Shopify (previous)", "Total Shopify",
+    "Delta (previous)", "Delta",
+]
+
+
+def state_key(start_date, end_date, label="", shopify_profile="detail"):
+    raw = f"v{RECON_STATE_VERSION}_{start_date}_{end_date}_{label}"
+    # Summary and line-level Shopify rows fingerprint differently
+    if shopify_profile != "detail":
+        raw += f"_{shopify_profile}"
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", raw)
+
+
+def order_fingerprints(indexes: dict) -> pd.Series:
+    """One uint64 per order key, combining the hashes of its rows in every source."""
+    per_source = {}
+    for sheet in FINGERPRINT_SOURCES:
+        index = indexes[sheet]
+        if index.df.empty:
+            continue
+        row_hashes = pd.util.hash_pandas_object(index.df, index=False)
+        # Sum wraps around in uint64, so row order does not matter
+        per_source[sheet] = row_hashes.groupby(index.keys.values).sum()
+
+    if not per_source:
+        return pd.Series(dtype="uint64")
+
+    # Orders missing from a source count 0 there; reindexing with a fill
+    # value keeps the hashes uint64 (a NaN would turn them into floats)
+    keys = pd.Index(sorted(set().union(*(s.index for s in per_source.values()))))
+    combined = pd.DataFrame({
+        sheet: hashes.reindex(keys, fill_value=0) for sheet, hashes in per_source.items()
+    })
+    return pd.util.hash_pandas_object(combined, index=False)
+
+
+def load_state(key, state_dir=STATE_DIR):
+    path = os.path.join(private_dir(state_dir), f"{key}.pkl")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_state(key, fingerprints, recon_df, state_dir=STATE_DIR):
+    path = os.path.join(private_dir(state_dir), f"{key}.pkl")
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump({"fingerprints": fingerprints, "recon": recon_df}, f)
+    os.replace(path + ".tmp", path)
+
+
+def _subset_sheets(indexes, keys):
+    """Only the rows of each source that belong to ``keys``."""
+    subset = {}
+    for sheet, index in indexes.items():
+        positions = [index.positions[k] for k in keys if k in index.positions]
+        rows = np.sort(np.concatenate(positions)) if positions else []
+        subset[sheet] = index.df.iloc[rows]
+    return subset
+
+
+def incremental_recon(sheets: dict, key, indexes: dict = None, state_dir=STATE_DIR):
+    """
+    Recon for ``sheets`` reusing the previous run stored under ``key``.
+
+    Returns ``(recon_df, changes_df)``; ``changes_df`` lists the orders
+    that are new, changed or gone since the previous run (empty on the
+    first run).
+    """
+    if indexes is None:
+        indexes = build_order_indexes(sheets)
+
+    current = order_fingerprints(indexes)
+    previous = load_state(key, state_dir)
+
+    if previous is None:
+        recon_df = build_recon_frame(sheets, indexes)
+        save_state(key, current, recon_df, state_dir)
+        return recon_df, pd.DataFrame(columns=CHANGES_COLUMNS)
+
+    old_prints = previous["fingerprints"]
+    old_recon = previous["recon"]
+
+    aligned = old_prints.reindex(current.index)
+    changed = set(current.index[aligned.isna() | (aligned != current)])
+    removed = set(old_prints.index.difference(current.index))
+
+    recon_df = old_recon.drop(index=list(changed | removed), errors="ignore")
+    if changed:
+        fresh = build_recon_frame(_subset_sheets(indexes, changed))
+        recon_df = pd.concat([recon_df, fresh]).sort_index()
+
+    save_state(key, current, recon_df, state_dir)
+
+    # Only report orders whose Recon row actually moved
+    touched = sorted((changed | removed) & (set(old_recon.index) | set(recon_df.index)))
+    before = old_recon.reindex(touched)
+    after = recon_df.reindex(touched)
+    differs = ~(before.astype(str) == after.astype(str)).all(axis=1)
+    touched = list(before.index[differs])
+    before, after = before.loc[touched], after.loc[touched]
+    changes_df = pd.DataFrame({
+        "Order Ref": after["Order Ref"].fillna(before["Order Ref"]),
+        "Change": [
+            "Removed" if k not in recon_df.index
+            else "New" if k not in old_recon.index
+            else "Changed"
+            for k in touched
+        ],
+        "Total ITSP (previous)": before["Total ITSP"],
+        "Total ITSP": after["Total ITSP"],
+        "Total Shopify (previous)": before["Total Shopify"],
+        "Total Shopify": after["Total Shopify"],
+        "Delta (previous)": before["Delta"],
+        "Delta": after["Delta"],
+    }, index=touched)
+
+    return recon_df, changes_df[CHANGES_COLUMNS].reset_index(drop=True)
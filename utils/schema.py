@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from utils.helpers import lazy_import
+
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Per-sheet column schemas
+#
+# dtype:   "numeric" or "date"
+# decimal: decimal separator used by the source (numeric only)
+# format:  strftime format or "ISO8601" (date only)
+# --------------------------------------------------
+API_NUMBER = {"dtype": "numeric", "decimal": "."}
+SHEET_NUMBER = {"dtype": "numeric", "decimal": ","}
+ISO_DATE = {"dtype": "date", "format": "ISO8601"}
+
+SHEET_SCHEMAS = {
+    "Shopify payments": {
+        "Transaction ID": API_NUMBER,
+        "Date": ISO_DATE,
+        "Gross payments": API_NUMBER,
+        "Refunds": API_NUMBER,
+        "Net payments": API_NUMBER,
+    },
+    "Shopify incl. returns": {
+        "Order ID": API_NUMBER,
+        "Sale ID": API_NUMBER,
+        "Date": ISO_DATE,
+        "Net quantity": API_NUMBER,
+        "Gross sales": API_NUMBER,
+        "Discounts": API_NUMBER,
+        "Returns": API_NUMBER,
+        "Net sales": API_NUMBER,
+        "Shipping": API_NUMBER,
+        "Taxes": API_NUMBER,
+        "Total sales": API_NUMBER,
+    },
+    "Shopify Tax": {
+        "Sale tax ID": API_NUMBER,
+        "Order ID": API_NUMBER,
+        "Date": ISO_DATE,
+        "Rate": API_NUMBER,
+        "Amount": API_NUMBER,
+        # Summary profile only
+        "Lines": API_NUMBER,
+    },
+    "ITSP Sales": {
+        "Date": ISO_DATE,
+        "Shipping costs": API_NUMBER,
+        "Discount": API_NUMBER,
+        "Amount": API_NUMBER,
+        "VAT value": API_NUMBER,
+    },
+    "ITSP Returns": {
+        "Date": ISO_DATE,
+        "Return costs": API_NUMBER,
+        "Discount": API_NUMBER,
+        "Amount": API_NUMBER,
+        "Postage costs": API_NUMBER,
+    },
+    # Read back from the uploaded reference workbook as text
+    "Old ITSP": {
+        "Shipping costs": SHEET_NUMBER,
+        "Discount": SHEET_NUMBER,
+        "Amount": SHEET_NUMBER,
+        "VAT value": SHEET_NUMBER,
+        "Payment amount (LCY)": SHEET_NUMBER,
+        "Total Qty": SHEET_NUMBER,
+        "Subtotaal excl VAT": SHEET_NUMBER,
+        "Total incl. VAT": SHEET_NUMBER,
+        "VAT %": SHEET_NUMBER,
+    },
+}
+
+
+def apply_schema(df: pd.DataFrame, sheet: str) -> pd.DataFrame:
+    """
+    Parse the typed columns of ``sheet`` in ``df`` and return it.
+
+    Columns that already carry the target dtype are left alone, so the
+    schema can be applied again further down the pipeline at no cost.
+    """
+    schema = SHEET_SCHEMAS.get(sheet, {})
+    if df.empty or not schema:
+        return df
+
+    for col, spec in schema.items():
+        if col not in df.columns:
+            continue
+        s = df[col]
+
+        if spec["dtype"] == "numeric":
+            if pd.api.types.is_numeric_dtype(s):
+                continue
+            if spec["decimal"] != ".":
+                s = s.astype(str).str.replace(spec["decimal"], ".", regex=False)
+            df[col] = pd.to_numeric(s, errors="coerce")
+
+        elif spec["dtype"] == "date":
+            if pd.api.types.is_datetime64_any_dtype(s):
+                continue
+            df[col] = pd.to_datetime(s, format=spec["format"], errors="coerce")
+
+    return df
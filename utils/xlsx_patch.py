@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import posixpath
+import re
+import struct
+import zipfile
+import zlib
+from collections import namedtuple
+from io import BytesIO
+from xml.sax.saxutils import quoteattr, unescape
+
+from utils.excel import SHEET_ORDER, sheet_position
+from utils.xlsx_writer import (
+    STYLES_XML,
+    deflate,
+    filter_database_name,
+    rows_xml,
+    serialize_sheet,
+    sheet_parts,
+    shift_styles,
+    text_entry,
+    zip_package,
+)
+
+# --------------------------------------------------
+# Reference workbook patching
+#
+# Instead of writing Backend and the whole Old ITSP history again, the
+# uploaded reference is copied entry by entry, still compressed. Only
+# the period sheets are added or replaced, Old ITSP gets this period's
+# new orders spliced into its XML, and the styles of the generated
+# sheets are appended to the reference's, their ids shifted by the
+# number of styles it already had.
+# --------------------------------------------------
+KEPT_SHEETS = ["Backend", "Old ITSP"]
+APPENDED_SHEET = "Old ITSP"
+
+# The sheet rows are appended to is compressed again; favour speed
+SPLICE_LEVEL = 1
+
+REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+REL_OFFICE_DOCUMENT = f"{REL}/officeDocument"
+REL_WORKSHEET = f"{REL}/worksheet"
+REL_STYLES = f"{REL}/styles"
+REL_CALC_CHAIN = f"{REL}/calcChain"
+WORKSHEET_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+
+ReferenceStyles = namedtuple("ReferenceStyles", ["xml", "offset"])
+
+# Style collections merged, with the element each one holds
+_STYLE_COLLECTIONS = [
+    ("numFmts", "numFmt"), ("fonts", "font"), ("fills", "fill"),
+    ("borders", "border"), ("cellXfs", "xf"),
+]
+
+
+def _attr(element, name):
+    m = re.search(rf'\s{name}="([^"]*)"', element)
+    return unescape(m.group(1), {"&quot;": '"', "&apos;": "'"}) if m else None
+
+
+def _children(xml, collection, child):
+    """Elements of the ``collection`` block of ``xml`` (None if absent)."""
+    m = re.search(rf"<{collection}\b[^>]*/>|<{collection}\b[^>]*>(.*?)</{collection}>", xml, re.S)
+    if m is None:
+        return None
+    return re.findall(rf"<{child}\b[^>]*/>|<{child}\b[^>]*>.*?</{child}>", m.group(1) or "", re.S)
+
+
+def _replace_collection(xml, collection, children):
+    block = f'<{collection} count="{len(children)}">{"".join(children)}</{collection}>'
+    pattern = rf"<{collection}\b[^>]*/>|<{collection}\b[^>]*>.*?</{collection}>"
+    if re.search(pattern, xml, re.S):
+        return re.sub(pattern, lambda _: block, xml, count=1, flags=re.S)
+    # Only numFmts may be missing; it comes first in the stylesheet
+    return re.sub(r"(<styleSheet\b[^>]*>)", lambda m: m.group(1) + block, xml, count=1)
+
+
+# -------------------
+# Styles
+# -------------------
+def merge_styles(reference_xml: str) -> ReferenceStyles:
+    """
+    The reference's styles.xml with the generated sheets' styles
+    appended; cell style ``n`` of utils.xlsx_writer becomes
+    ``n + offset``.
+    """
+    ours = {c: _children(STYLES_XML, c, e) for c, e in _STYLE_COLLECTIONS}
+    theirs = {c: _children(reference_xml, c, e) for c, e in _STYLE_COLLECTIONS}
+    for collection in ["fonts", "fills", "borders", "cellXfs"]:
+        if not theirs[collection]:
+            raise ValueError(f"The reference workbook's styles have no {collection}")
+    theirs["numFmts"] = theirs["numFmts"] or []
+
+    # Custom number formats get ids after the reference's own
+    next_id = max([163, *(int(_attr(f, "numFmtId")) for f in theirs["numFmts"])]) + 1
+    format_ids = {}
+    for fmt in ours["numFmts"]:
+        format_ids[_attr(fmt, "numFmtId")] = str(next_id)
+        next_id += 1
+
+    def shift(fmt_or_xf):
+        def repl(m):
+            key, value = m.group(1), m.group(2)
+            if key == "numFmtId":
+                value = format_ids.get(value, value)
+            else:
+                value = str(int(value) + len(theirs[key.replace("Id", "s")]))
+            return f'{key}="{value}"'
+        return re.sub(r'\b(numFmtId|fontId|fillId|borderId)="(\d+)"', repl, fmt_or_xf)
+
+    merged = reference_xml
+    for collection, _ in _STYLE_COLLECTIONS:
+        merged = _replace_collection(
+            merged, collection, theirs[collection] + [shift(e) for e in ours[collection]]
+        )
+    return ReferenceStyles(merged, len(theirs["cellXfs"]))
+
+
+# -------------------
+# Package parts
+# -------------------
+def _raw_entry(reference: bytes, info: zipfile.ZipInfo):
+    """An entry of the reference as it is stored, without decompressing it."""
+    if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        raise ValueError(f"Unsupported zip entry in the reference workbook: {info.filename}")
+    name_len, extra_len = struct.unpack_from("<HH", reference, info.header_offset + 26)
+    start = info.header_offset + 30 + name_len + extra_len
+    data = reference[start:start + info.compress_size]
+    return info.filename, data, info.CRC, info.file_size, info.compress_type
+
+
+def _relationships(xml, base):
+    """``{Id: (Type, part path)}`` of a .rels part, targets resolved from ``base``."""
+    rels = {}
+    for element in re.findall(r"<Relationship\b[^>]*/>", xml):
+        target = _attr(element, "Target")
+        if _attr(element, "TargetMode") != "External":
+            target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(
+                posixpath.join(base, target)
+            )
+        rels[_attr(element, "Id")] = (_attr(element, "Type"), target)
+    return rels
+
+
+def _rels_path(part):
+    return posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+
+
+def reference_styles(reference: bytes) -> ReferenceStyles:
+    with zipfile.ZipFile(BytesIO(reference)) as zf:
+        workbook_path, rels, _ = _workbook_parts(zf)
+        styles = [path for kind, path in rels.values() if kind == REL_STYLES]
+        if not styles:
+            raise ValueError("The reference workbook has no styles part")
+        return merge_styles(zf.read(styles[0]).decode("utf-8"))
+
+
+def _workbook_parts(zf):
+    """Path of the workbook part, its relationships and their raw XML."""
+    root = _relationships(zf.read("_rels/.rels").decode("utf-8"), "")
+    workbook_path = next(path for kind, path in root.values() if kind == REL_OFFICE_DOCUMENT)
+    rels_xml = zf.read(_rels_path(workbook_path)).decode("utf-8")
+    return workbook_path, _relationships(rels_xml, posixpath.dirname(workbook_path)), rels_xml
+
+
+# -------------------
+# Appending rows
+# -------------------
+def _row_number(xml: bytes, end):
+    """Number of the last row before ``end`` (0 if there is none)."""
+    start = xml.rfind(b"<row", 0, end)
+    if start < 0:
+        return 0
+    m = re.match(rb'<row\b[^>]*?\sr="(\d+)"', xml[start:xml.index(b">", start) + 1])
+    # Rows without r are numbered one after the other
+    return int(m.group(1)) if m else len(re.findall(rb"<row\b", xml[:end]))
+
+
+def append_rows(xml: bytes, df, style_offset=0):
+    """
+    Splice the rows of ``df`` at the end of a worksheet's sheetData and
+    extend its dimension and autofilter. Returns ``(xml, filter_ref)``.
+    """
+    empty = re.search(rb"<sheetData\s*/>", xml)
+    if empty:
+        xml = xml[:empty.start()] + b"<sheetData></sheetData>" + xml[empty.end():]
+    end = xml.rfind(b"</sheetData>")
+    if end < 0:
+        raise ValueError("Worksheet without sheetData")
+
+    last = _row_number(xml, end)
+    rows = shift_styles("".join(rows_xml(df, last + 1)).encode("utf-8"), style_offset)
+    new_last = last + len(df)
+    head, tail = xml[:end], xml[end:]
+
+    def extend(m):
+        return m.group(1) + str(max(int(m.group(2)), new_last)).encode()
+
+    # The dimension comes before sheetData, no need to scan the rows
+    start = head.find(b"<sheetData")
+    head = re.sub(
+        rb'(<dimension ref="[A-Z]+\d+:[A-Z]+)(\d+)', extend, head[:start], count=1
+    ) + head[start:]
+    tail, n = re.subn(rb'(<autoFilter ref="[A-Z]+\d+:[A-Z]+)(\d+)', extend, tail, count=1)
+    filter_ref = None
+    if n:
+        filter_ref = re.search(rb'<autoFilter ref="([^"]+)"', tail).group(1).decode()
+    return head + rows + tail, filter_ref
+
+
+# -------------------
+# Workbook
+# -------------------
+def patch_workbook(reference: bytes, parts, appends=None, styles=None) -> BytesIO:
+    """
+    The reference workbook with ``parts`` (utils.xlsx_writer SheetParts,
+    serialized with ``styles.offset``) added or replacing the sheets of
+    the same name, and the rows of ``appends`` (``{sheet: DataFrame}``)
+    appended to existing sheets. Every other part is copied as stored.
+    """
+    styles = styles or reference_styles(reference)
+    zf = zipfile.ZipFile(BytesIO(reference))
+    workbook_path, rels, rels_xml = _workbook_parts(zf)
+    workbook_dir = posixpath.dirname(workbook_path)
+    workbook = zf.read(workbook_path).decode("utf-8")
+    content_types = zf.read("[Content_Types].xml").decode("utf-8")
+
+    sheet_elements = re.findall(r"<sheet\b[^>]*/>", workbook)
+    rid_attr = re.search(r"\s(\w+:id)=", sheet_elements[0]).group(1) if sheet_elements else "r:id"
+    names = [_attr(e, "name") for e in sheet_elements]
+    paths = {name: rels[_attr(e, rid_attr)][1] for name, e in zip(names, sheet_elements)}
+
+    replaced, dropped, filters = {}, set(), {}
+    new_rels, new_types = [], []
+    next_sheet_id = max([0, *(int(_attr(e, "sheetId")) for e in sheet_elements)]) + 1
+    next_rid = max([0, *(int(i[3:]) for i in rels if re.fullmatch(r"rId\d+", i))]) + 1
+
+    for part in parts:
+        if part is None:
+            continue
+        filters[part.name] = part.filter_ref
+        if part.name in paths:
+            path = paths[part.name]
+            # The new sheet refers to nothing (drawings, tables...)
+            dropped.add(_rels_path(path))
+        else:
+            n = len(paths) + 1
+            while posixpath.join(workbook_dir, "worksheets", f"sheet{n}.xml") in zf.NameToInfo:
+                n += 1
+            path = posixpath.join(workbook_dir, "worksheets", f"sheet{n}.xml")
+            paths[part.name] = path
+            rid = f"rId{next_rid}"
+            next_rid += 1
+            names.append(part.name)
+            sheet_elements.append(
+                f'<sheet name={quoteattr(part.name)} sheetId="{next_sheet_id}" {rid_attr}="{rid}"/>'
+            )
+            next_sheet_id += 1
+            new_rels.append(
+                f'<Relationship Id="{rid}" Type="{REL_WORKSHEET}" '
+                f'Target="{posixpath.relpath(path, workbook_dir)}"/>'
+            )
+            new_types.append(f'<Override PartName="/{path}" ContentType="{WORKSHEET_CONTENT_TYPE}"/>')
+        replaced[path] = (path, part.data, part.crc, part.size)
+
+    for sheet, df in (appends or {}).items():
+        if df.empty:
+            continue
+        if sheet not in paths:
+            raise ValueError(f"The reference workbook has no {sheet!r} sheet to append to")
+        xml, filter_ref = append_rows(zf.read(paths[sheet]), df, styles.offset)
+        replaced[paths[sheet]] = (paths[sheet], deflate(xml, SPLICE_LEVEL), zlib.crc32(xml), len(xml))
+        if filter_ref:
+            filters[sheet] = filter_ref
+
+    # Formulas changed: drop the calculation chain, Excel recalculates
+    for rid, (kind, path) in rels.items():
+        if kind == REL_CALC_CHAIN:
+            dropped.add(path)
+            rels_xml = re.sub(rf'<Relationship\b[^>]*\sId="{rid}"[^>]*/>', "", rels_xml)
+            content_types = re.sub(rf'<Override\b[^>]*PartName="/{re.escape(path)}"[^>]*/>', "", content_types)
+        elif kind == REL_STYLES:
+            replaced[path] = text_entry(path, styles.xml)
+
+    order = _tab_order(names)
+    position = {old: new for new, old in enumerate(order)}
+    workbook = _patch_workbook_xml(workbook, [sheet_elements[i] for i in order], names, position, filters)
+
+    rels_xml = rels_xml.replace("</Relationships>", "".join(new_rels) + "</Relationships>")
+    content_types = content_types.replace("</Types>", "".join(new_types) + "</Types>")
+    replaced[workbook_path] = text_entry(workbook_path, workbook)
+    replaced[_rels_path(workbook_path)] = text_entry(_rels_path(workbook_path), rels_xml)
+    replaced["[Content_Types].xml"] = text_entry("[Content_Types].xml", content_types)
+
+    entries = []
+    for info in zf.infolist():
+        if info.filename in dropped:
+            continue
+        entry = replaced.pop(info.filename, None)
+        entries.append(entry or _raw_entry(reference, info))
+    entries.extend(replaced.values())
+    return zip_package(entries)
+
+
+def _tab_order(names):
+    """
+    Sheet indexes in tab order: the sheets of SHEET_ORDER in that order,
+    each other sheet (notes, pivots...) right after the one it followed.
+    """
+    known = sorted((i for i, name in enumerate(names) if name in SHEET_ORDER),
+                   key=lambda i: sheet_position(names[i]))
+    followers, anchor = {}, None
+    for i, name in enumerate(names):
+        if name in SHEET_ORDER:
+            anchor = i
+        else:
+            followers.setdefault(anchor, []).append(i)
+
+    order = followers.get(None, [])
+    for i in known:
+        order += [i, *followers.get(i, [])]
+    return order
+
+
+def _patch_workbook_xml(workbook, sheet_elements, names, position, filters):
+    """Reorder the sheets, remap sheet indexes and renew autofilter names."""
+    def remap(m):
+        return f'{m.group(1)}="{position[int(m.group(2))]}"'
+
+    workbook = re.sub(
+        r"<sheets>.*?</sheets>|<sheets/>", lambda _: f"<sheets>{''.join(sheet_elements)}</sheets>",
+        workbook, count=1, flags=re.S,
+    )
+    workbook = re.sub(r'\b(activeTab)="(\d+)"', remap, workbook)
+    workbook = re.sub(r'\bfirstSheet="\d+"', 'firstSheet="0"', workbook)
+
+    defined = []
+    for element in re.findall(r"<definedName\b[^>]*/>|<definedName\b[^>]*>.*?</definedName>", workbook, re.S):
+        local = _attr(element, "localSheetId")
+        if local is not None:
+            if _attr(element, "name") == "_xlnm._FilterDatabase" and names[int(local)] in filters:
+                continue
+            element = re.sub(r'\b(localSheetId)="(\d+)"', remap, element)
+        defined.append(element)
+    for sheet, ref in filters.items():
+        if ref:
+            defined.append(filter_database_name(sheet, position[names.index(sheet)], ref))
+
+    block = f"<definedNames>{''.join(defined)}</definedNames>" if defined else ""
+    if re.search(r"<definedNames\b", workbook):
+        workbook = re.sub(
+            r"<definedNames\b[^>]*>.*?</definedNames>|<definedNames\b[^>]*/>", lambda _: block,
+            workbook, count=1, flags=re.S,
+        )
+    elif block:
+        anchor = "</externalReferences>" if "</externalReferences>" in workbook else "</sheets>"
+        workbook = workbook.replace(anchor, anchor + block, 1)
+
+    if "<calcPr" not in workbook:
+        workbook = workbook.replace("</workbook>", '<calcPr fullCalcOnLoad="1"/></workbook>')
+    elif "fullCalcOnLoad" not in workbook:
+        workbook = workbook.replace("<calcPr", '<calcPr fullCalcOnLoad="1"', 1)
+    return workbook
+
+
+def patch_reference(reference: bytes, sheets: dict, recon_df, appends=None) -> BytesIO:
+    """
+    utils.excel.export_to_excel as a patch of the reference: the period
+    sheets of ``sheets`` and the Recon are written, the KEPT_SHEETS only
+    get ``appends``.
+    """
+    styles = reference_styles(reference)
+    period = {sheet: df for sheet, df in sheets.items() if sheet not in KEPT_SHEETS}
+    parts = list(sheet_parts(period, styles.offset).values())
+    parts.append(serialize_sheet("Recon", recon_df, as_table=False, style_offset=styles.offset))
+    return patch_workbook(reference, parts, appends, styles)
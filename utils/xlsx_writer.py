@@ -0,0 +1,575 @@
+from __future__ import annotations
+
+import datetime as dt
+import math
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import types
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from xml.sax.saxutils import escape, quoteattr
+
+from utils.excel import (
+    LIGHT_BLUE,
+    LIGHT_GREEN,
+    LIGHT_ORANGE,
+    NUMBER_FORMAT,
+    TAB_COLORS,
+    sheet_position,
+)
+from utils.frame_handoff import open_frame, release_frame, share_frame, sweep_stale_frames
+from utils.helpers import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# --------------------------------------------------
+# Direct xlsx writer
+#
+# Each worksheet's XML is generated and deflated on its own, in worker
+# processes, and the package is then zipped together from the finished
+# parts. Cells use inline strings and a fixed style table, so sheets do
+# not share any state while they are written. The output matches what
+# pandas + openpyxl produce for the same sheets (see utils.excel).
+# --------------------------------------------------
+SheetPart = namedtuple("SheetPart", ["name", "data", "crc", "size", "filter_ref"])
+
+# Style ids, i.e. positions in cellXfs of STYLES_XML
+DEFAULT = 0
+HEADER = 1           # pandas header: bold, thin border, centered
+BOLD = 2
+DATETIME = 3         # pandas datetime cells
+DATE = 4             # pandas date cells
+APPEND_DATETIME = 5  # openpyxl ws.append datetime cells
+NUMBER = 6
+DAY_MONTH_YEAR = 7
+FILL_STYLES = {LIGHT_ORANGE: 8, LIGHT_BLUE: 9, LIGHT_GREEN: 10}
+
+STYLES_XML = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="4">
+<numFmt numFmtId="164" formatCode="YYYY-MM-DD HH:MM:SS"/>
+<numFmt numFmtId="165" formatCode="YYYY-MM-DD"/>
+<numFmt numFmtId="166" formatCode="yyyy-mm-dd h:mm:ss"/>
+<numFmt numFmtId="167" formatCode="dd/mm/yyyy"/>
+</numFmts>
+<fonts count="2">
+<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>
+<font><b/><sz val="11"/><name val="Calibri"/><family val="2"/></font>
+</fonts>
+<fills count="5">
+<fill><patternFill/></fill>
+<fill><patternFill patternType="gray125"/></fill>
+<fill><patternFill patternType="solid"><fgColor rgb="00{LIGHT_ORANGE}"/><bgColor rgb="00{LIGHT_ORANGE}"/></patternFill></fill>
+<fill><patternFill patternType="solid"><fgColor rgb="00{LIGHT_BLUE}"/><bgColor rgb="00{LIGHT_BLUE}"/></patternFill></fill>
+<fill><patternFill patternType="solid"><fgColor rgb="00{LIGHT_GREEN}"/><bgColor rgb="00{LIGHT_GREEN}"/></patternFill></fill>
+</fills>
+<borders count="2">
+<border><left/><right/><top/><bottom/><diagonal/></border>
+<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>
+</borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="11">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="top"/></xf>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="166" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="167" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="0" fontId="0" fillId="2" borderId="0" xfId="0" applyFill="1"/>
+<xf numFmtId="0" fontId="0" fillId="3" borderId="0" xfId="0" applyFill="1"/>
+<xf numFmtId="0" fontId="0" fillId="4" borderId="0" xfId="0" applyFill="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+assert NUMBER_FORMAT == "#,##0.00"  # built-in numFmtId 4
+
+# Formula columns appended after the data, per sheet: header, header
+# style, cell style and formula ({r} is the row). Mirrors the
+# add_*_columns functions of utils.excel.
+FORMULA_COLUMNS = {
+    "Shopify incl. returns": [
+        ("CHECK", FILL_STYLES[LIGHT_ORANGE], FILL_STYLES[LIGHT_ORANGE], "SUM(S{r}:U{r})-V{r}"),
+        ("Country code", FILL_STYLES[LIGHT_BLUE], FILL_STYLES[LIGHT_BLUE],
+         'IF(I{r}="",VLOOKUP(H{r},Backend!E:F,2,0),VLOOKUP(I{r},Backend!E:F,2,0))'),
+    ],
+    "Shopify payments": [
+        ("Year", FILL_STYLES[LIGHT_GREEN], DEFAULT, "YEAR(B{r})"),
+        ("Month", FILL_STYLES[LIGHT_GREEN], DEFAULT, "MONTH(B{r})"),
+    ],
+    "ITSP Sales": [
+        ("Total EUR incl. VAT", FILL_STYLES[LIGHT_BLUE], NUMBER, "H{r}+P{r}+Q{r}"),
+        ("VAT %", FILL_STYLES[LIGHT_BLUE], NUMBER, "Q{r}/(H{r}+P{r})"),
+        ("Date", FILL_STYLES[LIGHT_BLUE], DAY_MONTH_YEAR, "B{r}"),
+    ],
+    "ITSP Returns": [
+        ("Date", FILL_STYLES[LIGHT_BLUE], DAY_MONTH_YEAR, "B{r}"),
+        ("Shipping cost original order", FILL_STYLES[LIGHT_BLUE], DEFAULT,
+         "VLOOKUP(H{r},'Old ITSP'!F:H,3,0)"),
+        ("Shipping cost return", FILL_STYLES[LIGHT_BLUE], DEFAULT,
+         "IF(K{r}=SUMIFS('Old ITSP'!W:W,'Old ITSP'!F:F,H{r}),O{r},0)"),
+        ("VAT %", FILL_STYLES[LIGHT_BLUE], DEFAULT, "ROUND(VLOOKUP(H{r},'Old ITSP'!F:Z,21,0),2)"),
+        ("Total EUR incl. VAT", FILL_STYLES[LIGHT_BLUE], DEFAULT, "(L{r}+P{r})*(1+Q{r})"),
+        ("Check", FILL_STYLES[LIGHT_ORANGE], DEFAULT, "VLOOKUP(H{r},'ITSP Sales'!F:F,1,0)"),
+    ],
+}
+
+EXCEL_EPOCH = dt.datetime(1899, 12, 30)
+_ILLEGAL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+)
+
+
+def column_letter(index):
+    """1 -> A, 27 -> AA."""
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+# -------------------
+# Cell values
+# -------------------
+def _string(value, style=DEFAULT):
+    text = escape(_ILLEGAL_CHARS.sub("", value))
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    s = f' s="{style}"' if style else ""
+    return f'{s} t="inlineStr"><is><t{space}>{text}</t></is></c>'
+
+
+def _number(value, style=DEFAULT):
+    s = f' s="{style}"' if style else ""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if math.isinf(value):
+            return _string("inf" if value > 0 else "-inf", style)
+        if value.is_integer() and abs(value) < 1e15:
+            value = int(value)
+    return f"{s}><v>{value!r}</v></c>" if isinstance(value, float) else f"{s}><v>{value}</v></c>"
+
+
+def _serial(value):
+    return (value - EXCEL_EPOCH).total_seconds() / 86400
+
+
+def _cell(value, datetime_style):
+    """Fragment after ``<c r="A1"`` for any Python value (None: no cell)."""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, str):
+        # Excel has no empty string cells, openpyxl leaves them out too
+        return _string(value) if value else None
+    if isinstance(value, (bool, np.bool_)):
+        return f' t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return _number(int(value))
+    if isinstance(value, (float, np.floating)):
+        return _number(float(value))
+    if isinstance(value, dt.datetime):
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None)
+        return _number(_serial(value), datetime_style)
+    if isinstance(value, dt.date):
+        return _number(_serial(dt.datetime.combine(value, dt.time())), DATE)
+    return _string(str(value))
+
+
+def _column_cells(series, datetime_style):
+    """One fragment per row of ``series``, built per dtype where possible."""
+    if not isinstance(series.dtype, np.dtype):
+        # Extension dtypes (nullable ints, tz-aware datetimes...) go cell by cell
+        return [_cell(v, datetime_style) for v in series.astype(object).tolist()]
+    kind = series.dtype.kind
+    if kind == "M":
+        serials = (series - pd.Timestamp(EXCEL_EPOCH)) / pd.Timedelta(days=1)
+        return [_number(v, datetime_style) for v in serials.tolist()]
+    if kind in "iu":
+        return [f"><v>{v}</v></c>" for v in series.tolist()]
+    if kind == "f":
+        return [_number(v) for v in series.tolist()]
+    if kind == "b":
+        return [f' t="b"><v>{int(v)}</v></c>' for v in series.tolist()]
+    return [_cell(v, datetime_style) for v in series.tolist()]
+
+
+# -------------------
+# Worksheets
+# -------------------
+def rows_xml(df, first_row, formulas=(), datetime_style=DATETIME):
+    """``<row>`` elements of ``df``, numbered from ``first_row``."""
+    parts = []
+    letters = [column_letter(i) for i in range(1, len(df.columns) + len(formulas) + 1)]
+    columns = [_column_cells(df.iloc[:, i], datetime_style) for i in range(len(df.columns))]
+    data_letters = letters[:len(df.columns)]
+    formula_letters = letters[len(df.columns):]
+    for i, cells in enumerate(zip(*columns) if columns else ([()] * len(df))):
+        r = str(i + first_row)
+        parts.append(f'<row r="{r}">')
+        parts.extend(f'<c r="{l}{r}"{c}' for l, c in zip(data_letters, cells) if c is not None)
+        for l, (_, _, style, formula) in zip(formula_letters, formulas):
+            s = f' s="{style}"' if style else ""
+            parts.append(f'<c r="{l}{r}"{s}><f>{escape(formula.format(r=r))}</f><v></v></c>')
+        parts.append("</row>")
+    return parts
+
+
+_CELL_STYLE = re.compile(rb'(<c r="[A-Z]+\d+" s=")(\d+)"')
+
+
+def shift_styles(xml: bytes, offset):
+    """Move the cell style ids of generated XML by ``offset`` (see utils.xlsx_patch)."""
+    if not offset:
+        return xml
+    return _CELL_STYLE.sub(lambda m: m.group(1) + str(int(m.group(2)) + offset).encode() + b'"', xml)
+
+
+def sheet_head(sheet, columns, n_rows, as_table=True):
+    """
+    Worksheet XML up to the first data row, and the autofilter range
+    (None without one). See sheet_xml() for ``as_table``.
+    """
+    formulas = FORMULA_COLUMNS.get(sheet, []) if as_table else []
+    n_cols = len(columns) + len(formulas)
+    letters = [column_letter(i) for i in range(1, n_cols + 1)]
+    last_ref = f"{letters[-1]}{n_rows + 1}" if n_cols else "A1"
+    filter_ref = f"A1:{last_ref}" if as_table and n_cols else None
+
+    parts = [SHEET_HEADER]
+    color = TAB_COLORS.get(sheet)
+    if color:
+        parts.append(f'<sheetPr><tabColor rgb="00{color}"/></sheetPr>')
+    parts.append(f'<dimension ref="A1:{last_ref}"/>')
+    parts.append('<sheetViews><sheetView workbookViewId="0"/></sheetViews>')
+    parts.append('<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>')
+    parts.append("<sheetData>")
+
+    header_style = HEADER if as_table else BOLD
+    header = [_string(str(c), header_style) for c in columns]
+    header += [_string(name, style) for name, style, _, _ in formulas]
+    parts.append('<row r="1">')
+    parts.extend(f'<c r="{l}1"{h}' for l, h in zip(letters, header))
+    parts.append("</row>")
+    return "".join(parts), filter_ref
+
+
+def sheet_tail(filter_ref):
+    """Worksheet XML after the last data row."""
+    parts = ["</sheetData>"]
+    if filter_ref:
+        parts.append(f'<autoFilter ref="{filter_ref}"/>')
+    parts.append('<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/>')
+    parts.append("</worksheet>")
+    return "".join(parts)
+
+
+def sheet_xml(sheet, df, as_table=True):
+    """
+    Worksheet XML for ``df``.
+
+    ``as_table`` writes it the way DataFrame.to_excel does (bordered
+    header, autofilter, plus the sheet's formula columns); otherwise as
+    plain appended rows with a bold header, like the Recon sheet.
+    """
+    formulas = FORMULA_COLUMNS.get(sheet, []) if as_table else []
+    datetime_style = DATETIME if as_table else APPEND_DATETIME
+    head, filter_ref = sheet_head(sheet, df.columns, len(df), as_table)
+    parts = [head, *rows_xml(df, 2, formulas, datetime_style), sheet_tail(filter_ref)]
+    return "".join(parts).encode("utf-8"), filter_ref
+
+
+def deflate(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def sheet_part(sheet, df, as_table=True, style_offset=0):
+    """
+    Deflated worksheet, ready to be put in the package (runs in workers).
+    ``df`` may be a utils.frame_handoff.FrameFile.
+    """
+    df = open_frame(df)
+    data, filter_ref = sheet_xml(sheet, df, as_table)
+    data = shift_styles(data, style_offset)
+    return SheetPart(sheet, deflate(data), zlib.crc32(data), len(data), filter_ref)
+
+
+def stream_sheet_part(sheet, columns, n_rows, chunks, as_table=True, style_offset=0):
+    """
+    SheetPart of a sheet too large to hold as one frame: ``chunks``
+    yields its ``n_rows`` rows as DataFrames with ``columns``, and each
+    is turned into XML and deflated before the next is asked for.
+    Built in this process.
+    """
+    formulas = FORMULA_COLUMNS.get(sheet, []) if as_table else []
+    datetime_style = DATETIME if as_table else APPEND_DATETIME
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated, crc, size = [], 0, 0
+
+    def add(text):
+        nonlocal crc, size
+        data = shift_styles(text.encode("utf-8"), style_offset)
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        deflated.append(compressor.compress(data))
+
+    head, filter_ref = sheet_head(sheet, columns, n_rows, as_table)
+    add(head)
+    first_row = 2
+    for chunk in chunks:
+        add("".join(rows_xml(chunk, first_row, formulas, datetime_style)))
+        first_row += len(chunk)
+    add(sheet_tail(filter_ref))
+    deflated.append(compressor.flush())
+    return SheetPart(sheet, b"".join(deflated), crc, size, filter_ref)
+
+
+# -------------------
+# Worker processes
+#
+# A forkserver or spawn worker re-imports the parent's __main__ before it
+# runs anything. Under Streamlit that is the app script itself, which
+# would then run a whole page in every worker. Workers are started (the
+# pool starts them as tasks are submitted) with a bare __main__ instead.
+# -------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def process_pool():
+    """Shared pool of sheet writers, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            sweep_stale_frames()
+            # forkserver children do not inherit the parent's threads/locks
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=min(8, os.cpu_count() or 1), mp_context=context)
+        return _pool
+
+
+def submit(fn, *args):
+    """``process_pool().submit``, with the parent's __main__ out of the workers' reach."""
+    pool = process_pool()
+    with _pool_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            return pool.submit(fn, *args)
+        finally:
+            sys.modules["__main__"] = main
+
+
+def serialize_sheet(sheet, df, as_table=True, style_offset=0):
+    """SheetPart of ``df`` built in a worker process, None if it is empty."""
+    if df.empty and as_table:
+        return None
+    frame = share_frame(df)
+    try:
+        return submit(sheet_part, sheet, frame, as_table, style_offset).result()
+    finally:
+        release_frame(frame)
+
+
+def sheet_parts(sheets: dict, style_offset=0) -> dict:
+    """Serialize every non-empty sheet in parallel, as SheetParts by name."""
+    frames = {}
+    try:
+        for sheet, df in sheets.items():
+            if not df.empty:
+                frames[sheet] = share_frame(df)
+        futures = {
+            sheet: submit(sheet_part, sheet, frame, True, style_offset)
+            for sheet, frame in frames.items()
+        }
+        return {sheet: future.result() for sheet, future in futures.items()}
+    finally:
+        for frame in frames.values():
+            release_frame(frame)
+
+
+# -------------------
+# Package
+# -------------------
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/docProps/core.xml" '
+    'ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+    '<Override PartName="/docProps/app.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.extended-properties+xml"/>'
+    "{sheets}</Types>"
+)
+SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet{n}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" '
+    'Target="docProps/core.xml"/>'
+    '<Relationship Id="rId3" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/extended-properties" '
+    'Target="docProps/app.xml"/>'
+    "</Relationships>"
+)
+APP_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+    "<Application>Microsoft Excel</Application></Properties>"
+)
+CORE_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<cp:coreProperties '
+    'xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dcterms="http://purl.org/dc/terms/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<dcterms:created xsi:type="dcterms:W3CDTF">{now}</dcterms:created>'
+    "</cp:coreProperties>"
+)
+
+
+def filter_database_name(sheet, index, ref):
+    """Hidden defined name Excel keeps next to a sheet's autofilter."""
+    start, end = ref.split(":")
+    absolute = "$" + re.sub(r"(\d+)", r"$\1", start) + ":$" + re.sub(r"(\d+)", r"$\1", end)
+    quoted = "'" + sheet.replace("'", "''") + "'"
+    return (
+        f'<definedName name="_xlnm._FilterDatabase" localSheetId="{index}" hidden="1">'
+        f"{escape(quoted)}!{absolute}</definedName>"
+    )
+
+
+def _workbook_xml(parts):
+    sheets, names = [], []
+    for i, part in enumerate(parts):
+        sheets.append(f'<sheet name={quoteattr(part.name)} sheetId="{i + 1}" r:id="rId{i + 1}"/>')
+        if part.filter_ref:
+            names.append(filter_database_name(part.name, i, part.filter_ref))
+    defined = f"<definedNames>{''.join(names)}</definedNames>" if names else ""
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<bookViews><workbookView activeTab="0"/></bookViews>'
+        f"<sheets>{''.join(sheets)}</sheets>{defined}"
+        '<calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>'
+    )
+
+
+def _workbook_rels(parts):
+    rels = [
+        f'<Relationship Id="rId{i + 1}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i + 1}.xml"/>'
+        for i in range(len(parts))
+    ]
+    rels.append(
+        f'<Relationship Id="rId{len(parts) + 1}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f"{''.join(rels)}</Relationships>"
+    )
+
+
+def _dos_time(t):
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def zip_package(entries):
+    """
+    Zip ``(name, deflated, crc, size[, method])`` entries as they are;
+    the sheet parts were already compressed in the workers. ``method``
+    is the zip compression method of ``data`` (8, deflate, by default).
+    """
+    out = BytesIO()
+    mod_time, mod_date = _dos_time(time.localtime())
+    central = []
+    for name, data, crc, size, *method in entries:
+        method = method[0] if method else 8
+        if len(data) >= 0xFFFFFFFF or size >= 0xFFFFFFFF:
+            raise ValueError(f"{name} is too large for a zip without zip64")
+        encoded = name.encode("utf-8")
+        offset = out.tell()
+        out.write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, 20, 0, method, mod_time, mod_date,
+            crc, len(data), size, len(encoded), 0,
+        ))
+        out.write(encoded)
+        out.write(data)
+        central.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, 20, 20, 0, method, mod_time, mod_date,
+            crc, len(data), size, len(encoded), 0, 0, 0, 0, 0, offset,
+        ) + encoded)
+
+    start = out.tell()
+    for record in central:
+        out.write(record)
+    out.write(struct.pack(
+        "<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central),
+        out.tell() - start, start, 0,
+    ))
+    out.seek(0)
+    return out
+
+
+def text_entry(name, text):
+    data = text.encode("utf-8")
+    return name, deflate(data), zlib.crc32(data), len(data)
+
+
+def assemble_workbook(parts) -> BytesIO:
+    """xlsx package from SheetParts, tabs in utils.excel.SHEET_ORDER."""
+    parts = sorted((p for p in parts if p is not None), key=lambda p: sheet_position(p.name))
+    now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    entries = [
+        text_entry("[Content_Types].xml", CONTENT_TYPES.format(
+            sheets="".join(SHEET_CONTENT_TYPE.format(n=i + 1) for i in range(len(parts)))
+        )),
+        text_entry("_rels/.rels", ROOT_RELS),
+        text_entry("docProps/app.xml", APP_XML),
+        text_entry("docProps/core.xml", CORE_XML.format(now=now)),
+        text_entry("xl/workbook.xml", _workbook_xml(parts)),
+        text_entry("xl/_rels/workbook.xml.rels", _workbook_rels(parts)),
+        text_entry("xl/styles.xml", STYLES_XML),
+    ]
+    entries += [
+        (f"xl/worksheets/sheet{i + 1}.xml", p.data, p.crc, p.size)
+        for i, p in enumerate(parts)
+    ]
+    return zip_package(entries)